@@ -0,0 +1,21 @@
+-- Indexes for the query shapes in utils/table_operations.py.
+-- Check the plans with: python -m utils.index_advisor
+
+-- Rentals.add: WHERE film_id = ? AND return_date IS NULL
+-- Rentals.search / count_search: WHERE return_date IS [NOT] NULL ORDER BY rental_date
+-- (the unfiltered ORDER BY rental_date already uses the (rental_date, film_id, customer_id) unique key)
+ALTER TABLE rental
+  ADD INDEX idx_rental_film_return (film_id, return_date),
+  ADD INDEX idx_rental_return_date (return_date, rental_date);
+
+-- Payments.search: ORDER BY payment_date, optionally WHERE payment_method = ?
+-- Payments.get_analytics: GROUP BY month(payment_date) / payment_method with SUM(amount)
+-- Customers.top_spenders / top_customers_by_payment: GROUP BY customer_id with SUM(amount)
+ALTER TABLE payment
+  ADD INDEX idx_payment_date_amount (payment_date, amount),
+  ADD INDEX idx_payment_method_date (payment_method, payment_date, amount),
+  ADD INDEX idx_payment_customer_amount (customer_id, amount);
+
+-- Customers.list_customers: ORDER BY last_name, first_name
+ALTER TABLE customer
+  ADD INDEX idx_customer_name (last_name, first_name);
@@ -0,0 +1,25 @@
+-- One row per film that is currently rented out. The primary key on film_id
+-- makes a second concurrent rental of the same film fail with a duplicate key,
+-- and availability checks become a primary-key lookup instead of a scan of the
+-- film's rental history. Kept current by Rentals.add/return_film/update/delete.
+CREATE TABLE open_rentals (
+  film_id SMALLINT UNSIGNED NOT NULL,
+  rental_id INT NOT NULL,
+  customer_id SMALLINT UNSIGNED NOT NULL,
+  rental_date DATETIME NOT NULL,
+  PRIMARY KEY (film_id),
+  UNIQUE KEY uq_open_rentals_rental (rental_id),
+  CONSTRAINT fk_open_rentals_rental FOREIGN KEY (rental_id) REFERENCES rental (rental_id) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Backfill from rental. If historical data has several open rentals for one
+-- film, the most recent one holds the slot.
+INSERT INTO open_rentals (film_id, rental_id, customer_id, rental_date)
+SELECT r.film_id, r.rental_id, r.customer_id, r.rental_date
+FROM rental r
+JOIN (
+  SELECT film_id, MAX(rental_id) AS rental_id
+  FROM rental
+  WHERE return_date IS NULL
+  GROUP BY film_id
+) latest ON latest.rental_id = r.rental_id;
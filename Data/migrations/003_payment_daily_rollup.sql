@@ -0,0 +1,26 @@
+-- Day-level revenue rollup for the analytics dashboard.
+-- One row per (day, payment_method, country). Payments.add_payment,
+-- update_payment and delete_payment apply their deltas in the same
+-- transaction as the payment write. A payment without a method is stored
+-- under '' and one whose customer has no resolvable country under
+-- country_id 0, because both are part of the primary key.
+-- The country is the customer's country at the time the payment is written.
+CREATE TABLE payment_daily_rollup (
+  day DATE NOT NULL,
+  payment_method VARCHAR(25) NOT NULL DEFAULT '',
+  country_id SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+  total DECIMAL(12,2) NOT NULL DEFAULT 0,
+  payment_count INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (day, payment_method, country_id),
+  KEY idx_rollup_method_day (payment_method, day),
+  KEY idx_rollup_country_day (country_id, day)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+INSERT INTO payment_daily_rollup (day, payment_method, country_id, total, payment_count)
+SELECT DATE(p.payment_date), COALESCE(p.payment_method, ''), COALESCE(ci.country_id, 0),
+       SUM(p.amount), COUNT(*)
+FROM payment p
+LEFT JOIN customer c ON c.customer_id = p.customer_id
+LEFT JOIN address a ON a.address_id = c.address_id
+LEFT JOIN city ci ON ci.city_id = a.city_id
+GROUP BY DATE(p.payment_date), COALESCE(p.payment_method, ''), COALESCE(ci.country_id, 0);
@@ -0,0 +1,41 @@
+-- Change feed support (utils/change_feed.py).
+-- Every tracked table gets an index on last_update so "rows changed since the
+-- watermark" is a range scan, and deletes leave a row in row_tombstone.
+
+ALTER TABLE film     ADD INDEX idx_film_last_update (last_update);
+ALTER TABLE actor    ADD INDEX idx_actor_last_update (last_update);
+ALTER TABLE customer ADD INDEX idx_customer_last_update (last_update);
+ALTER TABLE address  ADD INDEX idx_address_last_update (last_update);
+ALTER TABLE city     ADD INDEX idx_city_last_update (last_update);
+ALTER TABLE country  ADD INDEX idx_country_last_update (last_update);
+ALTER TABLE payment  ADD INDEX idx_payment_last_update (last_update);
+ALTER TABLE rental   ADD INDEX idx_rental_last_update (last_update);
+
+CREATE TABLE row_tombstone (
+  tombstone_id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+  table_name VARCHAR(64) NOT NULL,
+  row_id INT UNSIGNED NOT NULL,
+  deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (tombstone_id),
+  KEY idx_tombstone_deleted_at (deleted_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Single-statement trigger bodies, so no DELIMITER is needed. Rows removed by
+-- a foreign key cascade do not fire triggers; none of the tracked tables is
+-- the child side of an ON DELETE CASCADE.
+DROP TRIGGER IF EXISTS trg_film_tombstone;
+CREATE TRIGGER trg_film_tombstone AFTER DELETE ON film FOR EACH ROW INSERT INTO row_tombstone (table_name, row_id) VALUES ('film', OLD.film_id);
+DROP TRIGGER IF EXISTS trg_actor_tombstone;
+CREATE TRIGGER trg_actor_tombstone AFTER DELETE ON actor FOR EACH ROW INSERT INTO row_tombstone (table_name, row_id) VALUES ('actor', OLD.actor_id);
+DROP TRIGGER IF EXISTS trg_customer_tombstone;
+CREATE TRIGGER trg_customer_tombstone AFTER DELETE ON customer FOR EACH ROW INSERT INTO row_tombstone (table_name, row_id) VALUES ('customer', OLD.customer_id);
+DROP TRIGGER IF EXISTS trg_address_tombstone;
+CREATE TRIGGER trg_address_tombstone AFTER DELETE ON address FOR EACH ROW INSERT INTO row_tombstone (table_name, row_id) VALUES ('address', OLD.address_id);
+DROP TRIGGER IF EXISTS trg_city_tombstone;
+CREATE TRIGGER trg_city_tombstone AFTER DELETE ON city FOR EACH ROW INSERT INTO row_tombstone (table_name, row_id) VALUES ('city', OLD.city_id);
+DROP TRIGGER IF EXISTS trg_country_tombstone;
+CREATE TRIGGER trg_country_tombstone AFTER DELETE ON country FOR EACH ROW INSERT INTO row_tombstone (table_name, row_id) VALUES ('country', OLD.country_id);
+DROP TRIGGER IF EXISTS trg_payment_tombstone;
+CREATE TRIGGER trg_payment_tombstone AFTER DELETE ON payment FOR EACH ROW INSERT INTO row_tombstone (table_name, row_id) VALUES ('payment', OLD.payment_id);
+DROP TRIGGER IF EXISTS trg_rental_tombstone;
+CREATE TRIGGER trg_rental_tombstone AFTER DELETE ON rental FOR EACH ROW INSERT INTO row_tombstone (table_name, row_id) VALUES ('rental', OLD.rental_id);
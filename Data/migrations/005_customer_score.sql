@@ -0,0 +1,38 @@
+-- Recency/frequency/monetary scores and a simple lifetime value per customer,
+-- written by Customers.refresh_scores(). Raw metrics are aggregated from
+-- payment and rental; r/f/m_score are quintiles (5 = best) over all scored
+-- customers. The indexes back the sort/filter options of /customers/top-spenders.
+CREATE TABLE customer_score (
+  customer_id SMALLINT UNSIGNED NOT NULL,
+  first_payment DATETIME NULL,
+  last_payment DATETIME NULL,
+  frequency INT NOT NULL DEFAULT 0,
+  monetary DECIMAL(10,2) NOT NULL DEFAULT 0,
+  rental_count INT NOT NULL DEFAULT 0,
+  recency_days INT NULL,
+  r_score TINYINT NOT NULL DEFAULT 0,
+  f_score TINYINT NOT NULL DEFAULT 0,
+  m_score TINYINT NOT NULL DEFAULT 0,
+  rfm_score SMALLINT NOT NULL DEFAULT 0,
+  segment VARCHAR(20) NOT NULL DEFAULT '',
+  ltv DECIMAL(10,2) NOT NULL DEFAULT 0,
+  scored_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (customer_id),
+  KEY idx_score_monetary (monetary),
+  KEY idx_score_ltv (ltv),
+  KEY idx_score_rfm (rfm_score, monetary),
+  KEY idx_score_recency (recency_days, monetary),
+  KEY idx_score_frequency (frequency, monetary),
+  KEY idx_score_segment (segment, monetary)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Customers whose payments or rentals changed since the last scoring run.
+-- Payment and rental writes add to it in their own transaction.
+CREATE TABLE customer_score_dirty (
+  customer_id SMALLINT UNSIGNED NOT NULL,
+  PRIMARY KEY (customer_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Everyone starts dirty, so the first refresh_scores() scores all customers.
+INSERT INTO customer_score_dirty (customer_id)
+SELECT customer_id FROM customer;
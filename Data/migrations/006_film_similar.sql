@@ -0,0 +1,21 @@
+-- "Customers who rented this also rented": the top-K most similar films per
+-- film, written by utils/similarity.py. Films.similar() reads one film's rows
+-- by primary key, so the lookup cost does not depend on the size of rental.
+CREATE TABLE film_similar (
+  film_id SMALLINT UNSIGNED NOT NULL,
+  position TINYINT UNSIGNED NOT NULL,
+  similar_film_id SMALLINT UNSIGNED NOT NULL,
+  score FLOAT NOT NULL,
+  shared_customers INT NOT NULL,
+  PRIMARY KEY (film_id, position)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Single row: the rental.last_update watermark of the last build.
+CREATE TABLE film_similar_state (
+  id TINYINT UNSIGNED NOT NULL,
+  rental_mark TIMESTAMP NULL,
+  built_at TIMESTAMP NULL,
+  PRIMARY KEY (id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+INSERT INTO film_similar_state (id, rental_mark, built_at) VALUES (1, NULL, NULL);
@@ -0,0 +1,27 @@
+-- Stored due date per rental (rental_date + the film's rental_duration at the
+-- time of rental), so overdue checks no longer join film. Rentals.add/update
+-- keep it current. last_update is assigned to itself so the backfill does not
+-- look like a change to every rental.
+ALTER TABLE rental ADD COLUMN due_date DATETIME NULL AFTER return_date;
+
+UPDATE rental r
+JOIN film f ON f.film_id = r.film_id
+SET r.due_date = r.rental_date + INTERVAL f.rental_duration DAY,
+    r.last_update = r.last_update;
+
+-- Overdue = return_date IS NULL AND due_date < NOW(): one range on this index.
+ALTER TABLE rental ADD INDEX idx_rental_open_due (return_date, due_date);
+
+-- Late fees for overdue rentals, recomputed in one pass by
+-- Rentals.assess_late_fees(). notified_at is set once the customer was told.
+CREATE TABLE late_fee (
+  rental_id INT NOT NULL,
+  customer_id SMALLINT UNSIGNED NOT NULL,
+  days_overdue INT NOT NULL,
+  fee DECIMAL(6,2) NOT NULL,
+  assessed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  notified_at TIMESTAMP NULL,
+  PRIMARY KEY (rental_id),
+  KEY idx_late_fee_notified (notified_at, customer_id),
+  KEY idx_late_fee_customer (customer_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
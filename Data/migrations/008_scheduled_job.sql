@@ -0,0 +1,21 @@
+-- One row per recurring job registered with utils/scheduler.py. A worker runs
+-- a job only after claiming it with a single UPDATE that sets locked_by and a
+-- lease (locked_until), so several app processes never run the same job at
+-- the same time. An expired lease (crashed worker) can be claimed again.
+CREATE TABLE scheduled_job (
+  name VARCHAR(64) NOT NULL,
+  schedule VARCHAR(64) NOT NULL,
+  next_run_at DATETIME NOT NULL,
+  locked_by VARCHAR(64) NULL,
+  locked_until DATETIME NULL,
+  attempts INT NOT NULL DEFAULT 0,
+  last_status VARCHAR(16) NULL,
+  last_started_at DATETIME NULL,
+  last_finished_at DATETIME NULL,
+  last_duration_ms INT NULL,
+  last_error TEXT NULL,
+  run_count INT NOT NULL DEFAULT 0,
+  fail_count INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (name),
+  KEY idx_job_next_run (next_run_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
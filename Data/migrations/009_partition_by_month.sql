@@ -0,0 +1,63 @@
+-- Monthly RANGE partitions for payment (payment_date) and rental (rental_date),
+-- so date-bounded queries only read the months they ask for and old months can
+-- be dropped or archived as a whole (utils/partitions.py keeps them current).
+--
+-- MySQL partitioning has two requirements here:
+--   * every unique key must contain the partitioning column, so the primary
+--     keys become (payment_id, payment_date) and (rental_id, rental_date).
+--     A lookup by id alone (Payments.get, Rentals.get, the _require_hot
+--     checks, open_rentals and customer_score_dirty joins, UPDATE payment ...
+--     WHERE rental_id) cannot be pruned: it probes the key in every
+--     partition. That cost grows with the partition count, so history older
+--     than twelve months shares one partition (see below), and setting
+--     partition_retention_months keeps the count bounded afterwards;
+--   * partitioned InnoDB tables can neither have nor be the target of foreign
+--     keys. The constraints below are dropped (their indexes stay) and the
+--     data layer does the checks instead: Rentals/Payments writes lock the
+--     customer and film they reference, customer and film deletes refuse while
+--     rentals or payments still point at them, and Rentals.delete clears
+--     payment.rental_id and the open_rentals slot as the old ON DELETE rules did.
+ALTER TABLE open_rentals DROP FOREIGN KEY fk_open_rentals_rental;
+ALTER TABLE payment DROP FOREIGN KEY fk_payment_rental, DROP FOREIGN KEY fk_payment_customer;
+ALTER TABLE rental DROP FOREIGN KEY fk_rental_customer, DROP FOREIGN KEY fk_rental_film;
+
+ALTER TABLE payment DROP PRIMARY KEY, ADD PRIMARY KEY (payment_id, payment_date);
+ALTER TABLE rental DROP PRIMARY KEY, ADD PRIMARY KEY (rental_id, rental_date);
+
+-- p_old holds everything before the month twelve months ago, then one
+-- partition per month up to three months ahead, named pYYYYMM, plus pmax for
+-- anything later. One partition per month back to the oldest row would make
+-- ~260 mostly empty partitions on the Sakila data (2005), and every id-only
+-- lookup would probe all of them. With these bounds a table starts with about 20.
+-- The list depends on the date, so it is built here and run as a prepared
+-- statement.
+SET SESSION group_concat_max_len = 1000000;
+
+SET @first_month = CURDATE() - INTERVAL (DAYOFMONTH(CURDATE()) - 1) DAY - INTERVAL 12 MONTH;
+
+SET @partitions = (
+  WITH RECURSIVE months (month_start) AS (
+    SELECT CAST(@first_month AS DATE)
+    UNION ALL
+    SELECT month_start + INTERVAL 1 MONTH FROM months
+    WHERE month_start < CURDATE() + INTERVAL 3 MONTH
+  )
+  SELECT CONCAT('PARTITION p_old VALUES LESS THAN (', QUOTE(@first_month), '), ',
+                GROUP_CONCAT(
+                  CONCAT('PARTITION p', YEAR(month_start) * 100 + MONTH(month_start),
+                         ' VALUES LESS THAN (', QUOTE(month_start + INTERVAL 1 MONTH), ')')
+                  ORDER BY month_start SEPARATOR ', '))
+  FROM months
+);
+
+SET @ddl = CONCAT('ALTER TABLE payment PARTITION BY RANGE COLUMNS (payment_date) (',
+                  @partitions, ', PARTITION pmax VALUES LESS THAN (MAXVALUE))');
+PREPARE partition_stmt FROM @ddl;
+EXECUTE partition_stmt;
+DEALLOCATE PREPARE partition_stmt;
+
+SET @ddl = CONCAT('ALTER TABLE rental PARTITION BY RANGE COLUMNS (rental_date) (',
+                  @partitions, ', PARTITION pmax VALUES LESS THAN (MAXVALUE))');
+PREPARE partition_stmt FROM @ddl;
+EXECUTE partition_stmt;
+DEALLOCATE PREPARE partition_stmt;
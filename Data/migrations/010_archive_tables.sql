@@ -0,0 +1,22 @@
+-- Cold tier for old payments and closed rentals (utils/archive.py). Same
+-- columns and indexes as the hot tables, without partitioning, and stored
+-- with InnoDB page compression since the rows are rarely read.
+CREATE TABLE payment_archive LIKE payment;
+ALTER TABLE payment_archive REMOVE PARTITIONING;
+ALTER TABLE payment_archive ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8;
+
+CREATE TABLE rental_archive LIKE rental;
+ALTER TABLE rental_archive REMOVE PARTITIONING;
+ALTER TABLE rental_archive ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8;
+
+-- Per table: rows dated before archived_before may be in the archive (rows
+-- that must stay hot, such as open rentals, remain in the hot table). Nothing
+-- on or after it is archived. Reads consult the archive only when their date
+-- range reaches below this mark.
+CREATE TABLE archive_state (
+  table_name VARCHAR(64) NOT NULL,
+  archived_before DATETIME NOT NULL,
+  rows_archived BIGINT UNSIGNED NOT NULL DEFAULT 0,
+  last_run_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (table_name)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,32 @@
+-- Change feed for the tables behind the film search and its facets
+-- (utils/change_feed.py): category, language, film_category, film_actor and
+-- open_rentals. Same shape as 004: an index on last_update and an AFTER
+-- DELETE trigger writing to row_tombstone.
+
+-- open_rentals had no last_update. Rows already there get the time of this
+-- migration, which the feed never reports since it starts at the end.
+ALTER TABLE open_rentals
+  ADD COLUMN last_update TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  ADD INDEX idx_open_rentals_last_update (last_update);
+
+ALTER TABLE category      ADD INDEX idx_category_last_update (last_update);
+ALTER TABLE language      ADD INDEX idx_language_last_update (last_update);
+ALTER TABLE film_category ADD INDEX idx_film_category_last_update (last_update);
+ALTER TABLE film_actor    ADD INDEX idx_film_actor_last_update (last_update);
+
+-- film_category and film_actor have two-column keys: row_id holds the first
+-- column and row_id2 the second. NULL for every single-column table.
+ALTER TABLE row_tombstone ADD COLUMN row_id2 INT UNSIGNED NULL AFTER row_id;
+
+-- open_rentals rows removed by the ON DELETE CASCADE from rental (a rental
+-- deleted by hand in SQL) fire no trigger; the app deletes them explicitly.
+DROP TRIGGER IF EXISTS trg_category_tombstone;
+CREATE TRIGGER trg_category_tombstone AFTER DELETE ON category FOR EACH ROW INSERT INTO row_tombstone (table_name, row_id) VALUES ('category', OLD.category_id);
+DROP TRIGGER IF EXISTS trg_language_tombstone;
+CREATE TRIGGER trg_language_tombstone AFTER DELETE ON language FOR EACH ROW INSERT INTO row_tombstone (table_name, row_id) VALUES ('language', OLD.language_id);
+DROP TRIGGER IF EXISTS trg_film_category_tombstone;
+CREATE TRIGGER trg_film_category_tombstone AFTER DELETE ON film_category FOR EACH ROW INSERT INTO row_tombstone (table_name, row_id, row_id2) VALUES ('film_category', OLD.film_id, OLD.category_id);
+DROP TRIGGER IF EXISTS trg_film_actor_tombstone;
+CREATE TRIGGER trg_film_actor_tombstone AFTER DELETE ON film_actor FOR EACH ROW INSERT INTO row_tombstone (table_name, row_id, row_id2) VALUES ('film_actor', OLD.actor_id, OLD.film_id);
+DROP TRIGGER IF EXISTS trg_open_rentals_tombstone;
+CREATE TRIGGER trg_open_rentals_tombstone AFTER DELETE ON open_rentals FOR EACH ROW INSERT INTO row_tombstone (table_name, row_id) VALUES ('open_rentals', OLD.film_id);
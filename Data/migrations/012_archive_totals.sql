@@ -0,0 +1,34 @@
+-- Per-customer and per-film totals of the archived rows (utils/archive.py).
+-- The all-time dashboards (top spenders, top countries, top rented films,
+-- customer scores) add the hot rows to these instead of reading the archive,
+-- so their cost follows the hot tables. archive.move and partition archiving
+-- add the rows they copy in the same transaction; archived rows are read-only,
+-- so nothing else changes them.
+CREATE TABLE customer_archive_total (
+  customer_id SMALLINT UNSIGNED NOT NULL,
+  payment_total DECIMAL(12,2) NOT NULL DEFAULT 0,
+  payment_count INT NOT NULL DEFAULT 0,
+  first_payment DATETIME NULL,
+  last_payment DATETIME NULL,
+  rental_count INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (customer_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE film_archive_total (
+  film_id SMALLINT UNSIGNED NOT NULL,
+  rental_count INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (film_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Backfill from what is archived already.
+INSERT INTO customer_archive_total (customer_id, payment_total, payment_count, first_payment, last_payment)
+SELECT customer_id, SUM(amount), COUNT(*), MIN(payment_date), MAX(payment_date)
+FROM payment_archive
+GROUP BY customer_id;
+
+INSERT INTO customer_archive_total (customer_id, rental_count)
+SELECT customer_id, COUNT(*) FROM rental_archive GROUP BY customer_id
+ON DUPLICATE KEY UPDATE rental_count = VALUES(rental_count);
+
+INSERT INTO film_archive_total (film_id, rental_count)
+SELECT film_id, COUNT(*) FROM rental_archive GROUP BY film_id;
@@ -1,21 +1,42 @@
 from flask import Flask, render_template, request, redirect, url_for, flash
-from settings import db_user, db_password, db_host, db_name
-import mysql.connector
+from utils.db import get_connection, pool as db_pool, breaker as db_breaker
 from utils.table_operations import Films, Customers, Addresses, Payments, Rentals
+from utils.http_cache import cached_page, last_good_pages
+from utils.assets import Assets
+from utils.responses import Compress, stream_page
+from utils.jobs import build_scheduler
+from utils.warmup import Warmup
+from utils.health import Readiness
+from utils.metrics import query_stats
+from utils.facets import FACETS
+from utils.admission import Admission
+from utils.deadlines import DeadlineExceeded, deadline_stats
+from utils.breaker import CircuitOpen
+from datetime import date, timedelta
 import math
+import settings
 
 app = Flask(__name__)
 app.secret_key = "dev-only-change-me"
-
-def get_connection():
-    return mysql.connector.connect(
-        host=db_host,
-        user=db_user,
-        password=db_password,
-        database=db_name,
-        charset="utf8mb4",
-        autocommit=True,
-    )
+assets = Assets(app)
+if settings.build_assets_on_start:
+    assets.ensure_built()
+Compress(app, min_size=1024)
+# Per route class concurrency limits; sheds with 503 + Retry-After when full.
+admission = Admission(app if settings.use_admission_control else None,
+                      classes=settings.admission_classes)
+
+def _database_unavailable(retry_after):
+    return (f"The database is not responding; please retry in {retry_after}s.", 503,
+            {"Retry-After": str(retry_after), "Content-Type": "text/plain"})
+
+# Writes fail fast while the database circuit breaker is open (utils/breaker.py);
+# read pages fall back to their last good copy in cached_page.
+@app.before_request
+def refuse_writes_while_db_down():
+    if (db_breaker is not None and request.method not in ("GET", "HEAD")
+            and db_breaker.rejecting):
+        return _database_unavailable(db_breaker.retry_after())
 
 # Sınıfları başlat
 films = Films(connection_factory=get_connection)
@@ -24,36 +45,59 @@ addresses = Addresses(connection_factory=get_connection)
 payments = Payments(connection_factory=get_connection)
 rentals = Rentals(connection_factory=get_connection)
 
+# Optional NumPy snapshot answering the dashboard aggregates from memory.
+fact_snapshot = None
+if settings.use_fact_snapshot:
+    from utils.snapshot import FactSnapshot
+    fact_snapshot = FactSnapshot(get_connection, max_age=settings.snapshot_max_age)
+
+# Picks up writes made outside this process (other workers, SQL consoles).
+if settings.use_change_feed:
+    from utils.change_feed import ChangeFeed
+    from utils.cache import table_versions
+    change_feed = ChangeFeed(get_connection)
+    change_feed.subscribe(lambda batch: table_versions.bump(batch.table))
+    if fact_snapshot is not None:
+        change_feed.subscribe(fact_snapshot.apply, tables=("payment", "rental", "customer",
+                                                          "address", "city", "country", "film"))
+    change_feed.start(interval=settings.change_feed_interval)
+
 @app.route("/")
 def main():
     return render_template("main.html")
 
 # --- FILMS ---
+# Facet -> type of its query string values; every facet may be given several times.
+FILM_FACET_TYPES = {"category_id": int, "language_id": int, "rating": str,
+                    "year": int, "rate": int, "length": int}
+
 @app.route("/films")
+@cached_page("film", "film_category", "category", "language", "open_rentals")
 def films_list():
-    category_id = request.args.get("category_id", type=int)
-    language_id = request.args.get("language_id", type=int)
+    selected = {name: request.args.getlist(name, type=kind)
+                for name, kind in FILM_FACET_TYPES.items()}
     q = request.args.get("q", type=str)
+    available = request.args.get("available", type=int)
     page = max(request.args.get("page", default=1, type=int), 1)
     page_size = 20
-    rows = films.search(category_id=category_id, language_id=language_id, q=q,
-                        page=page, page_size=page_size)
-    total_count = films.count_search(category_id=category_id, language_id=language_id, q=q)
-    total_pages = math.ceil(total_count / page_size)
-    languages = films.languages()
-    categories = films.categories()
-
-    return render_template("films.html",
-                           films=rows,
-                           languages=languages,
-                           categories=categories,
-                           sel_category_id=category_id,
-                           sel_language_id=language_id,
+    result = films.browse(selected, q=q, available=bool(available), page=page,
+                          page_size=page_size)
+    total_pages = math.ceil(result["total"] / page_size)
+
+    return stream_page("films.html",
+                           films=result["films"],
+                           facets=result["facets"],
+                           facet_names=FACETS,
+                           selected={k: v for k, v in selected.items() if v},
+                           total=result["total"],
                            q=q,
+                           available=available,
                            page=page,
                            total_pages=total_pages)
 
 @app.route("/film/<int:film_id>", methods=["GET", "POST"])
+@cached_page("film", "film_category", "category", "language", "actor", "film_actor",
+             "film_similar")
 def film_detail(film_id):
     if request.method == "POST":
         payload = {
@@ -74,16 +118,16 @@ def film_detail(film_id):
 
     film = films.get(film_id)
     categories = films.categories()
-    film_actors = films.actors(film_id)
-    available_actors = films.available_actors(film_id)
+    cast_options = films.cast_options(film_id)
     languages = films.languages()
+    similar = films.similar(film_id, k=5)
 
     return render_template("film_detail.html",
                            film=film,
                            categories=categories,
-                           actors=film_actors,
-                           available_actors=available_actors,
-                           languages=languages)
+                           cast_options=cast_options,
+                           languages=languages,
+                           similar=similar)
 
 @app.route("/films/add", methods=["GET", "POST"])
 def add_film():
@@ -132,6 +176,8 @@ def add_film():
     return render_template("film_add.html", languages=languages, categories=categories)
 
 @app.route("/films/stats")
+@admission.route_class("analytics")
+@cached_page("film", "film_category", "category", "actor", "film_actor", server_cache=True)
 def film_stats():
     stats = films.get_stats()
     return render_template("film_stats.html", stats=stats)
@@ -146,14 +192,25 @@ def delete_film(film_id):
         flash(f"Could not delete film. Error: {e}", "danger")
         return redirect(url_for("film_detail", film_id=film_id))
 
+@app.post("/film/<int:film_id>/actors")
+def set_actors(film_id):
+    """Replace the whole cast in one request: the form posts the desired actor_id set."""
+    actor_ids = request.form.getlist("actor_id", type=int)
+    added, removed = films.set_actors(film_id=film_id, actor_ids=actor_ids)
+    if added or removed:
+        flash(f"Cast updated: {len(added)} added, {len(removed)} removed", "success")
+    else:
+        flash("Cast unchanged", "info")
+    return redirect(url_for("film_detail", film_id=film_id))
+
 @app.post("/film/<int:film_id>/actors/add")
 def add_actor(film_id):
-    actor_id = request.form.get("actor_id", type=int)
-    if not actor_id:
+    actor_ids = request.form.getlist("actor_id", type=int)
+    if not actor_ids:
         flash("Select an actor to add", "warning")
         return redirect(url_for("film_detail", film_id=film_id))
-    films.add_actor(film_id=film_id, actor_id=actor_id)
-    flash("Actor added", "success")
+    films.add_actors(film_id=film_id, actor_ids=actor_ids)
+    flash("Actor added" if len(actor_ids) == 1 else f"{len(actor_ids)} actors added", "success")
     return redirect(url_for("film_detail", film_id=film_id))
 
 @app.post("/film/<int:film_id>/actors/<int:actor_id>/remove")
@@ -162,8 +219,19 @@ def remove_actor(film_id, actor_id):
     flash("Actor removed", "info")
     return redirect(url_for("film_detail", film_id=film_id))
 
+@app.post("/film/<int:film_id>/actors/remove")
+def remove_actors(film_id):
+    actor_ids = request.form.getlist("actor_id", type=int)
+    if not actor_ids:
+        flash("Select actors to remove", "warning")
+        return redirect(url_for("film_detail", film_id=film_id))
+    films.remove_actors(film_id=film_id, actor_ids=actor_ids)
+    flash(f"{len(actor_ids)} actor(s) removed", "info")
+    return redirect(url_for("film_detail", film_id=film_id))
+
 # --- ADDRESS ---
 @app.route("/address")
+@cached_page("address", "city", "country")
 def address():
     address_text = request.args.get("address", default=None, type=str)
     district = request.args.get("district", default=None, type=str)
@@ -189,7 +257,7 @@ def address():
     cities = addresses.get_cities()
     countries = addresses.get_countries()
 
-    return render_template("address.html",
+    return stream_page("address.html",
                            addresses=rows, cities=cities, countries=countries,
                            sel_city_id=city_id, sel_country_id=country_id,
                            address=address_text, district=district,
@@ -197,12 +265,15 @@ def address():
                            total_pages=total_pages)
 
 @app.route("/address/top-countries")
+@admission.route_class("analytics")
+@cached_page("country", "city", "address", "customer", "payment", server_cache=True)
 def address_top_countries():
     rows = addresses.top_countries_by_customers()
-    spending_rows = addresses.top_countries_by_spending()
+    spending_rows = (fact_snapshot or addresses).top_countries_by_spending()
     return render_template("address_top_countries.html", rows=rows, spending_rows=spending_rows)
 
 @app.route("/address/<int:address_id>", methods=["GET", "POST"])
+@cached_page("address", "city", "country")
 def address_detail(address_id):
     if request.method == "POST":
         payload = {
@@ -261,7 +332,7 @@ def address_add():
 
 # --- CUSTOMERS  ---
 @app.route("/customers")
-@app.route("/customers")
+@cached_page("customer", "address", "city", "country")
 def customers_list():
     q = request.args.get("q", type=str)
     page = max(request.args.get("page", default=1, type=int), 1)
@@ -271,7 +342,7 @@ def customers_list():
     total_count = customers.count_search(q=q)
     total_pages = math.ceil(total_count / page_size)
 
-    return render_template("customers.html",
+    return stream_page("customers.html",
                            customers=rows, q=q, page=page,
                            total_pages=total_pages)
 
@@ -297,6 +368,7 @@ def customer_add():
     return render_template("customer_detail.html", customer=None, addresses=all_addresses)
 
 @app.route("/customer/<int:customer_id>", methods=["GET", "POST"])
+@cached_page("customer", "address", "city", "country")
 def customer_detail(customer_id):
     if request.method == "POST":
         payload = {
@@ -332,17 +404,49 @@ def customer_delete(customer_id):
     return redirect(url_for("customers_list"))
 
 @app.route("/customers/top")
+@admission.route_class("analytics")
 def customers_top():
     rows = customers.top_customers_by_payment()
     return render_template("customers_top.html", customers=rows)
 @app.route("/customers/top-spenders")
+@admission.route_class("analytics")
+@cached_page("customer", "address", "city", "country", "payment", "rental", "customer_score",
+             server_cache=True)
 def customers_top_spenders():
     limit = request.args.get("limit", default=20, type=int)
-    rows = customers.top_spenders(limit=limit)
-    return render_template("customers_top_spenders.html", rows=rows, limit=limit)
+    sort = request.args.get("sort", default="monetary", type=str)
+    if sort not in Customers.SCORE_SORTS:
+        sort = "monetary"
+    segment = request.args.get("segment", type=str) or None
+    min_r = request.args.get("min_r", type=int)
+    min_f = request.args.get("min_f", type=int)
+    min_m = request.args.get("min_m", type=int)
+    # Scores are rewritten by the customer-scores job, never in the request.
+    rows = customers.scored(sort=sort, segment=segment, min_r=min_r, min_f=min_f,
+                            min_m=min_m, limit=limit)
+    return render_template("customers_top_spenders.html", rows=rows, limit=limit,
+                           status=customers.score_status(),
+                           sorts=list(Customers.SCORE_SORTS), segments=Customers.SEGMENTS,
+                           sel_sort=sort, sel_segment=segment,
+                           min_r=min_r, min_f=min_f, min_m=min_m)
+
+# Date windows for the payment and rental lists. They end at the newest row, so
+# a quiet database (or the 2005 sample data) still shows its latest activity,
+# and bounded dates let MySQL skip the older monthly partitions.
+DATE_WINDOWS = {"30": "Last 30 days", "90": "Last 90 days", "365": "Last year", "all": "All time"}
+
+def date_window(latest):
+    """Selected ?window= key and the matching lower date bound (None = no bound)."""
+    window = request.args.get("window", default=str(settings.recent_window_days), type=str)
+    if window not in DATE_WINDOWS:
+        window = "all"
+    if window == "all" or latest is None:
+        return window, None
+    return window, latest.date() - timedelta(days=int(window) - 1)
 
 # --- PAYMENTS ---
 @app.route("/payments")
+@cached_page("payment", "customer")
 def payments_list():
     # 1. Get query parameters from the URL
     q = request.args.get("q", type=str)
@@ -355,13 +459,16 @@ def payments_list():
     # Define how many items to show per page (Updated to 20 to match friends' projects)
     per_page = 20 
 
+    window, since = date_window(payments.latest_date())
+
     # 2. Call the search function
     rows, total_count = payments.search(
         q=q, 
         payment_method=payment_method, 
         sort_order=sort_order, 
         page=page, 
-        per_page=per_page
+        per_page=per_page,
+        since=since
     )
     
     # 3. Calculate Total Pages
@@ -370,12 +477,14 @@ def payments_list():
         total_pages = 1
 
     # 4. Render the template
-    return render_template(
+    return stream_page(
         "payment.html", 
         payments=rows, 
         q=q, 
         sel_method=payment_method, 
         sel_sort=sort_order, 
+        sel_window=window,
+        windows=DATE_WINDOWS,
         page=page, 
         total_pages=total_pages
     )
@@ -435,38 +544,69 @@ def add_payment():
         return f"Error loading page: {e}"
 
 @app.route('/payments/analytics')
+@admission.route_class("analytics")
+@cached_page("payment", "payment_daily_rollup", "country", server_cache=True)
 def payments_analytics():
+    granularity = request.args.get("granularity", default="month", type=str)
+    if granularity not in Payments.GRANULARITIES:
+        granularity = "month"
+    start = request.args.get("start", type=date.fromisoformat)
+    end = request.args.get("end", type=date.fromisoformat)
+    payment_method = request.args.get("payment_method", type=str) or None
+    country_id = request.args.get("country_id", type=int)
     try:
-        monthly_revenue, method_stats = payments.get_analytics()
+        source = fact_snapshot or payments
+        revenue = source.revenue_series(granularity=granularity, start=start, end=end,
+                                        payment_method=payment_method, country_id=country_id)
+        method_stats = source.method_stats(start=start, end=end, country_id=country_id)
+        countries = addresses.get_countries()
         
         return render_template('payments_analytics.html', 
-                               monthly_revenue=monthly_revenue, 
-                               method_stats=method_stats)
+                               revenue=revenue, 
+                               method_stats=method_stats,
+                               countries=countries,
+                               granularities=list(Payments.GRANULARITIES),
+                               sel_granularity=granularity,
+                               start=start, end=end,
+                               sel_method=payment_method,
+                               sel_country_id=country_id)
     except Exception as e:
-        return f"Error loading analytics: {e}"
+        return f"Error loading analytics: {e}", 500
         
 # --- RENTALS ---
 @app.route("/rentals")
+@cached_page("rental", "customer", "film", refresh_every=60)
 def rentals_list():
     q = request.args.get("q", type=str)
     status = request.args.get("status", type=str)
     page = max(request.args.get("page", default=1, type=int), 1)
     page_size = 20 # Sayfa başına gösterilecek kayıt sayısı
     
+    # Overdue rentals are listed whatever their age.
+    window, since = date_window(rentals.latest_date()) if status != "overdue" else ("all", None)
+
     # Verileri çek
-    rows = rentals.search(q=q, status=status, page=page, page_size=page_size)
+    rows = rentals.search(q=q, status=status, page=page, page_size=page_size, since=since)
     
     # Toplam sayfa sayısını hesapla
-    total_count = rentals.count_search(q=q, status=status)
-    total_pages = math.ceil(total_count / page_size)
-    if total_pages == 0: total_pages = 1
+    total_count = rentals.count_search(q=q, status=status, since=since)
+    if total_count is None:
+        # The count ran out of time: offer a next page while this one is full.
+        total_pages = None
+        has_next = len(rows) == page_size
+    else:
+        total_pages = max(math.ceil(total_count / page_size), 1)
+        has_next = page < total_pages
     
-    return render_template("rentals.html", 
+    return stream_page("rentals.html", 
                            rentals=rows, 
                            q=q, 
                            sel_status=status, 
+                           sel_window=window,
+                           windows=DATE_WINDOWS,
                            page=page, 
-                           total_pages=total_pages)
+                           total_pages=total_pages,
+                           has_next=has_next)
 
 @app.route("/rental/add", methods=["GET", "POST"])
 def rental_add():
@@ -487,9 +627,9 @@ def rental_add():
             flash("Please select both customer and film", "warning")
 
     all_customers = customers.list_customers(page_size=500) 
-    all_films = films.search(page_size=500)
+    all_films = films.search(available=True, page_size=500)
     
-    return render_template("rental_add.html", customers=all_customers, films=all_films)
+    return stream_page("rental_add.html", customers=all_customers, films=all_films)
 
 @app.route("/rental/<int:rental_id>/return", methods=["POST"])
 def rental_return(rental_id):
@@ -498,8 +638,10 @@ def rental_return(rental_id):
     return redirect(url_for("rentals_list"))
 
 @app.route("/rentals/top")
+@admission.route_class("analytics")
+@cached_page("film", "rental", server_cache=True)
 def rentals_top():
-    top_films = rentals.top_rented_films(limit=10)
+    top_films = (fact_snapshot or rentals).top_rented_films(limit=10)
     return render_template("rentals_top.html", films=top_films)
 
 @app.route("/rental/edit/<int:rental_id>", methods=["GET", "POST"])
@@ -529,7 +671,7 @@ def rental_edit(rental_id):
     all_customers = customers.list_customers(page_size=1000)
     all_films = films.search(page_size=1000)
     
-    return render_template("rental_edit.html", rental=rental, customers=all_customers, films=all_films)
+    return stream_page("rental_edit.html", rental=rental, customers=all_customers, films=all_films)
 
 @app.post("/rental/delete/<int:rental_id>")
 def rental_delete(rental_id):
@@ -539,13 +681,100 @@ def rental_delete(rental_id):
     except Exception as e:
         flash(f"Delete failed: {e}", "danger")
     return redirect(url_for("rentals_list"))
-@app.get("/health")
-def health():
+# --- JOBS ---
+@app.route("/jobs")
+def jobs_status():
     try:
-        n = films.count()
-        return f"OK. films={n}"
+        jobs = scheduler.status()
     except Exception as e:
-        return f"DB error: {e}", 500
+        return f"Error loading jobs: {e}", 500
+    return render_template("jobs.html", jobs=jobs, worker_id=scheduler.worker_id,
+                           running_here=settings.run_scheduler)
+
+@app.post("/jobs/<name>/run")
+def job_run_now(name):
+    if name not in scheduler.jobs:
+        flash(f"Unknown job '{name}'.", "danger")
+        return redirect(url_for("jobs_status"))
+    scheduler.run_now(name)
+    flash(f"Job '{name}' queued to run on the next scheduler tick.", "success")
+    return redirect(url_for("jobs_status"))
+
+@app.get("/livez")
+@admission.exempt
+def livez():
+    return "OK"
+
+@app.get("/readyz")
+@admission.exempt
+def readyz():
+    ready, report = readiness.check()
+    return report, 200 if ready else 503
+
+@app.get("/stats/queries")
+@admission.exempt
+def query_stats_view():
+    # Calls and time per compiled search statement (utils/filters.py).
+    return {"queries": query_stats.top(request.args.get("limit", default=50, type=int))}
+
+@app.get("/stats/admission")
+@admission.exempt
+def admission_stats_view():
+    # Limits, queue depth and wait/service times per route class (utils/admission.py).
+    return {"classes": admission.stats()}
+
+@app.get("/stats/deadlines")
+@admission.exempt
+def deadline_stats_view():
+    # Calls, deadline hits and stale/partial fallbacks per DAO method (utils/deadlines.py).
+    return {"methods": deadline_stats.snapshot()}
+
+@app.get("/stats/breaker")
+@admission.exempt
+def breaker_stats_view():
+    # Circuit breaker state and the last good page copies served while it is open.
+    return {"breaker": db_breaker.stats() if db_breaker is not None else None,
+            "last_good_pages": {"entries": len(last_good_pages), "hits": last_good_pages.hits,
+                                "misses": last_good_pages.misses}}
+
+@app.errorhandler(CircuitOpen)
+def circuit_open(e):
+    return _database_unavailable(e.retry_after)
+
+@app.errorhandler(DeadlineExceeded)
+def deadline_exceeded(e):
+    return (f"This page took too long to load ({e}). Please retry or narrow the filters.",
+            503, {"Retry-After": "5", "Content-Type": "text/plain"})
+
+@app.get("/health")
+@admission.exempt
+def health():
+    ready, report = readiness.check()
+    if not ready:
+        return f"Not ready: {'; '.join(report['reasons'])}", 503
+    return f"OK. db={report['db']['ping_ms']}ms cache={warmup.describe()}"
+
+# Lookup lists, first pages and dashboards, loaded before /readyz says ready.
+warmup = Warmup(app, routes=settings.warmup_routes, calls=[
+    ("languages", films.languages),
+    ("categories", films.categories),
+    ("film-facets", films.facets.load),
+    ("countries", addresses.get_countries),
+    ("cities", addresses.get_cities),
+    ("customers", payments.get_all_customers),
+])
+readiness = Readiness(get_connection, pool=db_pool, warmup=warmup,
+                      timeout=settings.ready_timeout,
+                      max_latency_ms=settings.ready_max_latency_ms,
+                      max_utilization=settings.ready_max_pool_utilization)
+if settings.warmup_on_start:
+    warmup.start()
+
+# Recurring maintenance jobs; /jobs shows their state. Defined after warmup,
+# which the cache-warm job replays.
+scheduler = build_scheduler(get_connection, warmup=warmup)
+if settings.run_scheduler:
+    scheduler.start(interval=settings.scheduler_poll_seconds)
 
 if __name__ == "__main__":
 
@@ -3,4 +3,101 @@
 db_user = "root"          
 db_password = "1234"     
 db_host = "localhost"     
-db_name = "sakila"
\ No newline at end of file
+db_name = "sakila"
+
+# Connection pool shared by every request and background thread (0 = a new
+# connection per call). Callers wait up to db_pool_timeout seconds for a free one.
+db_pool_size = 10         # at most 32
+db_pool_timeout = 5
+
+# In-memory columnar snapshot for dashboard aggregates (needs numpy).
+use_fact_snapshot = False
+snapshot_max_age = 60     # seconds before picking up writes made by other processes
+
+# Change feed over last_update + row_tombstone (needs migration 004). It bumps
+# the cache version counters for writes made by other processes and in SQL.
+use_change_feed = True
+change_feed_interval = 5  # seconds between polls
+
+# Background jobs (utils/jobs.py, needs migration 008). Either run them in the
+# web process or start a worker with `python -m utils.jobs worker`.
+run_scheduler = False
+scheduler_poll_seconds = 10
+
+# Build the fingerprinted CSS bundle (utils/assets.py) at start when it is
+# missing or out of date. Turn off where static/ is read-only and run
+# `python -m utils.assets build` as a deploy step instead.
+build_assets_on_start = True
+
+# Cache warm-up at start; /health reports 503 until it has finished.
+warmup_on_start = True
+warmup_routes = [
+    "/films", "/address", "/customers", "/payments", "/rentals",
+    "/films/stats", "/payments/analytics", "/address/top-countries",
+    "/customers/top-spenders", "/rentals/top",
+]
+
+# /readyz: not ready when the pooled SELECT 1 cannot get a connection within
+# ready_timeout seconds, is slower than ready_max_latency_ms, or the pool is
+# this busy.
+ready_timeout = 0.5
+ready_max_latency_ms = 250
+ready_max_pool_utilization = 0.9
+
+# /payments and /rentals show this many days (ending at the newest row) unless
+# another window is picked.
+recent_window_days = 90
+
+# Monthly partitions of payment and rental (migration 009, utils/partitions.py).
+# Months older than partition_retention_months are dropped, or copied to
+# <table>_archive first when partition_archive is set. None keeps everything.
+partition_months_ahead = 3
+partition_retention_months = None
+partition_archive = False
+
+# Payments and returned rentals older than this move to payment_archive /
+# rental_archive (migration 010, utils/archive.py) every night. None turns the
+# job off; reads fall back to the archive either way.
+archive_after_days = 730
+
+# Nightly Parquet export for offline analytics (utils/export.py, needs pyarrow).
+# None turns the job off; `python3 -m utils.export run` still works.
+export_path = None          # e.g. "exports/snapshot"
+export_chunk_size = 50000
+
+# Admission control (utils/admission.py). Each route class runs at most `limit`
+# requests at once per process and lets `queue` more wait up to `timeout`
+# seconds; past that the app answers 503 with Retry-After (at least
+# `retry_after` seconds). Keep the limits' sum near db_pool_size.
+use_admission_control = True
+admission_classes = {
+    "crud": dict(limit=5, queue=50, timeout=2.0, retry_after=1),
+    "list": dict(limit=3, queue=20, timeout=3.0, retry_after=2),
+    "analytics": dict(limit=2, queue=4, timeout=5.0, retry_after=10),
+}
+
+# Query deadlines (utils/deadlines.py): each decorated DAO method has a time
+# budget in ms, enforced with max_execution_time and KILL QUERY. Override
+# per method by qualified name, e.g. {"Rentals.count_search": 2500}.
+use_query_deadlines = True
+query_deadlines_ms = {}
+
+# Circuit breaker around get_connection (utils/breaker.py). It opens after
+# breaker_failures connection failures in a row (refused, timed out or lost
+# connections; pool waits and query deadlines do not count). While it is
+# open, read pages are served from their last good copy with a notice and
+# writes get 503. After breaker_reset_seconds a SELECT 1 probe with a
+# breaker_probe_timeout second timeout decides whether to close it again.
+use_circuit_breaker = True
+breaker_failures = 5
+breaker_reset_seconds = 10
+breaker_probe_timeout = 1
+
+# Late fee notices (utils/overdue.py): "module:function" called as
+# notify(customer, items) once per customer. None = assess fees only; fees are
+# marked notified only after a real notifier has sent them.
+late_fee_notifier = None
+
+# ETags change, and server-side page cache entries expire, after this many
+# seconds even without a write seen here (matches cached_query's ttl).
+page_cache_ttl = 300
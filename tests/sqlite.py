@@ -0,0 +1,114 @@
+"""
+In-memory SQLite behind the slice of the mysql.connector API that the DAOs
+use, so tests can run their real SQL without a MySQL server. The few MySQL
+spellings they rely on are rewritten to SQLite's before each statement.
+"""
+import re
+import sqlite3
+from datetime import datetime
+
+_REWRITES = [
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\s+FOR (SHARE|UPDATE)\b"), ""),
+    (re.compile(r"\bINSERT IGNORE\b"), "INSERT OR IGNORE"),
+    (re.compile(r"\bON DUPLICATE KEY UPDATE\b"), "ON CONFLICT DO UPDATE SET"),
+    (re.compile(r"\bVALUES\((\w+)\)"), r"excluded.\1"),
+]
+
+
+def to_sqlite(sql: str) -> str:
+    for pattern, replacement in _REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+class Cursor:
+    def __init__(self, db, dictionary=False):
+        self._cur = db.cursor()
+        self._dictionary = dictionary
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def execute(self, sql, params=()):
+        self._cur.execute(to_sqlite(sql), tuple(params))
+
+    def executemany(self, sql, rows):
+        self._cur.executemany(to_sqlite(sql), [tuple(row) for row in rows])
+
+    def fetchall(self):
+        rows = self._cur.fetchall()
+        if not self._dictionary:
+            return rows
+        names = [d[0] for d in self._cur.description]
+        return [dict(zip(names, row)) for row in rows]
+
+    def fetchone(self):
+        rows = self.fetchall()[:1]
+        return rows[0] if rows else None
+
+    def close(self):
+        self._cur.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Connection:
+    def __init__(self, db):
+        self._db = db
+
+    def cursor(self, dictionary=False):
+        return Cursor(self._db, dictionary)
+
+    def start_transaction(self):
+        self._db.execute("BEGIN")
+
+    def commit(self):
+        self._db.execute("COMMIT")
+
+    def rollback(self):
+        self._db.execute("ROLLBACK")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda b: datetime.fromisoformat(b.decode()))
+
+
+def database(schema: str = "") -> sqlite3.Connection:
+    """
+    A fresh in-memory database in autocommit mode, like the app's connections.
+    Columns declared TIMESTAMP come back as datetime, as they do from MySQL.
+    """
+    db = sqlite3.connect(":memory:", isolation_level=None, check_same_thread=False,
+                         detect_types=sqlite3.PARSE_DECLTYPES)
+    db.create_function("CONCAT", -1, lambda *parts: "".join(map(str, parts)))
+    db.create_function("NOW", 0, lambda: datetime.now().isoformat(" ", "seconds"))
+    # Multi-argument min/max, NULL when any argument is, as in MySQL.
+    for name, pick in (("LEAST", min), ("GREATEST", max)):
+        db.create_function(name, -1, lambda *args, pick=pick: None if None in args else pick(args))
+    db.executescript(schema)
+    return db
+
+
+def factory(db: sqlite3.Connection):
+    """connection_factory for the DAOs."""
+    return lambda: Connection(db)
@@ -0,0 +1,49 @@
+import threading
+import time
+
+import pytest
+
+from utils.admission import Bulkhead, Overloaded
+
+
+def test_admits_up_to_limit_then_sheds_when_queue_is_full():
+    bulkhead = Bulkhead("crud", limit=2, queue=0, timeout=1)
+    bulkhead.acquire()
+    bulkhead.acquire()
+    with pytest.raises(Overloaded) as raised:
+        bulkhead.acquire()
+    assert raised.value.reason == "queue full"
+    stats = bulkhead.stats()
+    assert (stats["in_flight"], stats["admitted"], stats["shed"]) == (2, 2, 1)
+
+
+def test_queued_request_times_out():
+    bulkhead = Bulkhead("analytics", limit=1, queue=1, timeout=0.05)
+    bulkhead.acquire()
+    with pytest.raises(Overloaded) as raised:
+        bulkhead.acquire()
+    assert raised.value.reason == "timed out in queue"
+    assert bulkhead.timeouts == 1 and bulkhead.waiting == 0
+
+
+def test_release_hands_the_slot_to_a_waiter():
+    bulkhead = Bulkhead("list", limit=1, queue=1, timeout=5)
+    bulkhead.acquire()
+    admitted = threading.Event()
+
+    def waiter():
+        bulkhead.acquire()
+        admitted.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    while not bulkhead.waiting:
+        time.sleep(0.001)
+    # The queue (1) is taken, so a third request is shed at once.
+    with pytest.raises(Overloaded):
+        bulkhead.acquire()
+    bulkhead.release(time.monotonic())
+    assert admitted.wait(5)
+    thread.join()
+    assert bulkhead.in_flight == 1 and bulkhead.admitted == 2
+
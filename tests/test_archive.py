@@ -0,0 +1,106 @@
+"""
+Moving rows to the archive must not change the all-time dashboards, which
+read the hot tables plus the archive totals that archive.move keeps
+(migration 012) rather than the archive itself.
+"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from tests.sqlite import database, factory
+from utils import archive
+from utils.table_operations import Addresses, Customers, Rentals
+
+SCHEMA = """
+    CREATE TABLE country (country_id INTEGER PRIMARY KEY, country TEXT);
+    CREATE TABLE city (city_id INTEGER PRIMARY KEY, city TEXT, country_id INTEGER);
+    CREATE TABLE address (address_id INTEGER PRIMARY KEY, city_id INTEGER);
+    CREATE TABLE customer (customer_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT,
+                           email TEXT, address_id INTEGER);
+    CREATE TABLE film (film_id INTEGER PRIMARY KEY, title TEXT);
+    CREATE TABLE payment (payment_id INTEGER PRIMARY KEY, customer_id INTEGER, amount REAL,
+                          payment_date TIMESTAMP);
+    CREATE TABLE rental (rental_id INTEGER PRIMARY KEY, film_id INTEGER, customer_id INTEGER,
+                         rental_date TIMESTAMP, return_date TIMESTAMP);
+    CREATE TABLE payment_archive AS SELECT * FROM payment WHERE 0;
+    CREATE TABLE rental_archive AS SELECT * FROM rental WHERE 0;
+    CREATE UNIQUE INDEX payment_archive_pk ON payment_archive (payment_id);
+    CREATE UNIQUE INDEX rental_archive_pk ON rental_archive (rental_id);
+    CREATE TABLE row_tombstone (tombstone_id INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT,
+                                row_id INTEGER);
+    CREATE TABLE archive_state (table_name TEXT PRIMARY KEY, archived_before TIMESTAMP,
+                                rows_archived INTEGER);
+    CREATE TABLE customer_archive_total (customer_id INTEGER PRIMARY KEY,
+                                         payment_total REAL NOT NULL DEFAULT 0,
+                                         payment_count INTEGER NOT NULL DEFAULT 0,
+                                         first_payment TIMESTAMP, last_payment TIMESTAMP,
+                                         rental_count INTEGER NOT NULL DEFAULT 0);
+    CREATE TABLE film_archive_total (film_id INTEGER PRIMARY KEY,
+                                     rental_count INTEGER NOT NULL DEFAULT 0);
+    INSERT INTO country VALUES (1, 'Chile'), (2, 'Peru');
+    INSERT INTO city VALUES (1, 'Arica', 1), (2, 'Lima', 2);
+    INSERT INTO address VALUES (1, 1), (2, 2);
+    INSERT INTO film VALUES (1, 'ACE'), (2, 'BLADE'), (3, 'CHAMBER'), (4, 'DANCE');
+"""
+START = datetime(2004, 1, 1)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    rng = random.Random(3)
+    db = database(SCHEMA)
+    for customer_id in range(1, 13):
+        db.execute("INSERT INTO customer VALUES (?, 'A', ?, '', ?)",
+                   (customer_id, f"N{customer_id}", customer_id % 2 + 1))
+    for i in range(1, 301):
+        when = START + timedelta(days=rng.randrange(0, 700))
+        db.execute("INSERT INTO payment VALUES (?, ?, ?, ?)",
+                   (i, rng.randrange(1, 13), rng.choice([0.99, 2.99, 4.99]), when))
+        db.execute("INSERT INTO rental VALUES (?, ?, ?, ?, ?)",
+                   (i, rng.randrange(1, 5), rng.randrange(1, 13), when, when + timedelta(days=3)))
+    # information_schema is MySQL's; every column is copied here.
+    monkeypatch.setattr(archive, "_columns",
+                        lambda cur, table: [r[1] for r in db.execute(f"PRAGMA table_info({table})")])
+    return db
+
+
+def _dashboards(db):
+    customers, addresses = Customers(factory(db)), Addresses(factory(db))
+    return {
+        "top_spenders": [(r["customer_id"], round(r["total_paid"], 2), r["payments_count"])
+                         for r in customers.top_spenders(limit=12)],
+        "top_customers": [(r["customer_id"], round(r["total_spent"], 2), r["payment_count"])
+                          for r in customers.top_customers_by_payment(limit=12)],
+        "top_countries": [(r["country"], round(r["total_spent"], 2))
+                          for r in addresses.top_countries_by_spending()],
+        "top_films": [(r["film_id"], r["rental_count"])
+                      for r in Rentals(factory(db)).top_rented_films()],
+    }
+
+
+def test_dashboards_survive_archiving(db):
+    before = _dashboards(db)
+    for table in archive.TABLES:
+        archive.move(factory(db), table, START + timedelta(days=400), batch_size=40)
+    (hot,) = db.execute("SELECT COUNT(*) FROM payment").fetchone()
+    assert 0 < hot < 300
+    assert _dashboards(db) == before
+
+
+def test_totals_match_the_archive(db):
+    archive.move(factory(db), "payment", START + timedelta(days=300), batch_size=25)
+    archive.move(factory(db), "payment", START + timedelta(days=500), batch_size=25)
+    archive.move(factory(db), "rental", START + timedelta(days=500), batch_size=25)
+    totals = db.execute("""
+        SELECT customer_id, ROUND(payment_total, 2), payment_count, first_payment, last_payment
+        FROM customer_archive_total WHERE payment_count > 0 ORDER BY customer_id
+    """).fetchall()
+    # Aggregated TIMESTAMPs come back from SQLite as text.
+    assert [(*row[:3], str(row[3]), str(row[4])) for row in totals] == db.execute("""
+        SELECT customer_id, ROUND(SUM(amount), 2), COUNT(*), MIN(payment_date), MAX(payment_date)
+        FROM payment_archive GROUP BY customer_id ORDER BY customer_id
+    """).fetchall()
+    assert db.execute("SELECT film_id, rental_count FROM film_archive_total ORDER BY film_id"
+                      ).fetchall() == db.execute(
+        "SELECT film_id, COUNT(*) FROM rental_archive GROUP BY film_id ORDER BY film_id").fetchall()
@@ -0,0 +1,41 @@
+import json
+import os
+import re
+
+import pytest
+
+from utils import assets
+
+
+@pytest.fixture
+def dist(tmp_path, monkeypatch):
+    monkeypatch.setattr(assets, "DIST_DIR", str(tmp_path))
+    monkeypatch.setattr(assets, "MANIFEST", str(tmp_path / "manifest.json"))
+    return tmp_path
+
+
+def test_bundle_is_self_contained(dist):
+    manifest = assets.build()
+    css = (dist / manifest["app.css"]).read_text(encoding="utf-8")
+    # Everything the bundle references is local: no CDN or font service URLs.
+    refs = {ref.split("#")[0] for _, ref in re.findall(r"url\((['\"]?)([^'\")]+)\1\)", css)
+            if not ref.startswith("data:")}
+    assert not [ref for ref in refs if "//" in ref] and "@import" not in css
+    assert refs and refs <= set(manifest.values())
+    for name in refs:
+        assert (dist / name).exists()
+    assert json.loads((dist / "manifest.json").read_text()) == manifest
+    assert (dist / (manifest["app.css"] + ".gz")).exists()
+
+
+def test_stale_until_built_and_after_a_source_changes(dist):
+    assert assets.stale()
+    assets.build()
+    assert not assets.stale()
+    style = assets.BUNDLES["app.css"][-1]
+    built = os.path.getmtime(assets.MANIFEST)
+    os.utime(style, (built + 10, built + 10))
+    try:
+        assert assets.stale()
+    finally:
+        os.utime(style, None)
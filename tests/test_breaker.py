@@ -0,0 +1,99 @@
+import pytest
+from mysql.connector import errors
+
+from utils import breaker
+from utils.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, is_outage
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(breaker.time, "monotonic", clock)
+    return clock
+
+
+LOST = errors.OperationalError(msg="Lost connection", errno=2013)
+
+
+@pytest.mark.parametrize("error, outage", [
+    (errors.InterfaceError(msg="Can't connect", errno=2003), True),
+    (errors.OperationalError(msg="gone away", errno=2006), True),
+    (LOST, True),
+    (ConnectionRefusedError(), True),
+    (TimeoutError(), True),
+    (errors.PoolError(msg="pool exhausted"), False),
+    (errors.DatabaseError(msg="max_execution_time exceeded", errno=3024), False),
+    (errors.OperationalError(msg="interrupted", errno=1317), False),
+    (errors.IntegrityError(msg="Duplicate entry", errno=1062), False),
+    (CircuitOpen(5), False),
+    (ValueError("bad input"), False),
+])
+def test_only_connection_failures_are_outages(error, outage):
+    assert is_outage(error) is outage
+
+
+def test_opens_after_failures_in_a_row(clock):
+    cb = CircuitBreaker(probe=lambda: None, failures=3, reset_after=10)
+    cb.record(LOST)
+    cb.record(LOST)
+    cb.record(None)          # a success resets the count
+    cb.record(LOST)
+    cb.record(LOST)
+    assert cb.state == CLOSED
+    cb.record(LOST)
+    assert cb.state == OPEN and cb.trips == 1
+    with pytest.raises(CircuitOpen) as raised:
+        cb.before()
+    assert raised.value.retry_after == 11
+    assert cb.rejecting and cb.rejected == 1
+
+
+def test_other_errors_neither_count_nor_reset(clock):
+    cb = CircuitBreaker(probe=lambda: None, failures=2)
+    cb.record(LOST)
+    cb.record(errors.PoolError(msg="pool exhausted"))
+    cb.record(errors.IntegrityError(msg="Duplicate entry", errno=1062))
+    assert cb.failed == 1 and cb.state == CLOSED
+    cb.record(LOST)
+    assert cb.state == OPEN
+
+
+def test_successful_probe_closes(clock):
+    probes = []
+    cb = CircuitBreaker(probe=lambda: probes.append(cb.state), failures=1, reset_after=10)
+    cb.record(LOST)
+    clock.now += 10
+    assert not cb.rejecting
+    cb.before()
+    assert probes == [HALF_OPEN]
+    assert cb.state == CLOSED and cb.failed == 0 and cb.probes == 1
+
+
+def test_failed_probe_reopens(clock):
+    def probe():
+        raise LOST
+
+    cb = CircuitBreaker(probe=probe, failures=1, reset_after=10)
+    cb.record(LOST)
+    clock.now += 10
+    with pytest.raises(CircuitOpen):
+        cb.before()
+    assert cb.state == OPEN and cb.trips == 2
+    clock.now += 9
+    with pytest.raises(CircuitOpen):
+        cb.before()
+    assert cb.probes == 1
+
+
+def test_closed_breaker_lets_calls_through(clock):
+    cb = CircuitBreaker(probe=lambda: pytest.fail("no probe while closed"))
+    cb.before()
+    assert cb.stats()["state"] == CLOSED and cb.stats()["retry_in_s"] is None
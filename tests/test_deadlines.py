@@ -0,0 +1,233 @@
+import threading
+import time
+
+import pytest
+from mysql.connector import errors
+
+import settings
+from utils import db, deadlines
+from utils.deadlines import DeadlineExceeded, _Scope, _timed_out, _Watchdog, deadline
+
+TIMEOUT = errors.DatabaseError(msg="maximum statement execution time exceeded", errno=3024)
+
+
+class FakeCursor:
+    def __init__(self, executed):
+        self.executed = executed
+
+    def execute(self, sql, params=()):
+        self.executed.append((sql, params))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, connection_id=41):
+        self.connection_id = connection_id
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self.executed)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class Dao:
+    """Fails with `error` while it is set; records the time left in each call."""
+
+    def __init__(self):
+        self.connection_factory = object()
+        self.error = None
+        self.left = []
+
+    @deadline(1000, fallback=lambda self, n: "partial")
+    def count(self, n):
+        return self._run(n)
+
+    @deadline(1000)
+    def rows(self, n):
+        return self._run(n)
+
+    @deadline(1000, stale=False, fallback=lambda self, n: "partial")
+    def fresh(self, n):
+        return self._run(n)
+
+    @deadline(50)
+    def inner(self):
+        self.left.append(deadlines.remaining())
+        return self._run(0)
+
+    @deadline(2000)
+    def outer_long(self):
+        self.left.append(deadlines.remaining())
+        return self.inner()
+
+    @deadline(50)
+    def outer_short(self):
+        return self.rows_long()
+
+    @deadline(2000)
+    def rows_long(self):
+        self.left.append(deadlines.remaining())
+        return self._run(0)
+
+    def _run(self, n):
+        if self.error is not None:
+            raise self.error
+        return f"rows {n}"
+
+
+@pytest.fixture(autouse=True)
+def deadlines_on(monkeypatch):
+    monkeypatch.setattr(settings, "use_query_deadlines", True)
+    monkeypatch.setattr(settings, "query_deadlines_ms", {})
+
+
+def test_timeout_serves_stale_then_fallback_then_raises():
+    dao = Dao()
+    assert dao.count(1) == "rows 1"
+    dao.error = TIMEOUT
+    assert dao.count(1) == "rows 1"              # 1. last good result
+    assert dao.count(2) == "partial"             # 2. fallback when nothing is cached
+    assert dao.fresh(1) == "partial"             #    (stale=False skips step 1)
+    with pytest.raises(DeadlineExceeded) as raised:
+        dao.rows(3)                              # 3. neither
+    assert raised.value.__cause__ is TIMEOUT
+    stats = {row["method"]: row for row in deadlines.deadline_stats.snapshot()}
+    assert stats["Dao.count"]["stale"] >= 1 and stats["Dao.count"]["partial"] >= 1
+    assert stats["Dao.rows"]["errors"] >= 1
+
+
+def test_other_errors_are_not_deadline_hits():
+    dao = Dao()
+    dao.count(1)
+    dao.error = errors.IntegrityError(msg="Duplicate entry", errno=1062)
+    with pytest.raises(errors.IntegrityError):
+        dao.count(1)
+
+
+def test_nested_scope_takes_the_smaller_budget():
+    dao = Dao()
+    dao.outer_long()
+    outer_left, inner_left = dao.left
+    assert outer_left > 1.5 and inner_left <= 0.05
+    dao.left.clear()
+    dao.outer_short()
+    assert dao.left[0] <= 0.05
+    assert deadlines.remaining() is None         # scope is reset afterwards
+
+
+def test_disabled_deadlines_call_straight_through(monkeypatch):
+    monkeypatch.setattr(settings, "use_query_deadlines", False)
+    dao = Dao()
+    dao.error = TIMEOUT
+    with pytest.raises(errors.DatabaseError):
+        dao.count(1)
+
+
+def test_timed_out():
+    live = _Scope("m", time.monotonic() + 10)
+    expired = _Scope("m", time.monotonic() - 1)
+    assert not _timed_out(errors.PoolError(msg="pool exhausted"), live)
+    assert _timed_out(errors.PoolError(msg="pool exhausted"), expired)
+    assert _timed_out(TIMEOUT, live)
+    assert _timed_out(errors.OperationalError(msg="interrupted", errno=1317), live)
+    assert not _timed_out(errors.IntegrityError(msg="Duplicate entry", errno=1062), live)
+    live.killed = True
+    assert _timed_out(errors.OperationalError(msg="Lost connection", errno=2013), live)
+
+
+def _attached(scope, cn):
+    token = deadlines._current.set(scope)
+    try:
+        return deadlines.attach(cn)
+    finally:
+        deadlines._current.reset(token)
+
+
+def test_attach_sets_the_execution_limit():
+    cn = FakeConnection()
+    assert deadlines.attach(cn) is cn and cn.executed == []    # outside a deadline
+    scope = _Scope("m", time.monotonic() + 2)
+    _attached(scope, cn)
+    (sql, (ms,)), = cn.executed
+    assert sql == "SET SESSION max_execution_time = %s" and 1500 < ms <= 2000
+    assert scope.connections == {id(cn): 41}
+
+
+@pytest.fixture
+def killer(monkeypatch):
+    kills = FakeConnection(connection_id=99)
+    calls = []
+
+    def connect(**overrides):
+        calls.append(overrides)
+        return kills
+
+    monkeypatch.setattr(db, "connect", connect)
+    kills.calls = calls
+    return kills
+
+
+def test_kill_uses_a_short_connect_timeout(killer):
+    scope = _Scope("m", time.monotonic() - 1)
+    _attached(scope, FakeConnection())
+    _Watchdog._kill(scope)
+    assert killer.executed == [("KILL QUERY %s", (41,))]
+    assert killer.calls == [{"connection_timeout": settings.breaker_probe_timeout}]
+    assert scope.killed
+
+
+def test_detached_connection_is_never_killed(killer):
+    scope = _Scope("m", time.monotonic() - 1)
+    cn = _attached(scope, FakeConnection())
+    deadlines.detach(cn)                         # back in the pool
+    _Watchdog._kill(scope)
+    assert killer.executed == [] and killer.calls == [] and not scope.killed
+
+
+def test_finished_scope_is_never_killed(killer):
+    scope = _Scope("m", time.monotonic() - 1)
+    _attached(scope, FakeConnection())
+    scope.done = True
+    _Watchdog._kill(scope)
+    assert killer.executed == []
+
+
+def test_unreachable_server_does_not_stop_the_watchdog(monkeypatch):
+    def refuse(**overrides):
+        raise errors.InterfaceError(msg="Can't connect", errno=2003)
+
+    monkeypatch.setattr(db, "connect", refuse)
+    scope = _Scope("m", time.monotonic() - 1)
+    _attached(scope, FakeConnection())
+    _Watchdog._kill(scope)                       # swallowed
+    assert scope.killed
+
+
+def test_watchdog_kills_after_grace(killer):
+    watchdog = _Watchdog(grace=0.02)
+    killed = threading.Event()
+
+    class SignallingCursor(FakeCursor):
+        def execute(self, sql, params=()):
+            super().execute(sql, params)
+            killed.set()
+
+    killer.cursor = lambda: SignallingCursor(killer.executed)
+    scope = _Scope("m", time.monotonic() + 0.02)
+    _attached(scope, FakeConnection(connection_id=7))
+    later = _Scope("m", time.monotonic() + 60)
+    _attached(later, FakeConnection(connection_id=8))
+    watchdog.watch(later)
+    watchdog.watch(scope)
+    assert killed.wait(5)
+    assert killer.executed == [("KILL QUERY %s", (7,))]
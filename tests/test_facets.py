@@ -0,0 +1,136 @@
+"""
+The facet index (utils/facets.py) must agree with the SQL search it replaced
+on /films. Both run here against the same fixture catalog, the SQL side in an
+in-memory SQLite database through the statements Films._SEARCH compiles.
+"""
+import random
+
+import pytest
+
+from tests.sqlite import database, factory
+from utils.facets import LENGTH_BUCKETS, RATE_BUCKETS, FacetIndex
+from utils.table_operations import Films
+
+CATEGORIES = [(1, "Action"), (2, "Comedy"), (3, "Drama"), (4, "Horror")]
+LANGUAGES = [(1, "English"), (2, "French"), (3, "German")]
+RATINGS = ["G", "PG", "PG-13", "R", "NC-17"]
+
+
+@pytest.fixture(scope="module")
+def db():
+    rng = random.Random(2005)
+    db = database("""
+        CREATE TABLE film (film_id INTEGER PRIMARY KEY, title TEXT, language_id INTEGER,
+                           rating TEXT, release_year INTEGER, rental_rate REAL, length INTEGER);
+        CREATE TABLE category (category_id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE language (language_id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE film_category (film_id INTEGER, category_id INTEGER);
+        CREATE TABLE open_rentals (film_id INTEGER);
+    """)
+    db.executemany("INSERT INTO category VALUES (?, ?)", CATEGORIES)
+    db.executemany("INSERT INTO language VALUES (?, ?)", LANGUAGES)
+    words = ["ACE", "ALIEN", "BLADE", "CHAMBER", "DANCE", "EGG", "FIRE", "GHOST", "HALL", "ISLAND"]
+    for film_id in range(1, 121):
+        title = f"{rng.choice(words)} {rng.choice(words)} {film_id:03d}"
+        db.execute("INSERT INTO film VALUES (?, ?, ?, ?, ?, ?, ?)", (
+            film_id, title, rng.choice(LANGUAGES)[0], rng.choice(RATINGS),
+            rng.choice([2004, 2005, 2006]), rng.choice([0.99, 2.99, 4.99, 5.99]),
+            rng.choice([None, 46, 75, 90, 119, 120, 185]),
+        ))
+        # Most films have one category, some none, a few two.
+        for category_id, _ in rng.sample(CATEGORIES, rng.choice([0, 1, 1, 1, 2])):
+            db.execute("INSERT INTO film_category VALUES (?, ?)", (film_id, category_id))
+        if rng.random() < 0.3:
+            db.execute("INSERT INTO open_rentals VALUES (?)", (film_id,))
+    return db
+
+
+@pytest.fixture
+def index(db):
+    return FacetIndex(factory(db))
+
+
+def _sql_ids(db, **values):
+    """Matching film ids in title order, with the WHERE clause Films._SEARCH builds."""
+    query = Films._SEARCH.compile(values)
+    ids_sql = query.count_sql.replace("COUNT(DISTINCT f.film_id)", "DISTINCT f.film_id, f.title")
+    rows = db.execute(ids_sql.replace("%s", "?") + " ORDER BY f.title", query.params).fetchall()
+    (count,) = db.execute(query.count_sql.replace("%s", "?"), query.params).fetchone()
+    assert count == len(rows)
+    return [film_id for film_id, _ in rows]
+
+
+def _facet_counts(result, name):
+    return {v["value"]: v["count"] for v in result["facets"][name]}
+
+
+SEARCHES = [
+    {},
+    {"category_id": 2},
+    {"language_id": 3},
+    {"q": "ghost"},
+    {"available": 1},
+    {"category_id": 1, "language_id": 2},
+    {"category_id": 4, "q": "a", "available": 1},
+    {"language_id": 1, "q": "no such title"},
+]
+
+
+@pytest.mark.parametrize("values", SEARCHES)
+def test_filtered_ids_match_sql(db, index, values):
+    selected = {name: [values[name]] for name in ("category_id", "language_id") if name in values}
+    result = index.search(selected, q=values.get("q"), available=bool(values.get("available")),
+                          page=1, page_size=1000)
+    expected = _sql_ids(db, **values)
+    assert result["film_ids"] == expected
+    assert result["total"] == len(expected)
+
+
+@pytest.mark.parametrize("values", SEARCHES)
+def test_facet_counts_match_sql(db, index, values):
+    selected = {name: [values[name]] for name in ("category_id", "language_id") if name in values}
+    result = index.search(selected, q=values.get("q"), available=bool(values.get("available")))
+    # Disjunctive: a value's count is the SQL total with that value as its
+    # facet's filter and every other filter unchanged.
+    for name, ids in (("category_id", CATEGORIES), ("language_id", LANGUAGES)):
+        counts = _facet_counts(result, name)
+        for value, _ in ids:
+            assert counts.get(value, 0) == len(_sql_ids(db, **{**values, name: value})), (name, value)
+
+
+def test_paging_follows_sql_order(db, index):
+    expected = _sql_ids(db, language_id=1)
+    pages = [index.search({"language_id": [1]}, page=page, page_size=7)["film_ids"]
+             for page in range(1, len(expected) // 7 + 2)]
+    assert [film_id for page in pages for film_id in page] == expected
+
+
+@pytest.mark.parametrize("facet, column, buckets", [
+    ("rate", "rental_rate", RATE_BUCKETS),
+    ("length", "length", LENGTH_BUCKETS),
+])
+def test_bucket_counts_match_sql(db, index, facet, column, buckets):
+    counts = _facet_counts(index.search({"category_id": [3]}), facet)
+    for i, (_, low, high) in enumerate(buckets):
+        sql = ("SELECT COUNT(DISTINCT f.film_id) FROM film f"
+               " JOIN film_category fc ON fc.film_id = f.film_id WHERE fc.category_id = 3"
+               f" AND f.{column} IS NOT NULL")
+        params = []
+        if low is not None:
+            sql += f" AND f.{column} >= ?"
+            params.append(low)
+        if high is not None:
+            sql += f" AND f.{column} < ?"
+            params.append(high)
+        (expected,) = db.execute(sql, params).fetchone()
+        assert counts.get(i, 0) == expected, buckets[i][0]
+
+
+def test_rating_and_year_counts_match_sql(db, index):
+    result = index.search({"language_id": [2]})
+    for facet, column in (("rating", "rating"), ("year", "release_year")):
+        expected = dict(db.execute(
+            f"SELECT {column}, COUNT(*) FROM film WHERE language_id = 2 GROUP BY {column}"
+        ).fetchall())
+        counts = {value: count for value, count in _facet_counts(result, facet).items() if count}
+        assert counts == expected, facet
@@ -0,0 +1,86 @@
+from utils.filters import Filter, FilterSpec, fingerprint
+
+
+def _spec():
+    return FilterSpec(
+        "rentals",
+        filters=[
+            Filter("status", {"open": "r.return_date IS NULL", "returned": "r.return_date IS NOT NULL"}),
+            Filter("q", "(c.last_name LIKE %s OR f.title LIKE %s)", like=True, joins=["c", "f"]),
+            Filter("since", "r.rental_date >= %s"),
+        ],
+        select="""
+            SELECT r.rental_id
+            FROM rental r
+            JOIN customer c ON c.customer_id = r.customer_id
+            JOIN film f ON f.film_id = r.film_id
+            {where}
+            ORDER BY r.rental_date {direction}
+            LIMIT %s OFFSET %s
+        """,
+        count="SELECT COUNT(*) FROM rental r {joins} {where}",
+        joins={"c": "JOIN customer c ON c.customer_id = r.customer_id",
+               "f": "JOIN film f ON f.film_id = r.film_id"},
+    )
+
+
+def test_no_filters():
+    query = _spec().compile({}, direction="DESC")
+    assert query.mask == 0 and query.params == ()
+    assert query.sql == ("SELECT r.rental_id FROM rental r JOIN customer c ON c.customer_id = r.customer_id"
+                         " JOIN film f ON f.film_id = r.film_id ORDER BY r.rental_date DESC"
+                         " LIMIT %s OFFSET %s")
+    assert query.count_sql == "SELECT COUNT(*) FROM rental r"
+    assert query.fingerprint == fingerprint(query.sql)
+
+
+def test_active_filters_in_declared_order_with_params():
+    query = _spec().compile({"since": "2005-06-01", "q": "ann", "status": "open"}, direction="ASC")
+    assert ("WHERE r.return_date IS NULL AND (c.last_name LIKE %s OR f.title LIKE %s)"
+            " AND r.rental_date >= %s ORDER BY") in query.sql
+    assert query.params == ("%ann%", "%ann%", "2005-06-01")
+    assert query.count_sql == (
+        "SELECT COUNT(*) FROM rental r JOIN customer c ON c.customer_id = r.customer_id"
+        " JOIN film f ON f.film_id = r.film_id WHERE r.return_date IS NULL"
+        " AND (c.last_name LIKE %s OR f.title LIKE %s) AND r.rental_date >= %s")
+
+
+def test_falsy_and_unknown_values_are_inactive():
+    spec = _spec()
+    query = spec.compile({"status": "lost", "q": "", "since": None}, direction="ASC")
+    assert query.mask == 0 and "WHERE" not in query.sql and query.params == ()
+
+
+def test_count_joins_only_what_active_filters_need():
+    query = _spec().compile({"status": "returned"}, direction="ASC")
+    assert query.count_sql == "SELECT COUNT(*) FROM rental r WHERE r.return_date IS NOT NULL"
+
+
+def test_same_combination_gives_same_text_and_one_cache_entry():
+    spec = _spec()
+    first = spec.compile({"q": "ann", "status": "open"}, direction="ASC")
+    second = spec.compile({"q": "bob", "status": "open"}, direction="ASC")
+    assert (first.sql, first.fingerprint, first.mask) == (second.sql, second.fingerprint, second.mask)
+    assert first.params != second.params
+    returned = spec.compile({"q": "ann", "status": "returned"}, direction="ASC")
+    descending = spec.compile({"q": "ann", "status": "open"}, direction="DESC")
+    assert len({first.mask, returned.mask}) == 2
+    assert len({first.fingerprint, returned.fingerprint, descending.fingerprint}) == 3
+    assert len(spec.compiled()) == 3
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, params):
+        self.executed.append((sql, params))
+
+
+def test_run_appends_extra_params_and_records_timing():
+    query = _spec().compile({"since": "2005-06-01"}, direction="ASC")
+    cur = RecordingCursor()
+    query.run(cur, 20, 40)
+    query.run_count(cur)
+    assert cur.executed == [(query.sql, ("2005-06-01", 20, 40)),
+                            (query.count_sql, ("2005-06-01",))]
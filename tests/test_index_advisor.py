@@ -0,0 +1,76 @@
+from utils.index_advisor import findings, run
+
+
+class _Cursor:
+    def __init__(self, executed, dictionary=False):
+        self.executed = executed
+
+    def execute(self, sql, params=()):
+        self.executed.append(sql)
+        if sql.startswith("EXPLAIN ") and "boom" in sql:
+            raise RuntimeError("no such table: boom")
+
+    def fetchall(self):
+        last = self.executed[-1]
+        if last.startswith("EXPLAIN "):
+            return [{"table": "rental", "type": "ALL", "rows": 16044, "Extra": "Using filesort"}]
+        return [(1,)]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class _Connection:
+    def __init__(self, executed):
+        self.executed = executed
+
+    def cursor(self, **kwargs):
+        return _Cursor(self.executed, **kwargs)
+
+    def close(self):
+        pass
+
+
+def _read_then_write(daos):
+    with daos["films"].connection_factory() as cn, cn.cursor() as cur:
+        cur.execute("SELECT 1 FROM rental WHERE rental_id = %s", (1,))
+        assert cur.fetchall() == [(1,)]
+        cur.execute("DELETE FROM rental WHERE rental_id = %s", (1,))
+        assert cur.fetchall() == [] and cur.rowcount == 0
+
+
+def test_writes_are_explained_but_not_run():
+    executed = []
+    log = run(lambda: _Connection(executed), probes=[("probe", _read_then_write)])
+    assert [entry["sql"] for entry in log] == ["SELECT 1 FROM rental WHERE rental_id = %s",
+                                               "DELETE FROM rental WHERE rental_id = %s"]
+    assert all(entry["probe"] == "probe" for entry in log)
+    assert executed == ["EXPLAIN SELECT 1 FROM rental WHERE rental_id = %s",
+                        "SELECT 1 FROM rental WHERE rental_id = %s",
+                        "EXPLAIN DELETE FROM rental WHERE rental_id = %s"]
+
+
+def test_probe_errors_are_logged_not_raised():
+    def failing(daos):
+        with daos["films"].connection_factory() as cn, cn.cursor() as cur:
+            cur.execute("SELECT * FROM boom")
+
+    (entry,) = run(lambda: _Connection([]), probes=[("broken", failing)])
+    assert entry["probe"] == "broken" and entry["error"] == "no such table: boom"
+
+
+def test_findings():
+    plan = [
+        {"table": "rental", "type": "ALL", "rows": 16044, "Extra": "Using where; Using filesort"},
+        {"table": "category", "type": "ALL", "rows": 16, "Extra": "Using temporary"},
+        {"table": "payment", "type": "ref", "rows": 20, "Extra": "Using index"},
+    ]
+    assert findings({"plan": plan}) == ["full scan on rental (~16044 rows)", "filesort on rental",
+                                        "temporary table on category"]
+    assert findings({"plan": []}) == []
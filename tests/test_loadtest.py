@@ -0,0 +1,33 @@
+from utils.loadtest import find_knee, percentile
+
+
+def test_percentile_is_nearest_rank():
+    values = sorted([15, 20, 35, 40, 50])
+    assert percentile(values, 0.05) == 15
+    assert percentile(values, 0.30) == 20
+    assert percentile(values, 0.40) == 20
+    assert percentile(values, 0.50) == 35
+    assert percentile(values, 1.0) == 50
+    assert percentile([7], 0.99) == 7
+    assert percentile([], 0.5) is None
+
+
+def _steps(*pairs):
+    return [{"clerks": clerks, "throughput": throughput} for clerks, throughput in pairs]
+
+
+def test_knee_is_last_step_with_proportional_gain():
+    # Doubling clerks must add at least 25% throughput.
+    assert find_knee(_steps((1, 10), (2, 19), (4, 30), (8, 33), (16, 34))) == 4
+    assert find_knee(_steps((1, 10), (2, 12.5), (4, 13), (8, 40))) == 2
+    assert find_knee(_steps((1, 10), (2, 12.4), (4, 30))) == 1  # stops at the first shortfall
+
+
+def test_knee_with_steady_growth_is_the_last_step():
+    assert find_knee(_steps((1, 10), (2, 20), (4, 40))) == 4
+
+
+def test_knee_needs_two_steps_and_throughput():
+    assert find_knee(_steps((1, 10))) is None
+    assert find_knee([]) is None
+    assert find_knee(_steps((1, 0), (2, 5))) == 1
@@ -0,0 +1,36 @@
+import os
+
+from utils.migrations import MIGRATIONS_DIR, available, split_statements
+
+
+def test_versions_are_unique_and_in_order():
+    versions = [version for version, _, _ in available()]
+    assert versions == sorted(set(versions))
+    assert versions[0] == 1
+    assert all(os.path.dirname(path) == MIGRATIONS_DIR for _, _, path in available())
+
+
+def test_split_drops_comments_and_splits_at_line_ends():
+    sql = """
+        -- a comment; with a semicolon
+        CREATE TABLE t (
+          a INT,   -- trailing comments stay with their line
+          b VARCHAR(10) DEFAULT ';'
+        );
+        CREATE TRIGGER trg AFTER DELETE ON t FOR EACH ROW INSERT INTO u VALUES (OLD.a);
+
+        ALTER TABLE t ADD INDEX idx_b (b)
+    """
+    statements = split_statements(sql)
+    assert len(statements) == 3
+    assert statements[0].startswith("CREATE TABLE t (") and "DEFAULT ';'" in statements[0]
+    assert statements[1].endswith("VALUES (OLD.a)")
+    assert statements[2] == "ALTER TABLE t ADD INDEX idx_b (b)"
+
+
+def test_every_migration_splits_into_statements():
+    for version, name, path in available():
+        with open(path, encoding="utf-8") as fh:
+            statements = split_statements(fh.read())
+        assert statements, name
+        assert not any(s.upper().startswith("DELIMITER") for s in statements), name
@@ -0,0 +1,110 @@
+"""
+payment_daily_rollup is kept by +/- deltas inside each payment write
+(Payments._ROLLUP_SQL). After any sequence of writes it must equal a full
+GROUP BY over the payments.
+"""
+import pytest
+
+from tests.sqlite import database, factory
+from utils.table_operations import Payments
+
+SCHEMA = """
+    CREATE TABLE city (city_id INTEGER PRIMARY KEY, country_id INTEGER);
+    CREATE TABLE address (address_id INTEGER PRIMARY KEY, city_id INTEGER);
+    CREATE TABLE customer (customer_id INTEGER PRIMARY KEY, address_id INTEGER);
+    CREATE TABLE payment (payment_id INTEGER PRIMARY KEY AUTOINCREMENT, customer_id INTEGER,
+                          staff_id INTEGER, rental_id INTEGER, amount REAL, payment_date TEXT,
+                          payment_method TEXT);
+    CREATE TABLE payment_archive (payment_id INTEGER PRIMARY KEY);
+    CREATE TABLE customer_score_dirty (customer_id INTEGER PRIMARY KEY);
+    CREATE TABLE payment_daily_rollup (day TEXT, payment_method TEXT, country_id INTEGER,
+                                       total REAL, payment_count INTEGER,
+                                       PRIMARY KEY (day, payment_method, country_id));
+    INSERT INTO city VALUES (1, 10), (2, 20);
+    INSERT INTO address VALUES (1, 1), (2, 2);
+    INSERT INTO customer VALUES (1, 1), (2, 2), (3, 2);
+"""
+
+REBUILT = """
+    SELECT DATE(p.payment_date), COALESCE(p.payment_method, ''), ci.country_id,
+           SUM(p.amount), COUNT(*)
+    FROM payment p
+    JOIN customer c ON c.customer_id = p.customer_id
+    JOIN address a ON a.address_id = c.address_id
+    JOIN city ci ON ci.city_id = a.city_id
+    GROUP BY 1, 2, 3
+"""
+
+
+@pytest.fixture
+def db():
+    return database(SCHEMA)
+
+
+@pytest.fixture
+def payments(db):
+    return Payments(factory(db))
+
+
+def _rollup(db):
+    """Non-empty rollup buckets; a bucket emptied by deltas stays as a zero row."""
+    rows = db.execute("SELECT day, payment_method, country_id, total, payment_count"
+                      " FROM payment_daily_rollup WHERE payment_count <> 0").fetchall()
+    return sorted(rows)
+
+
+def _payment(customer_id, amount, when, method="cash"):
+    return {"customer_id": customer_id, "amount": amount, "payment_date": when,
+            "payment_method": method}
+
+
+def test_add_adds_to_its_bucket(db, payments):
+    payments.add_payment(_payment(1, 2.5, "2005-07-01T10:00"))
+    payments.add_payment(_payment(1, 4.25, "2005-07-01T18:30"))
+    payments.add_payment(_payment(2, 1.0, "2005-07-01T12:00"))
+    payments.add_payment(_payment(3, 3.0, "2005-07-02T09:00", method=None))
+    assert _rollup(db) == [("2005-07-01", "cash", 10, 6.75, 2),
+                           ("2005-07-01", "cash", 20, 1.0, 1),
+                           ("2005-07-02", "", 20, 3.0, 1)]
+    assert _rollup(db) == sorted(db.execute(REBUILT).fetchall())
+
+
+def test_update_moves_the_payment_between_buckets(db, payments):
+    payments.add_payment(_payment(1, 2.5, "2005-07-01T10:00"))
+    payments.add_payment(_payment(1, 4.25, "2005-07-01T11:00"))
+    # New amount, day, method and customer (so country) at once.
+    payments.update_payment(2, _payment(2, 8.0, "2005-07-03T11:00", method="card"))
+    assert _rollup(db) == [("2005-07-01", "cash", 10, 2.5, 1),
+                           ("2005-07-03", "card", 20, 8.0, 1)]
+    # Same bucket, new amount.
+    payments.update_payment(1, _payment(1, 0.5, "2005-07-01T23:59"))
+    assert _rollup(db) == [("2005-07-01", "cash", 10, 0.5, 1),
+                           ("2005-07-03", "card", 20, 8.0, 1)]
+    assert _rollup(db) == sorted(db.execute(REBUILT).fetchall())
+
+
+def test_delete_takes_the_payment_out(db, payments):
+    payments.add_payment(_payment(1, 2.5, "2005-07-01T10:00"))
+    payments.add_payment(_payment(1, 4.25, "2005-07-01T11:00"))
+    payments.delete_payment(1)
+    assert _rollup(db) == [("2005-07-01", "cash", 10, 4.25, 1)]
+    payments.delete_payment(2)
+    assert _rollup(db) == []
+    (zeroed,) = db.execute("SELECT total, payment_count FROM payment_daily_rollup").fetchall()
+    assert zeroed == (0, 0)
+
+
+def test_failed_write_leaves_the_rollup_alone(db, payments):
+    payments.add_payment(_payment(1, 2.5, "2005-07-01T10:00"))
+    before = _rollup(db)
+    with pytest.raises(ValueError):
+        payments.update_payment(1, _payment(99, 9.0, "2005-07-05T10:00"))
+    with pytest.raises(ValueError):
+        payments.add_payment(_payment(99, 9.0, "2005-07-05T10:00"))
+    assert _rollup(db) == before
+
+
+def test_writes_queue_customers_for_rescoring(db, payments):
+    payments.add_payment(_payment(1, 2.5, "2005-07-01T10:00"))
+    payments.update_payment(1, _payment(3, 2.5, "2005-07-01T10:00"))
+    assert db.execute("SELECT customer_id FROM customer_score_dirty ORDER BY 1").fetchall() == [(1,), (3,)]
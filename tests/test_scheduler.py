@@ -0,0 +1,107 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from utils.scheduler import Job, Schedule, Scheduler
+
+
+def _runs(expr, start, n):
+    schedule, at, runs = Schedule(expr), start, []
+    for _ in range(n):
+        at = schedule.next_after(at)
+        runs.append(at)
+    return runs
+
+
+def test_day_of_month_and_day_of_week_fire_on_either():
+    # 2024-09-13 is a Friday; the 13th of October is a Sunday.
+    runs = _runs("0 9 13 * 5", datetime(2024, 9, 12, 12), 4)
+    assert runs == [datetime(2024, 9, 13, 9), datetime(2024, 9, 20, 9),
+                    datetime(2024, 9, 27, 9), datetime(2024, 10, 4, 9)]
+    assert datetime(2024, 10, 13, 9) in _runs("0 9 13 * 5", datetime(2024, 10, 5), 3)
+
+
+def test_unrestricted_day_field_does_not_widen_the_other():
+    assert _runs("0 0 13 * *", datetime(2024, 9, 1), 2) == [datetime(2024, 9, 13), datetime(2024, 10, 13)]
+    assert _runs("0 0 * * 5", datetime(2024, 9, 1), 2) == [datetime(2024, 9, 6), datetime(2024, 9, 13)]
+
+
+def test_seven_is_sunday():
+    assert Schedule("0 0 * * 7").weekdays == {0}
+    assert Schedule("0 0 * * 5-7").weekdays == {0, 5, 6}
+    assert _runs("30 2 * * 7", datetime(2024, 9, 1, 3), 1) == [datetime(2024, 9, 8, 2, 30)]
+
+
+def test_lists_ranges_and_steps():
+    schedule = Schedule("*/15 8-10,22 * * 1-5")
+    assert schedule.minutes == {0, 15, 30, 45}
+    assert schedule.hours == {8, 9, 10, 22}
+    assert schedule.weekdays == {1, 2, 3, 4, 5}
+    assert Schedule("5/20 * * * *").minutes == {5, 25, 45}
+
+
+def test_next_run_is_strictly_after():
+    assert Schedule("@hourly").next_after(datetime(2024, 1, 1, 5)) == datetime(2024, 1, 1, 6)
+    assert Schedule("@monthly").next_after(datetime(2024, 12, 31, 23, 59)) == datetime(2025, 1, 1)
+
+
+def test_every():
+    assert Schedule("@every 90s").next_after(datetime(2024, 1, 1)) == datetime(2024, 1, 1, 0, 1, 30)
+    assert Schedule("@every 2h").next_after(datetime(2024, 1, 1)) == datetime(2024, 1, 1, 2)
+
+
+@pytest.mark.parametrize("expr", ["* * * *", "60 * * * *", "* 24 * * *", "0 0 0 * *",
+                                  "*/0 * * * *", "@every 0s", "0 0 31 2 *"])
+def test_invalid_schedules(expr):
+    with pytest.raises(ValueError):
+        Schedule(expr).next_after(datetime(2024, 1, 1))
+
+
+class _Connection:
+    """Records statements; every UPDATE matches `rowcount` rows."""
+
+    def __init__(self, rowcount=1):
+        self.executed = []
+        self.rowcount = rowcount
+        self._lock = threading.Lock()
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            self.executed.append(" ".join(sql.split()))
+
+    def fetchone(self):
+        return (datetime(2024, 1, 1),)
+
+    def renewals(self):
+        with self._lock:
+            return sum(sql.startswith("UPDATE scheduled_job SET locked_until") for sql in self.executed)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def test_lease_is_renewed_while_the_job_runs():
+    cn = _Connection()
+    scheduler = Scheduler(lambda: cn, worker_id="w1")
+    assert scheduler.run_job(Job("slow", "@hourly", lambda: time.sleep(0.2), lease=0.03))
+    assert cn.renewals() >= 3
+    assert "locked_by = NULL" in cn.executed[-1]
+    # The heartbeat has stopped with the job.
+    renewals = cn.renewals()
+    time.sleep(0.05)
+    assert cn.renewals() == renewals
+
+
+def test_heartbeat_stops_when_the_lease_is_lost():
+    cn = _Connection(rowcount=0)
+    scheduler = Scheduler(lambda: cn, worker_id="w1")
+    scheduler.run_job(Job("slow", "@hourly", lambda: time.sleep(0.2), lease=0.03))
+    assert cn.renewals() == 1
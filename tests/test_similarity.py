@@ -0,0 +1,65 @@
+"""
+An incremental similarity build reads only the histories around the films it
+rewrites. The lists it writes must match what a full build writes for them.
+"""
+import random
+from datetime import datetime
+
+from tests.sqlite import database, factory
+from utils import similarity
+
+SCHEMA = """
+    CREATE TABLE rental (rental_id INTEGER PRIMARY KEY, customer_id INTEGER, film_id INTEGER,
+                         last_update TIMESTAMP);
+    CREATE TABLE rental_archive (rental_id INTEGER PRIMARY KEY, customer_id INTEGER,
+                                 film_id INTEGER, last_update TIMESTAMP);
+    CREATE TABLE film_similar (film_id INTEGER, position INTEGER, similar_film_id INTEGER,
+                               score REAL, shared_customers INTEGER,
+                               PRIMARY KEY (film_id, position));
+    CREATE TABLE film_similar_state (id INTEGER PRIMARY KEY, rental_mark TIMESTAMP,
+                                     built_at TIMESTAMP);
+    INSERT INTO film_similar_state VALUES (1, NULL, NULL);
+"""
+
+
+def _catalog():
+    rng = random.Random(7)
+    db = database(SCHEMA)
+    old = datetime(2005, 6, 1)
+    for rental_id in range(1, 1501):
+        table = "rental_archive" if rental_id <= 300 else "rental"
+        db.execute(f"INSERT INTO {table} VALUES (?, ?, ?, ?)",
+                   (rental_id, rng.randrange(1, 400), rng.randrange(1, 40), old))
+    return db
+
+
+def _lists(db, films=None):
+    rows = db.execute("SELECT film_id, position, similar_film_id, score, shared_customers"
+                      " FROM film_similar ORDER BY film_id, position").fetchall()
+    return [row for row in rows if films is None or row[0] in films]
+
+
+def test_incremental_build_matches_full_build():
+    db = _catalog()
+    similarity.build(factory(db))
+    # Customer 5 rents three more films; only films in their history change.
+    db.executemany("INSERT INTO rental VALUES (?, 5, ?, ?)",
+                   [(2000 + film_id, film_id, datetime.now()) for film_id in (3, 11, 27)])
+    rewritten = similarity.build(factory(db))
+    affected = {film_id for (film_id,) in db.execute(
+        "SELECT film_id FROM rental WHERE customer_id = 5"
+        " UNION SELECT film_id FROM rental_archive WHERE customer_id = 5")}
+    assert rewritten == len(affected)
+    incremental = _lists(db, affected)
+
+    similarity.build(factory(db), full=True)
+    assert incremental == _lists(db, affected)
+    assert incremental
+
+
+def test_incremental_build_with_nothing_new_rewrites_nothing():
+    db = _catalog()
+    similarity.build(factory(db))
+    before = _lists(db)
+    assert similarity.build(factory(db)) == 0
+    assert _lists(db) == before
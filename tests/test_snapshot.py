@@ -0,0 +1,191 @@
+import random
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from tests.sqlite import database, factory
+from utils.cache import table_versions
+from utils.snapshot import _PAYMENT_SQL, DIM_TABLES, FACT_TABLES, FactSnapshot, _Facts
+from utils.table_operations import Payments
+
+
+def _snapshot(rows):
+    """A FactSnapshot holding `rows` (payment_id, customer_id, cents, date, method), no database."""
+    snap = FactSnapshot(connection_factory=None, max_age=3600)
+    snap._payments = _Facts(snap._payment_columns(rows))
+    snap._rentals = _Facts(snap._rental_columns([]))
+    snap._dims = {"country_of": np.array([-1, 1, 2], dtype=np.int32), "countries": {1: "A", 2: "B"},
+                  "customers": {1: {"customer_name": "One"}, 2: {"customer_name": "Two"}},
+                  "films": {}}
+    snap._versions = table_versions.get(*FACT_TABLES, *DIM_TABLES)
+    snap.refreshed_at = time.monotonic()
+    return snap
+
+
+def _period(day, granularity):
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return date(day.year, (day.month - 1) // 3 * 3 + 1, 1)
+
+
+@pytest.fixture(scope="module")
+def rows():
+    rng = random.Random(42)
+    start = datetime(2004, 12, 20)
+    rows = [(i, rng.choice([1, 2]), rng.randrange(1, 1200),
+             start + timedelta(minutes=rng.randrange(0, 60 * 24 * 500)), rng.choice(["cash", "card", ""]))
+            for i in range(1, 2001)]
+    # Bucket edges: Sunday night / Monday morning, last second of a quarter.
+    rows += [(3001, 1, 100, datetime(2005, 5, 29, 23, 59, 59), "cash"),
+             (3002, 1, 100, datetime(2005, 5, 30, 0, 0, 0), "cash"),
+             (3003, 2, 100, datetime(2005, 9, 30, 23, 59, 59), "card"),
+             (3004, 2, 100, datetime(1970, 1, 1, 12), "card")]
+    return rows
+
+
+@pytest.mark.parametrize("granularity", ["day", "week", "month", "quarter"])
+def test_revenue_buckets_match_calendar(rows, granularity):
+    expected = defaultdict(lambda: [0, 0])
+    for _, _, cents, when, _ in rows:
+        bucket = expected[_period(when.date(), granularity)]
+        bucket[0] += cents
+        bucket[1] += 1
+    series = _snapshot(rows).revenue_series(granularity, newest_first=False)
+    assert [r["period_start"] for r in series] == sorted(expected)
+    for r in series:
+        cents, count = expected[r["period_start"]]
+        assert (r["total"], r["payment_count"]) == (Decimal(cents).scaleb(-2), count)
+
+
+def test_bucket_labels(rows):
+    snap = _snapshot(rows)
+    weeks = {r["period_start"]: r["label"] for r in snap.revenue_series("week")}
+    assert weeks[date(2005, 5, 23)] == "Week of 2005-05-23"
+    assert weeks[date(2005, 5, 30)] == "Week of 2005-05-30"
+    assert date(1969, 12, 29) in weeks
+    quarters = {r["period_start"]: r["label"] for r in snap.revenue_series("quarter")}
+    assert quarters[date(2005, 7, 1)] == "2005 Q3"
+    months = snap.revenue_series("month")
+    assert months[0]["label"] > months[-1]["label"]          # newest first by default
+
+
+def test_filters_are_inclusive_days(rows):
+    snap = _snapshot(rows)
+    series = snap.revenue_series("day", start="2005-05-29", end="2005-05-30",
+                                 payment_method="cash", country_id=1, newest_first=False)
+    expected = defaultdict(int)
+    for _, customer_id, cents, when, method in rows:
+        if date(2005, 5, 29) <= when.date() <= date(2005, 5, 30) and method == "cash" and customer_id == 1:
+            expected[when.date()] += cents
+    assert {r["period_start"]: r["total"] for r in series} == {
+        day: Decimal(cents).scaleb(-2) for day, cents in expected.items()}
+
+
+def test_unknown_granularity():
+    with pytest.raises(ValueError):
+        _snapshot([]).revenue_series("year")
+
+
+def test_upsert_and_drop(rows):
+    snap = _snapshot(rows[:3])
+    facts = snap._payments
+    changed = snap._payment_columns([(2, 2, 999, datetime(2005, 1, 1), "card"),
+                                     (10, 1, 5, datetime(2005, 1, 2), "cash")])
+    updated = facts.upsert(changed)
+    assert list(updated.columns["id"]) == [1, 2, 3, 10]
+    assert updated.columns["cents"][updated.pos[2]] == 999
+    assert facts.columns["cents"][facts.pos[2]] == rows[1][2]      # copy-on-write
+    dropped = updated.drop([1, 10, 404])
+    assert list(dropped.columns["id"]) == [2, 3]
+    assert dropped.pos == {2: 0, 3: 1}
+
+
+class _RecordingConnection:
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def test_fetch_reads_hot_and_archived_rows():
+    cn = _RecordingConnection()
+    snap = FactSnapshot(lambda: cn)
+    snap._fetch(_PAYMENT_SQL)
+    snap._fetch(_PAYMENT_SQL, since=datetime(2005, 6, 1))
+    (full_sql, full_params), (since_sql, since_params) = cn.executed
+    assert "FROM payment_archive" in full_sql and "WHERE" not in full_sql and full_params == ()
+    assert since_sql.count("WHERE last_update >= %s") == 2
+    assert len(since_params) == 2 and since_params[0] < datetime(2005, 6, 1)
+
+
+# Just enough of sakila for FactSnapshot and Payments.delete_payment, with
+# the migration 004 delete trigger on payment.
+SAKILA = """
+    CREATE TABLE country (country_id INTEGER PRIMARY KEY, country TEXT, last_update TIMESTAMP);
+    CREATE TABLE city (city_id INTEGER PRIMARY KEY, city TEXT, country_id INTEGER,
+                       last_update TIMESTAMP);
+    CREATE TABLE address (address_id INTEGER PRIMARY KEY, city_id INTEGER, last_update TIMESTAMP);
+    CREATE TABLE customer (customer_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT,
+                           email TEXT, address_id INTEGER, last_update TIMESTAMP);
+    CREATE TABLE film (film_id INTEGER PRIMARY KEY, title TEXT, last_update TIMESTAMP);
+    CREATE TABLE payment (payment_id INTEGER PRIMARY KEY, customer_id INTEGER, amount REAL,
+                          payment_date TIMESTAMP, payment_method TEXT, last_update TIMESTAMP);
+    CREATE TABLE payment_archive (payment_id INTEGER PRIMARY KEY, customer_id INTEGER,
+                                  amount REAL, payment_date TIMESTAMP, payment_method TEXT,
+                                  last_update TIMESTAMP);
+    CREATE TABLE rental (rental_id INTEGER PRIMARY KEY, film_id INTEGER, customer_id INTEGER,
+                         rental_date TIMESTAMP, return_date TIMESTAMP, last_update TIMESTAMP);
+    CREATE TABLE rental_archive (rental_id INTEGER PRIMARY KEY, film_id INTEGER,
+                                 customer_id INTEGER, rental_date TIMESTAMP,
+                                 return_date TIMESTAMP, last_update TIMESTAMP);
+    CREATE TABLE customer_score_dirty (customer_id INTEGER PRIMARY KEY);
+    CREATE TABLE payment_daily_rollup (day TEXT, payment_method TEXT, country_id INTEGER,
+                                       total REAL, payment_count INTEGER,
+                                       PRIMARY KEY (day, payment_method, country_id));
+    CREATE TABLE row_tombstone (tombstone_id INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT,
+                                row_id INTEGER, deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+    CREATE TRIGGER payment_tombstone AFTER DELETE ON payment BEGIN
+        INSERT INTO row_tombstone (table_name, row_id) VALUES ('payment', OLD.payment_id);
+    END;
+    INSERT INTO country VALUES (1, 'Japan', '2006-02-15 04:44:00');
+    INSERT INTO city VALUES (1, 'Osaka', 1, '2006-02-15 04:45:25');
+    INSERT INTO address VALUES (1, 1, '2006-02-15 04:45:30'), (2, 1, '2006-02-15 04:45:30');
+    INSERT INTO customer VALUES (1, 'MARY', 'SMITH', 'mary@example.org', 1, '2006-02-15 04:57:20'),
+                                (2, 'JOHN', 'LAW', 'john@example.org', 2, '2006-02-15 04:57:20');
+    INSERT INTO payment VALUES (1, 1, 5.99, '2005-05-25 11:30:37', 'cash', '2006-02-15 22:12:30'),
+                               (2, 1, 9.99, '2005-05-28 10:35:23', 'card', '2006-02-15 22:12:30'),
+                               (3, 2, 4.99, '2005-06-15 00:54:12', 'cash', '2006-02-15 22:12:30');
+"""
+
+
+def test_local_delete_leaves_top_spenders():
+    db = database(SAKILA)
+    snap = FactSnapshot(factory(db), max_age=3600)
+    before = {r["customer_id"]: r["total_paid"] for r in snap.top_spenders()}
+    assert before == {1: Decimal("15.98"), 2: Decimal("4.99")}
+
+    Payments(factory(db)).delete_payment(2)
+    after = {r["customer_id"]: r["total_paid"] for r in snap.top_spenders()}
+    assert after == {1: Decimal("5.99"), 2: Decimal("4.99")}
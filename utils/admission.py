@@ -0,0 +1,156 @@
+"""
+Admission control: per route class bulkheads in front of the views.
+
+Each request is put in a class: "analytics" for the dashboard aggregates,
+"crud" for writes and single-record pages, "list" for the other pages. Views
+can be tagged explicitly with @admission.route_class(name) or
+@admission.exempt. Static files and asset bundles are always exempt. Each class has its own Bulkhead. At most `limit` of its
+requests run at once, and up to `queue` more wait, each for at most
+`timeout` seconds. A request that finds the queue full, or waits too long,
+gets 503 with Retry-After instead of opening one more connection. A burst on
+the dashboards then queues behind its own limit, while CRUD keeps its
+capacity.
+
+Limits are per process. stats() (served on /stats/admission) reports, per
+class, the limit, queue depth, in-flight and waiting requests, counters, and
+the wait and service time histograms.
+"""
+import math
+import threading
+import time
+
+from flask import g, request
+
+from utils.metrics import RollingHistogram
+
+# File endpoints (Flask's static files, utils/assets.py bundles) never touch MySQL.
+EXEMPT_ENDPOINTS = ("static", "assets")
+
+
+class Overloaded(Exception):
+    def __init__(self, bulkhead, reason):
+        super().__init__(f"{bulkhead.name}: {reason}")
+        self.bulkhead = bulkhead
+        self.reason = reason
+
+
+class Bulkhead:
+    def __init__(self, name, limit, queue, timeout, retry_after=1):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timeouts = 0
+        self.wait_ms = RollingHistogram()
+        self.service_ms = RollingHistogram()
+
+    def acquire(self):
+        """Take a slot, waiting up to `timeout`; raises Overloaded instead of waiting longer."""
+        start = time.monotonic()
+        with self._cond:
+            if self.in_flight >= self.limit or self.waiting:
+                if self.waiting >= self.queue:
+                    self.shed += 1
+                    raise Overloaded(self, "queue full")
+                self.waiting += 1
+                deadline = start + self.timeout
+                try:
+                    while self.in_flight >= self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            raise Overloaded(self, "timed out in queue")
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            self.admitted += 1
+        self.wait_ms.observe((time.monotonic() - start) * 1000)
+
+    def release(self, started):
+        self.service_ms.observe((time.monotonic() - started) * 1000)
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            counts = dict(limit=self.limit, queue=self.queue, timeout_s=self.timeout,
+                          in_flight=self.in_flight, waiting=self.waiting,
+                          admitted=self.admitted, shed=self.shed, timeouts=self.timeouts)
+        counts["wait_ms"] = self.wait_ms.snapshot()
+        counts["service_ms"] = self.service_ms.snapshot()
+        return counts
+
+
+class Admission:
+    def __init__(self, app=None, classes=None):
+        self.bulkheads = {name: Bulkhead(name, **spec) for name, spec in (classes or {}).items()}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+
+    # ---- tagging -------------------------------------------------------
+
+    @staticmethod
+    def route_class(name):
+        """Put a view in class `name` (place it under @app.route)."""
+        def decorator(view):
+            view.admission_class = name
+            return view
+        return decorator
+
+    @staticmethod
+    def exempt(view):
+        """Never queue or shed this view (health probes, metrics)."""
+        view.admission_class = None
+        return view
+
+    def classify(self):
+        view = self.app.view_functions.get(request.endpoint)
+        if view is None or request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        if hasattr(view, "admission_class"):
+            return view.admission_class
+        if request.method not in ("GET", "HEAD") or request.view_args:
+            return "crud"
+        return "list"
+
+    # ---- request hooks -------------------------------------------------
+
+    def before_request(self):
+        bulkhead = self.bulkheads.get(self.classify())
+        if bulkhead is None:
+            return None
+        try:
+            bulkhead.acquire()
+        except Overloaded as e:
+            # Roughly the time for the queue ahead to drain, at least the class default.
+            p50 = e.bulkhead.service_ms.snapshot()["p50"] or 0
+            drain = p50 / 1000 * (e.bulkhead.waiting + 1) / e.bulkhead.limit
+            retry_after = max(e.bulkhead.retry_after, math.ceil(drain))
+            return (f"Busy ({e}), please retry in {retry_after}s.", 503,
+                    {"Retry-After": str(retry_after), "Content-Type": "text/plain"})
+        g.admission = (bulkhead, time.monotonic())
+        return None
+
+    def teardown_request(self, exc=None):
+        # Streamed pages keep the request context, and so the slot, until the
+        # body is sent.
+        admitted = g.pop("admission", None)
+        if admitted is not None:
+            bulkhead, started = admitted
+            bulkhead.release(started)
+
+    def stats(self):
+        return {name: b.stats() for name, b in self.bulkheads.items()}
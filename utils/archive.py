@@ -0,0 +1,213 @@
+"""
+Cold archive for old payments and closed rentals (migration 010).
+
+    python -m utils.archive run [--older-than-days 730] [--batch-size 1000]
+    python -m utils.archive status
+
+run() moves rows dated before the cutoff from payment / rental into
+payment_archive / rental_archive. It works in batches, one transaction per
+batch (copy, then delete), so the hot tables stay small and no long lock is
+held. Rentals move only once returned, and open rentals stay hot whatever
+their age.
+
+A move is not a delete: the tombstones the hot table's delete trigger writes
+(migration 004) are removed in the same transaction, so the change feed and
+its subscribers keep the rows. The rows moved are also added, in the same
+transaction, to per-customer and per-film totals (migration 012), which the
+all-time aggregates read next to the hot tables instead of the archive.
+
+archive_state records, per table, the date below which rows may be archived.
+The data layer reads it to decide whether a lookup or search has to include
+the archive (see Rentals.search / Payments.search). The mark only moves
+forward: rows on or after it are never in the archive.
+
+Partition maintenance (utils/partitions.py, archive=True) moves whole months
+the same way and records the same mark.
+"""
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from utils.cache import table_versions
+
+# table -> (primary key, date column, extra condition for rows that may move)
+TABLES = {
+    "payment": ("payment_id", "payment_date", None),
+    "rental": ("rental_id", "rental_date", "return_date IS NOT NULL"),
+}
+
+
+TOTALS_TABLES = ("customer_archive_total", "film_archive_total")
+
+# table -> statements adding rows about to be archived to the archive totals
+# (migration 012). {source} is the hot table or one of its partitions, as t.
+_TOTALS = {
+    "payment": ["""
+        INSERT INTO customer_archive_total
+            (customer_id, payment_total, payment_count, first_payment, last_payment)
+        SELECT t.customer_id, SUM(t.amount), COUNT(*), MIN(t.payment_date), MAX(t.payment_date)
+        FROM {source} t {where}
+        GROUP BY t.customer_id
+        ON DUPLICATE KEY UPDATE
+            payment_total = payment_total + VALUES(payment_total),
+            payment_count = payment_count + VALUES(payment_count),
+            first_payment = LEAST(COALESCE(first_payment, VALUES(first_payment)), VALUES(first_payment)),
+            last_payment = GREATEST(COALESCE(last_payment, VALUES(last_payment)), VALUES(last_payment))
+    """],
+    "rental": ["""
+        INSERT INTO customer_archive_total (customer_id, rental_count)
+        SELECT t.customer_id, COUNT(*) FROM {source} t {where}
+        GROUP BY t.customer_id
+        ON DUPLICATE KEY UPDATE rental_count = rental_count + VALUES(rental_count)
+    """, """
+        INSERT INTO film_archive_total (film_id, rental_count)
+        SELECT t.film_id, COUNT(*) FROM {source} t {where}
+        GROUP BY t.film_id
+        ON DUPLICATE KEY UPDATE rental_count = rental_count + VALUES(rental_count)
+    """],
+}
+
+
+def archive_table(table: str) -> str:
+    return f"{table}_archive"
+
+
+def _columns(cur, table) -> List[str]:
+    cur.execute("""
+        SELECT COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        ORDER BY ORDINAL_POSITION
+    """, (table,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def copy_columns(cur, table: str) -> str:
+    """
+    Column list for copying `table` rows into its archive. Copying by name
+    lets the archive be altered independently as long as it keeps every hot
+    column.
+    """
+    archived = set(_columns(cur, archive_table(table)))
+    return ", ".join(c for c in _columns(cur, table) if c in archived)
+
+
+def add_totals(cur, table: str, source: str, condition: str = "", params=()):
+    """
+    Add the rows of `source` (aliased t) matching `condition` to the archive
+    totals, leaving out rows the archive already holds, as the INSERT IGNORE
+    that copies them does. Run in the copying transaction, before the copy.
+    """
+    key = TABLES[table][0]
+    where = f"WHERE NOT EXISTS (SELECT 1 FROM {archive_table(table)} x WHERE x.{key} = t.{key})"
+    if condition:
+        where += f" AND {condition}"
+    for sql in _TOTALS[table]:
+        cur.execute(sql.format(source=source, where=where), params)
+
+
+def drop_tombstones(cur, table: str, ids, after: int):
+    """
+    Take back the row_tombstone entries that the delete trigger wrote for
+    rows moved to the archive (tombstone_id > `after`, read before the
+    delete). Run in the moving transaction, so the change feed and the
+    export never see them.
+    """
+    marks = ", ".join(["%s"] * len(ids))
+    cur.execute(f"""
+        DELETE FROM row_tombstone
+        WHERE tombstone_id > %s AND table_name = %s AND row_id IN ({marks})
+    """, [after, table, *ids])
+
+
+def record(cur, table: str, before, rows: int):
+    """Advance the table's archive mark (never backwards) inside the caller's transaction."""
+    cur.execute("""
+        INSERT INTO archive_state (table_name, archived_before, rows_archived)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE archived_before = GREATEST(archived_before, VALUES(archived_before)),
+                                rows_archived = rows_archived + VALUES(rows_archived)
+    """, (table, before, rows))
+
+
+def cutoffs(connection_factory) -> Dict[str, datetime]:
+    with connection_factory() as cn, cn.cursor() as cur:
+        cur.execute("SELECT table_name, archived_before FROM archive_state")
+        return dict(cur.fetchall())
+
+
+def move(connection_factory, table: str, before: datetime, batch_size: int = 1000) -> int:
+    """Move `table` rows dated before `before` into its archive. Returns rows moved."""
+    key, date_col, condition = TABLES[table]
+    extra = f" AND {condition}" if condition else ""
+    moved = 0
+    with connection_factory() as cn, cn.cursor() as cur:
+        columns = copy_columns(cur, table)
+        while True:
+            cn.start_transaction()
+            try:
+                cur.execute(f"""
+                    SELECT {key} FROM {table}
+                    WHERE {date_col} < %s{extra}
+                    ORDER BY {date_col}
+                    LIMIT %s
+                    FOR UPDATE
+                """, (before, batch_size))
+                ids = [row[0] for row in cur.fetchall()]
+                if ids:
+                    marks = ", ".join(["%s"] * len(ids))
+                    add_totals(cur, table, table, f"t.{key} IN ({marks})", ids)
+                    cur.execute(f"""
+                        INSERT IGNORE INTO {archive_table(table)} ({columns})
+                        SELECT {columns} FROM {table} WHERE {key} IN ({marks})
+                    """, ids)
+                    cur.execute("SELECT COALESCE(MAX(tombstone_id), 0) FROM row_tombstone")
+                    (last_tombstone,) = cur.fetchone()
+                    cur.execute(f"DELETE FROM {table} WHERE {key} IN ({marks})", ids)
+                    drop_tombstones(cur, table, ids, last_tombstone)
+                record(cur, table, before, len(ids))
+                cn.commit()
+            except Exception:
+                cn.rollback()
+                raise
+            moved += len(ids)
+            if len(ids) < batch_size:
+                break
+    table_versions.bump(table, archive_table(table), "archive_state", *TOTALS_TABLES)
+    return moved
+
+
+def run(connection_factory, older_than_days: int = 730, batch_size: int = 1000) -> Dict[str, int]:
+    with connection_factory() as cn, cn.cursor() as cur:
+        cur.execute("SELECT NOW()")
+        before = cur.fetchone()[0] - timedelta(days=older_than_days)
+    return {table: move(connection_factory, table, before, batch_size) for table in TABLES}
+
+
+def main(argv=None):
+    import settings
+    from utils.db import get_connection
+
+    parser = argparse.ArgumentParser(description="DataTrack cold archive")
+    parser.add_argument("command", choices=["run", "status"])
+    parser.add_argument("--older-than-days", type=int, default=settings.archive_after_days)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        for table, n in run(get_connection, args.older_than_days, args.batch_size).items():
+            print(f"{table}: moved {n} row(s)")
+        return
+    marks = cutoffs(get_connection)
+    with get_connection() as cn, cn.cursor() as cur:
+        for table in TABLES:
+            counts = []
+            for name in (table, archive_table(table)):
+                cur.execute(f"SELECT COUNT(*) FROM {name}")
+                counts.append(cur.fetchone()[0])
+            mark: Optional[datetime] = marks.get(table)
+            print(f"{table:<8} hot={counts[0]:<8} archived={counts[1]:<8} "
+                  f"archived before {mark or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Self-hosted static asset pipeline.
+
+    python -m utils.assets fetch   # download the pinned third-party CSS and fonts into static/vendor
+    python -m utils.assets build   # bundle + minify CSS, fingerprint, precompress into static/dist
+
+The vendored files are committed under static/vendor, so the store network
+never talks to a CDN. `fetch` needs internet access and is only for updating
+them. Bootstrap and Bootstrap Icons are the pinned releases below. fonts.css
+declares Inter only: the Outfit heading font has not been vendored, and
+style.css falls back to Inter for headings.
+
+`build` writes static/dist/manifest.json mapping logical names ("app.css")
+to content-hashed file names. Those files are served from /assets
+with a one-year immutable Cache-Control, plus their .br/.gz twins when the
+client accepts them. static/dist is not committed. With build_assets_on_start
+(settings.py) the app builds it at start when it is missing or older than a
+source; otherwise run `build` as a deploy step.
+
+Templates call asset_url("app.css"). It returns None when no build exists,
+and base.html then links the vendored files one by one from /static.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import urllib.parse
+import urllib.request
+
+from flask import request, send_from_directory, url_for, abort
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip twins are written without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(ROOT, "static")
+VENDOR_DIR = os.path.join(STATIC_DIR, "vendor")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST = os.path.join(DIST_DIR, "manifest.json")
+
+# Pinned third-party stylesheets, fetched into static/vendor/<name>.
+VENDOR = {
+    "fonts.css": "https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600"
+                 "&family=Outfit:wght@300;400;500;600;700&display=swap",
+    "bootstrap.min.css": "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css",
+    "bootstrap-icons.min.css": "https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/bootstrap-icons.min.css",
+}
+
+# Bundle order: later files override earlier ones.
+BUNDLES = {
+    "app.css": [
+        os.path.join(VENDOR_DIR, "fonts.css"),
+        os.path.join(VENDOR_DIR, "bootstrap.min.css"),
+        os.path.join(VENDOR_DIR, "bootstrap-icons.min.css"),
+        os.path.join(STATIC_DIR, "css", "style.css"),
+    ],
+}
+
+COMPRESSIBLE = (".css", ".js", ".svg", ".json", ".txt")
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Google Fonts picks the font format from the User-Agent; ask for woff2.
+_UA = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+_URL_RE = re.compile(r"url\(\s*(['\"]?)([^'\")]+)\1\s*\)")
+
+
+def _download(url):
+    req = urllib.request.Request(url, headers={"User-Agent": _UA})
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return resp.read()
+
+
+def fetch():
+    """Download VENDOR stylesheets and every file they reference into static/vendor."""
+    files_dir = os.path.join(VENDOR_DIR, "files")
+    os.makedirs(files_dir, exist_ok=True)
+
+    for name, url in VENDOR.items():
+        css = _download(url).decode("utf-8")
+
+        def localize(m):
+            ref = m.group(2)
+            if ref.startswith("data:") or ref.startswith("#"):
+                return m.group(0)
+            absolute = urllib.parse.urljoin(url, ref)
+            path = urllib.parse.urlsplit(absolute)
+            fname = os.path.basename(path.path)
+            with open(os.path.join(files_dir, fname), "wb") as fh:
+                fh.write(_download(absolute))
+            suffix = f"#{path.fragment}" if path.fragment else ""
+            return f'url("files/{fname}{suffix}")'
+
+        css = _URL_RE.sub(localize, css)
+        css = re.sub(r"/\*#\s*sourceMappingURL=.*?\*/", "", css)
+        with open(os.path.join(VENDOR_DIR, name), "w", encoding="utf-8") as fh:
+            fh.write(f"/* {url} */\n" + css)
+        print(f"fetched {name}")
+
+
+def minify_css(css):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,])\s*", r"\1", css)
+    css = css.replace(";}", "}")
+    return css.strip()
+
+
+def _fingerprint(data, name):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+def _write(name, data):
+    with open(os.path.join(DIST_DIR, name), "wb") as fh:
+        fh.write(data)
+    if name.endswith(COMPRESSIBLE):
+        with open(os.path.join(DIST_DIR, name + ".gz"), "wb") as fh:
+            fh.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(os.path.join(DIST_DIR, name + ".br"), "wb") as fh:
+                fh.write(brotli.compress(data, quality=11))
+
+
+def build():
+    """Bundle, minify, fingerprint and precompress; returns the manifest."""
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    os.makedirs(DIST_DIR)
+    manifest = {}
+    copied = {}
+
+    for bundle, sources in BUNDLES.items():
+        parts = []
+        for src in sources:
+            if not os.path.exists(src):
+                raise SystemExit(f"missing {os.path.relpath(src, ROOT)} - run `python -m utils.assets fetch` first")
+            with open(src, encoding="utf-8") as fh:
+                css = fh.read()
+            # Remote @imports are replaced by the vendored copies in the bundle.
+            css = re.sub(r"@import\s+url\(['\"]?https?://[^)]*\)\s*;", "", css)
+            base = os.path.dirname(src)
+
+            def rewrite(m):
+                ref = m.group(2)
+                if ref.startswith(("data:", "#", "http:", "https:")):
+                    return m.group(0)
+                path, _, frag = ref.partition("#")
+                path = path.split("?")[0]
+                local = os.path.normpath(os.path.join(base, path))
+                if local not in copied:
+                    with open(local, "rb") as fh:
+                        data = fh.read()
+                    copied[local] = _fingerprint(data, os.path.basename(local))
+                    _write(copied[local], data)
+                    manifest[os.path.relpath(local, STATIC_DIR).replace(os.sep, "/")] = copied[local]
+                return f"url({copied[local]}{'#' + frag if frag else ''})"
+
+            parts.append(_URL_RE.sub(rewrite, css))
+
+        data = minify_css("\n".join(parts)).encode("utf-8")
+        manifest[bundle] = _fingerprint(data, bundle)
+        _write(manifest[bundle], data)
+
+    with open(MANIFEST, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    return manifest
+
+
+def stale() -> bool:
+    """True when there is no build, or a bundled source changed after it."""
+    try:
+        built = os.path.getmtime(MANIFEST)
+    except OSError:
+        return True
+    return any(os.path.getmtime(src) > built
+               for sources in BUNDLES.values() for src in sources if os.path.exists(src))
+
+
+class Assets:
+    """Flask integration: the /assets route and the asset_url() template helper."""
+
+    def __init__(self, app=None):
+        self._manifest = None
+        self._mtime = None
+        if app is not None:
+            self.init_app(app)
+
+    def manifest(self):
+        try:
+            mtime = os.path.getmtime(MANIFEST)
+        except OSError:
+            return {}
+        if mtime != self._mtime:
+            with open(MANIFEST, encoding="utf-8") as fh:
+                self._manifest = json.load(fh)
+            self._mtime = mtime
+        return self._manifest
+
+    def asset_url(self, name):
+        hashed = self.manifest().get(name)
+        return url_for("assets", filename=hashed) if hashed else None
+
+    def serve(self, filename):
+        if filename not in self.manifest().values():
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        encoding = None
+        accepted = request.accept_encodings
+        for enc, ext in (("br", ".br"), ("gzip", ".gz")):
+            if accepted[enc] and os.path.exists(os.path.join(DIST_DIR, filename + ext)):
+                encoding, filename = enc, filename + ext
+                break
+        response = send_from_directory(DIST_DIR, filename, mimetype=mimetype, max_age=31536000)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Cache-Control"] = IMMUTABLE
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def ensure_built(self):
+        """Build static/dist if it is stale; a failed build leaves the unbundled fallback."""
+        if not stale():
+            return
+        try:
+            build()
+            logger.info("asset bundle built")
+        except (OSError, SystemExit) as e:
+            logger.warning("asset build failed, serving the vendored files unbundled: %s", e)
+
+    def init_app(self, app):
+        app.add_url_rule("/assets/<path:filename>", "assets", self.serve)
+        app.jinja_env.globals["asset_url"] = self.asset_url
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DataTrack static asset pipeline")
+    parser.add_argument("command", choices=["fetch", "build"])
+    args = parser.parse_args(argv)
+    if args.command == "fetch":
+        fetch()
+    else:
+        for name, hashed in sorted(build().items()):
+            print(f"{name} -> {hashed}")
+
+
+if __name__ == "__main__":
+    main()
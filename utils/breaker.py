@@ -0,0 +1,145 @@
+"""
+Circuit breaker around the database connection factory.
+
+utils/db.get_connection() asks the breaker before every checkout and reports
+back how the connection went. The breaker only counts connection-level
+failures: the server refused or timed out the connection, or the connection
+was lost. Errors in statements, such as a duplicate key, neither count nor
+reset the count. Neither do a full pool and queries stopped by their
+deadline. Those happen under load while MySQL is healthy, and admission
+control (utils/admission.py) and the deadline fallbacks (utils/deadlines.py)
+deal with them.
+
+  closed     every call goes through. After `failures` failures in a row the
+             breaker opens.
+  open       calls fail at once with CircuitOpen, without waiting on the pool
+             or the network, for `reset_after` seconds.
+  half-open  the first call after that runs `probe` (a SELECT 1 on its own
+             connection with a short timeout) before its checkout. Success
+             closes the breaker and the call goes ahead. Failure opens it
+             for another `reset_after` seconds. Other calls fail while the
+             probe runs.
+
+While the breaker is open, cached_page serves read pages from their last good
+copy, cached_query and @deadline methods return their last result, and the
+app refuses writes with 503. stats() is served on /stats/breaker.
+"""
+import threading
+import time
+
+import mysql.connector
+from mysql.connector import errorcode
+from mysql.connector.errors import InterfaceError
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+# Cannot connect (socket, TCP), server gone away, connection lost mid-query.
+CONNECTION_ERRNOS = (
+    errorcode.CR_CONNECTION_ERROR,
+    errorcode.CR_CONN_HOST_ERROR,
+    errorcode.CR_SERVER_GONE_ERROR,
+    errorcode.CR_SERVER_LOST,
+    errorcode.CR_SERVER_LOST_EXTENDED,
+)
+
+
+class CircuitOpen(InterfaceError):
+    def __init__(self, retry_after):
+        super().__init__(msg=f"database unavailable, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def is_outage(error) -> bool:
+    """Errors that say the server cannot be reached, not that it is busy or the statement was wrong."""
+    if isinstance(error, CircuitOpen):
+        return False
+    if isinstance(error, (InterfaceError, ConnectionError, TimeoutError)):
+        return True
+    return isinstance(error, mysql.connector.Error) and error.errno in CONNECTION_ERRNOS
+
+
+class CircuitBreaker:
+    def __init__(self, probe, failures=5, reset_after=10.0):
+        self.probe = probe
+        self.failures = failures
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failed = 0
+        self.opened_at = None       # time.time() of the last trip, for the stale banner
+        self._retry_at = 0.0
+        self._probing = False
+        self.trips = 0
+        self.rejected = 0
+        self.probes = 0
+        self.last_error = None
+
+    # ---- checks --------------------------------------------------------
+
+    def retry_after(self) -> int:
+        return max(int(self._retry_at - time.monotonic()) + 1, 1)
+
+    @property
+    def rejecting(self) -> bool:
+        """Open and not yet due for a probe: calls would fail at once."""
+        with self._lock:
+            return (self.state == OPEN and time.monotonic() < self._retry_at
+                    or self.state == HALF_OPEN and self._probing)
+
+    def before(self):
+        """Called before a checkout; raises CircuitOpen instead of trying."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self._probing or time.monotonic() < self._retry_at:
+                self.rejected += 1
+                raise CircuitOpen(self.retry_after())
+            self.state, self._probing = HALF_OPEN, True
+            self.probes += 1
+        try:
+            self.probe()
+        except Exception as e:
+            with self._lock:
+                self._probing = False
+                self._trip(e)
+                self.rejected += 1
+                raise CircuitOpen(self.retry_after()) from e
+        with self._lock:
+            self._probing = False
+            self.state, self.failed = CLOSED, 0
+
+    # ---- reports -------------------------------------------------------
+
+    def record(self, error=None):
+        """Outcome of a call: None for success, else the exception it raised."""
+        if error is None:
+            with self._lock:
+                self.failed = 0
+        elif is_outage(error):
+            with self._lock:
+                self.failed += 1
+                self.last_error = str(error)
+                if self.state == CLOSED and self.failed >= self.failures:
+                    self._trip(error)
+
+    def _trip(self, error):
+        self.state = OPEN
+        self.opened_at = time.time()
+        self._retry_at = time.monotonic() + self.reset_after
+        self.trips += 1
+        self.last_error = str(error)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures_in_a_row": self.failed,
+                "threshold": self.failures,
+                "opened_at": self.opened_at,
+                "retry_in_s": (max(round(self._retry_at - time.monotonic(), 1), 0)
+                               if self.state != CLOSED else None),
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "probes": self.probes,
+                "last_error": self.last_error,
+            }
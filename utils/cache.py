@@ -0,0 +1,109 @@
+"""
+In-process cache bookkeeping shared by the data layer and the web layer.
+
+TableVersions keeps one counter per table. The write methods in
+table_operations bump the tables they touch after commit, and anything that
+caches query results keys on those counters, so a cached entry goes stale
+exactly when one of its tables changes.
+
+Counters live in process memory. Writes made by another process are only seen
+once something bumps the counter here as well.
+
+@cached_query("language") memoizes a data-access method on top of the
+counters; it is meant for small lookup lists (languages, categories,
+countries) that every form page reads. While the database circuit breaker
+is open (utils/breaker.py), an entry is returned even after its ttl.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from utils.breaker import CircuitOpen
+
+
+class TableVersions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        # Counters restart at zero with the process; the epoch keeps keys built
+        # before a restart from matching keys built after it.
+        self.epoch = f"{os.getpid():x}.{int(time.time()):x}"
+
+    def bump(self, *tables):
+        with self._lock:
+            for t in tables:
+                self._versions[t] = self._versions.get(t, 0) + 1
+
+    def get(self, *tables):
+        with self._lock:
+            return tuple(self._versions.get(t, 0) for t in tables)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._versions)
+
+
+class LRUCache:
+    """Small thread-safe LRU map with a fixed number of entries."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+table_versions = TableVersions()
+query_cache = LRUCache(max_entries=256)
+
+
+def cached_query(*tables, ttl=300):
+    """
+    Memoize a DAO method per (connection factory, arguments) until one of
+    `tables` is bumped, or for at most `ttl` seconds so writes made by other
+    processes still show up. Callers must treat the result as read-only.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            key = (func.__qualname__, self.connection_factory, args,
+                   tuple(sorted(kwargs.items())), table_versions.get(*tables))
+            hit = query_cache.get(key)
+            if hit is not None and hit[0] > time.monotonic():
+                return hit[1]
+            try:
+                value = func(self, *args, **kwargs)
+            except CircuitOpen:
+                if hit is None:
+                    raise
+                return hit[1]
+            query_cache.set(key, (time.monotonic() + ttl, value))
+            return value
+        return wrapper
+    return decorator
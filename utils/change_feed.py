@@ -0,0 +1,186 @@
+"""
+Change feed over the last_update columns (migration 004).
+
+ChangeFeed.poll() reads, for every tracked table, the rows whose last_update
+moved past the table's watermark, plus new row_tombstone entries for deletes,
+and hands each table's changes to the subscribers as one ChangeBatch.
+
+Rows are read in (last_update, primary key) order with a keyset cursor, so a
+batch limit never skips rows that share a timestamp. Only rows at least `lag`
+seconds old (by the database clock) are consumed: last_update has one-second
+resolution and is set when a statement runs, not when its transaction commits,
+so a fresh watermark could otherwise jump over a row that commits late.
+
+The feed starts at the current end of every table (prime()); it reports
+changes, not history.
+
+film_category and film_actor have two-column keys; their deletes are
+reported as (first, second) tuples, in TRACKED's column order.
+
+Not tracked: tables derived from tracked ones, which the app writes in the
+same transaction or rebuilds in a job (payment_daily_rollup, customer_score,
+customer_score_dirty, film_similar, film_similar_state, late_fee,
+payment_archive, rental_archive, archive_state), and bookkeeping tables
+(row_tombstone, scheduled_job, schema_migrations). They have no last_update
+index or delete trigger; caches over them are invalidated only by this
+process's own writes and their TTL.
+
+    feed = ChangeFeed(get_connection)
+    feed.subscribe(lambda batch: table_versions.bump(batch.table))
+    feed.start(interval=5)
+"""
+import logging
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# table -> primary key column(s). Every table here has an idx_<table>_last_update
+# index and an AFTER DELETE trigger writing to row_tombstone (migrations 004, 011).
+TRACKED = {
+    "film": ("film_id",),
+    "actor": ("actor_id",),
+    "customer": ("customer_id",),
+    "address": ("address_id",),
+    "city": ("city_id",),
+    "country": ("country_id",),
+    "payment": ("payment_id",),
+    "rental": ("rental_id",),
+    "category": ("category_id",),
+    "language": ("language_id",),
+    "film_category": ("film_id", "category_id"),
+    "film_actor": ("actor_id", "film_id"),
+    "open_rentals": ("film_id",),
+}
+
+
+class ChangeBatch(NamedTuple):
+    table: str
+    upserted: List[dict]    # full rows inserted or updated since the last batch
+    deleted: list           # primary keys of deleted rows (tuples for two-column keys)
+
+
+class ChangeFeed:
+    def __init__(self, connection_factory, tables=None, lag=2, batch_size=1000):
+        self.connection_factory = connection_factory
+        self.tables = {t: TRACKED[t] for t in (tables or TRACKED)}
+        self.lag = lag
+        self.batch_size = batch_size
+        self._subscribers: List[tuple] = []
+        self._marks: Optional[Dict[str, tuple]] = None   # table -> (last_update, key tuple)
+        self._tombstone_id = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def subscribe(self, callback: Callable[[ChangeBatch], None], tables=None):
+        """Call callback(batch) for changes to `tables` (default: all tracked tables)."""
+        self._subscribers.append((callback, set(tables) if tables else None))
+
+    def prime(self):
+        """Move every watermark to the current end of its table."""
+        marks = {}
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            for table, key in self.tables.items():
+                cur.execute(f"SELECT MAX(last_update) FROM {table}")
+                newest = cur.fetchone()[0]
+                cur.execute(f"""
+                    SELECT {', '.join(key)} FROM {table} WHERE last_update = %s
+                    ORDER BY {', '.join(f'{c} DESC' for c in key)} LIMIT 1
+                """, (newest,))
+                marks[table] = (newest, tuple(cur.fetchone() or (0,) * len(key)))
+            cur.execute("SELECT COALESCE(MAX(tombstone_id), 0) FROM row_tombstone")
+            self._tombstone_id = cur.fetchone()[0]
+        self._marks = marks
+
+    def _changed_rows(self, cur, table, key):
+        newest, last_key = self._marks[table]
+        columns = ", ".join(key)
+        after = (f"(last_update > %s OR (last_update = %s AND ({columns}) > "
+                 f"({', '.join(['%s'] * len(key))})))")
+        where, params = ["last_update <= NOW() - INTERVAL %s SECOND"], [self.lag]
+        if newest is not None:
+            where.append(after)
+            params += [newest, newest, *last_key]
+        rows = []
+        while True:
+            cur.execute(f"""
+                SELECT * FROM {table}
+                WHERE {' AND '.join(where)}
+                ORDER BY last_update, {columns}
+                LIMIT %s
+            """, params + [self.batch_size])
+            page = cur.fetchall()
+            rows += page
+            if len(page) < self.batch_size:
+                break
+            newest, last_key = page[-1]["last_update"], tuple(page[-1][c] for c in key)
+            where[1:] = [after]
+            params[1:] = [newest, newest, *last_key]
+        if rows:
+            self._marks[table] = (rows[-1]["last_update"], tuple(rows[-1][c] for c in key))
+        return rows
+
+    def _tombstones(self, cur):
+        cur.execute("""
+            SELECT tombstone_id, table_name, row_id, row_id2
+            FROM row_tombstone
+            WHERE tombstone_id > %s AND deleted_at <= NOW() - INTERVAL %s SECOND
+            ORDER BY tombstone_id
+        """, (self._tombstone_id, self.lag))
+        deleted: Dict[str, list] = {}
+        for row in cur.fetchall():
+            self._tombstone_id = row["tombstone_id"]
+            row_id = row["row_id"] if row["row_id2"] is None else (row["row_id"], row["row_id2"])
+            deleted.setdefault(row["table_name"], []).append(row_id)
+        return deleted
+
+    def poll(self) -> List[ChangeBatch]:
+        """Read pending changes, notify subscribers and return the batches."""
+        with self._lock:
+            if self._marks is None:
+                self.prime()
+                return []
+            batches = []
+            with self.connection_factory() as cn, cn.cursor(dictionary=True) as cur:
+                deleted = self._tombstones(cur)
+                for table, key in self.tables.items():
+                    upserted = self._changed_rows(cur, table, key)
+                    if upserted or deleted.get(table):
+                        batches.append(ChangeBatch(table, upserted, deleted.get(table, [])))
+
+        for batch in batches:
+            for callback, tables in self._subscribers:
+                if tables is None or batch.table in tables:
+                    callback(batch)
+        return batches
+
+    def purge_tombstones(self, keep_days=7):
+        """Delete tombstones older than keep_days; returns the number removed."""
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            cur.execute("DELETE FROM row_tombstone WHERE deleted_at < NOW() - INTERVAL %s DAY",
+                        (keep_days,))
+            return cur.rowcount
+
+    # ---- background polling ---------------------------------------------
+
+    def _run(self, interval):
+        # The first poll primes the watermarks, so an unreachable database
+        # does not hold up the process start.
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("change feed poll failed")
+            if self._stop.wait(interval):
+                return
+
+    def start(self, interval=5):
+        """Poll every `interval` seconds in a daemon thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval,),
+                                            name="change-feed", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,185 @@
+"""
+Database connections.
+
+get_connection() is the connection factory every DAO uses. With db_pool_size
+set in settings.py it hands out connections from a bounded pool instead of
+opening a new MySQL connection per call; closing (or leaving the `with` block
+of) a pooled connection returns it to the pool.
+
+The pool waits at most db_pool_timeout seconds for a free connection and then
+raises PoolExhausted, and it keeps the counters (in use, waits, timeouts)
+that /readyz uses to report saturation.
+
+Inside a query deadline (utils/deadlines.py) the wait is bounded by the time
+left, and the connection gets that time as its max_execution_time.
+
+With use_circuit_breaker set, checkouts go through a CircuitBreaker
+(utils/breaker.py): while MySQL is down or stalled they fail at once with
+CircuitOpen instead of each waiting out the pool timeout.
+"""
+import threading
+import time
+
+import mysql.connector
+from mysql.connector import pooling
+from mysql.connector.errors import PoolError
+
+import settings
+from utils import deadlines
+from utils.breaker import CircuitBreaker
+from utils.metrics import RollingHistogram
+
+_CONFIG = dict(
+    host=settings.db_host,
+    user=settings.db_user,
+    password=settings.db_password,
+    database=settings.db_name,
+    charset="utf8mb4",
+    autocommit=True,
+)
+
+
+class PoolExhausted(PoolError):
+    pass
+
+
+class _PooledConnection:
+    """Connection handed out by ConnectionPool; close() gives it back."""
+
+    max_execution_ms = 0      # set by deadlines.attach()
+    deadline_scope = None
+
+    def __init__(self, pool, cn):
+        self._pool = pool
+        self._cn = cn
+
+    def __getattr__(self, attr):
+        return getattr(self._cn, attr)
+
+    def close(self):
+        if self._cn is None:
+            return
+        cn, self._cn = self._cn, None
+        try:
+            deadlines.detach(self)
+            # Sessions are not reset on return (that would also reset
+            # autocommit), so never hand out a half-finished transaction
+            # or a deadline's execution limit.
+            if cn.in_transaction:
+                cn.rollback()
+            if self.max_execution_ms:
+                with cn.cursor() as cur:
+                    cur.execute("SET SESSION max_execution_time = DEFAULT")
+        finally:
+            cn.close()
+            self._pool._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        if breaker is not None:
+            breaker.record(exc)
+
+
+class ConnectionPool:
+    def __init__(self, size, timeout, **config):
+        self.size = size
+        self.timeout = timeout
+        self._config = config
+        self._pool = None
+        self._init_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_ms = RollingHistogram()
+
+    def _mysql_pool(self):
+        # Created on first use: building the pool opens `size` connections.
+        if self._pool is None:
+            with self._init_lock:
+                if self._pool is None:
+                    self._pool = pooling.MySQLConnectionPool(
+                        pool_name="datatrack", pool_size=self.size,
+                        pool_reset_session=False, **self._config)
+        return self._pool
+
+    def connection(self, timeout=None):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout if timeout is None else timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolExhausted(f"no free database connection within {self.timeout}s "
+                                f"({self.size} in use)")
+        self.wait_ms.observe((time.monotonic() - started) * 1000)
+        try:
+            cn = self._mysql_pool().get_connection()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+        return _PooledConnection(self, cn)
+
+    def _release(self):
+        with self._lock:
+            self.in_use -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self.in_use,
+                "available": self.size - self.in_use,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_ms": self.wait_ms.snapshot(),
+            }
+
+
+pool = (ConnectionPool(settings.db_pool_size, settings.db_pool_timeout, **_CONFIG)
+        if settings.db_pool_size else None)
+
+
+def connect(**overrides):
+    """A new, unpooled connection."""
+    return mysql.connector.connect(**{**_CONFIG, **overrides})
+
+
+def _probe():
+    # Its own connection, so a stuck pool cannot make the probe wait.
+    with connect(connection_timeout=settings.breaker_probe_timeout) as cn, cn.cursor() as cur:
+        cur.execute("SELECT 1")
+        cur.fetchall()
+
+
+breaker = (CircuitBreaker(_probe, failures=settings.breaker_failures,
+                          reset_after=settings.breaker_reset_seconds)
+           if settings.use_circuit_breaker else None)
+
+
+def get_connection():
+    if breaker is not None:
+        breaker.before()
+    left = deadlines.remaining()
+    try:
+        if pool is not None:
+            cn = pool.connection(timeout=None if left is None else min(left, pool.timeout))
+        else:
+            cn = connect()
+    except (mysql.connector.Error, OSError) as e:
+        if breaker is not None:
+            breaker.record(e)
+        raise
+    if breaker is not None and pool is None:
+        breaker.record()    # unpooled connections report nothing when closed
+    try:
+        return deadlines.attach(cn)
+    except BaseException:
+        cn.close()          # gives the pool slot back
+        raise
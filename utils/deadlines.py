@@ -0,0 +1,241 @@
+"""
+Per-call query deadlines for the data layer.
+
+@deadline(ms) on a DAO method gives each call a time budget. Nested calls get
+the smaller of their own budget and what is left of the caller's. While the
+call runs:
+
+  * every connection it checks out (utils/db.get_connection) gets
+    SET SESSION max_execution_time = <remaining ms>. MySQL then aborts a
+    SELECT that runs past the deadline (error 3024). The pooled connection
+    resets the limit when it is given back;
+  * waiting for a pooled connection is bounded by the remaining time;
+  * a watchdog thread sends KILL QUERY for the call's connections, from a
+    separate connection, once the deadline has passed by `grace` seconds.
+    This covers what max_execution_time does not: writes, locks and
+    statements stuck on the network (error 1317 on the client).
+
+When a call runs out of time it is counted as a hit, and then, in order:
+
+  1. the last good result for the same arguments is returned (stale=True);
+  2. fallback(self, *args, **kwargs) is returned, a partial answer such as
+     None for an unknown count;
+  3. DeadlineExceeded is raised, and the app turns it into a 503.
+
+Results served by 1 or 2 set g.degraded inside a request, so cached_page
+neither caches nor ETags the page built from them. While the database circuit
+breaker is open (utils/breaker.py), calls return their last good result the
+same way, or raise CircuitOpen. stats() reports calls,
+hits and fallbacks per method (served on /stats/deadlines).
+"""
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from functools import wraps
+
+import mysql.connector
+from flask import g, has_app_context
+from mysql.connector.errors import PoolError
+
+import settings
+from utils.breaker import CircuitOpen
+from utils.cache import LRUCache
+
+ER_QUERY_INTERRUPTED = 1317   # KILL QUERY
+ER_QUERY_TIMEOUT = 3024       # max_execution_time exceeded
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, method, budget_ms):
+        super().__init__(f"{method} did not finish within {budget_ms} ms")
+        self.method = method
+        self.budget_ms = budget_ms
+
+
+class _Scope:
+    def __init__(self, method, expires):
+        self.method = method
+        self.expires = expires
+        self.lock = threading.Lock()
+        self.connections = {}     # id(connection) -> MySQL connection id
+        self.done = False
+        self.killed = False
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+
+_current = contextvars.ContextVar("deadline_scope", default=None)
+
+
+def remaining():
+    """Seconds left in the current deadline, or None outside one."""
+    scope = _current.get()
+    return None if scope is None else max(scope.remaining(), 0.0)
+
+
+def attach(cn):
+    """Apply the current deadline to a freshly checked-out connection."""
+    scope = _current.get()
+    if scope is None:
+        return cn
+    ms = max(int(scope.remaining() * 1000), 1)
+    with cn.cursor() as cur:
+        cur.execute("SET SESSION max_execution_time = %s", (ms,))
+    cn.max_execution_ms = ms
+    with scope.lock:
+        scope.connections[id(cn)] = cn.connection_id
+    cn.deadline_scope = scope
+    return cn
+
+
+def detach(cn):
+    """Called when a connection goes back: the watchdog must not kill it any more."""
+    scope = getattr(cn, "deadline_scope", None)
+    if scope is not None:
+        # Waits for a KILL in progress, so it cannot hit the next borrower.
+        with scope.lock:
+            scope.connections.pop(id(cn), None)
+
+
+class _Watchdog:
+    def __init__(self, grace=0.25):
+        self.grace = grace
+        self._heap = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def watch(self, scope):
+        with self._cond:
+            heapq.heappush(self._heap, (scope.expires + self.grace, next(self._order), scope))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="deadline-watchdog",
+                                                daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                _, _, scope = heapq.heappop(self._heap)
+            if not scope.done:
+                self._kill(scope)
+
+    @staticmethod
+    def _kill(scope):
+        from utils.db import connect
+
+        with scope.lock:
+            if scope.done or not scope.connections:
+                return
+            scope.killed = True
+            try:
+                # Unpooled, so a saturated pool cannot delay the kill, and with
+                # a short connect timeout, so an unreachable server cannot
+                # hold up the kills queued behind this one.
+                with connect(connection_timeout=settings.breaker_probe_timeout) as cn, \
+                        cn.cursor() as cur:
+                    for connection_id in scope.connections.values():
+                        cur.execute("KILL QUERY %s", (connection_id,))
+            except (mysql.connector.Error, OSError):
+                pass    # the query ended on its own, or the server is unreachable
+
+
+watchdog = _Watchdog()
+
+
+class DeadlineStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, method, budget_ms, ms, outcome):
+        with self._lock:
+            entry = self._stats.setdefault(method, {
+                "method": method, "budget_ms": budget_ms, "calls": 0, "hits": 0,
+                "stale": 0, "partial": 0, "errors": 0, "max_ms": 0.0,
+            })
+            entry["calls"] += 1
+            entry["max_ms"] = max(entry["max_ms"], round(ms, 1))
+            if outcome != "ok":
+                entry["hits"] += 1
+                entry[outcome] += 1
+
+    def snapshot(self):
+        with self._lock:
+            rows = [dict(e) for e in self._stats.values()]
+        return sorted(rows, key=lambda r: (-r["hits"], r["method"]))
+
+
+deadline_stats = DeadlineStats()
+_last_good = LRUCache(max_entries=256)
+
+
+def _timed_out(error, scope):
+    if isinstance(error, PoolError):
+        return scope.remaining() <= 0    # gave up waiting for a connection at the deadline
+    return error.errno in (ER_QUERY_TIMEOUT, ER_QUERY_INTERRUPTED) or scope.killed
+
+
+def _degraded():
+    if has_app_context():
+        g.degraded = True
+
+
+def deadline(ms, fallback=None, stale=True):
+    """Give each call of a DAO method `ms` milliseconds (settings.query_deadlines_ms overrides)."""
+    def decorator(func):
+        name = func.__qualname__
+
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not settings.use_query_deadlines:
+                return func(self, *args, **kwargs)
+            budget = settings.query_deadlines_ms.get(name, ms)
+            started = time.monotonic()
+            expires = started + budget / 1000
+            outer = _current.get()
+            if outer is not None:
+                expires = min(expires, outer.expires)
+            scope = _Scope(name, expires)
+            token = _current.set(scope)
+            watchdog.watch(scope)
+            key = (name, self.connection_factory, args, tuple(sorted(kwargs.items())))
+            try:
+                result = func(self, *args, **kwargs)
+            except CircuitOpen:
+                previous = _last_good.get(key) if stale else None
+                if previous is None:
+                    raise
+                _degraded()
+                return previous
+            except mysql.connector.Error as e:
+                if not _timed_out(e, scope):
+                    raise
+                elapsed = (time.monotonic() - started) * 1000
+                previous = _last_good.get(key) if stale else None
+                if previous is not None:
+                    deadline_stats.record(name, budget, elapsed, "stale")
+                    _degraded()
+                    return previous
+                if fallback is not None:
+                    deadline_stats.record(name, budget, elapsed, "partial")
+                    _degraded()
+                    return fallback(self, *args, **kwargs)
+                deadline_stats.record(name, budget, elapsed, "errors")
+                raise DeadlineExceeded(name, budget) from e
+            finally:
+                scope.done = True
+                _current.reset(token)
+            deadline_stats.record(name, budget, (time.monotonic() - started) * 1000, "ok")
+            if stale:
+                _last_good.set(key, result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,433 @@
+"""
+Columnar snapshot export for offline analytics.
+
+    python -m utils.export run [--out exports/snapshot] [--full] [--chunk-size 50000]
+    python -m utils.export status [--out exports/snapshot]
+    python -m utils.export report [--out exports/snapshot]
+
+run() writes film, customer, address, city, country, rental and payment as
+zstd-compressed Parquet under out/<table>/. rental and payment are split by
+month (month=YYYY-MM/), so a reader that filters on the month only opens
+those files. Rows are streamed from an unbuffered cursor chunk_size at a
+time, so neither MySQL nor this process holds a whole table. Archived rows
+(migration 010) are exported with the hot ones.
+
+The first run, and every --full run, writes a complete copy of each table and
+swaps it in. Later runs are incremental: they add the rows with last_update
+at or after the previous watermark as new files, and the keys deleted since
+then (row_tombstone, migration 004) under <table>/_deleted/. Readers keep
+the newest version of each key and drop deleted keys. A full run compacts
+the table back to one file set. Tombstones are purged after a week, so a run
+whose watermark is older than that is done in full.
+
+SnapshotReader answers the dashboard aggregates (the FactSnapshot queries)
+from the exported files, read through memory maps, without touching MySQL.
+After an incremental run it applies only the new files: the rows of the
+newer runs and their _deleted keys. After a full run it loads again.
+
+Requires pyarrow (optional dependency).
+"""
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from utils.snapshot import WATERMARK_OVERLAP, FactSnapshot, _Facts
+
+MANIFEST = "_manifest.json"
+
+# ChangeFeed.purge_tombstones keeps 7 days; stay safely inside that.
+MAX_INCREMENTAL_AGE = timedelta(days=6)
+
+
+class Column(NamedTuple):
+    name: str
+    type: pa.DataType
+    sql: Optional[str] = None    # expression when it is not the bare column
+
+
+class ExportTable(NamedTuple):
+    key: str
+    columns: List[Column]
+    month_of: Optional[str] = None   # partition by the month of this column
+    archived: bool = False           # also read <table>_archive
+
+
+_ID = pa.int32()
+_TS = pa.timestamp("s")
+
+TABLES = {
+    "film": ExportTable("film_id", [
+        Column("film_id", _ID), Column("title", pa.string()), Column("description", pa.string()),
+        Column("release_year", pa.int16()), Column("language_id", pa.int16()),
+        Column("rental_duration", pa.int16()), Column("rental_rate", pa.decimal128(4, 2)),
+        Column("length", pa.int16()), Column("replacement_cost", pa.decimal128(5, 2)),
+        Column("rating", pa.string()),
+        Column("special_features", pa.string(), "CAST(special_features AS CHAR)"),
+        Column("last_update", _TS),
+    ]),
+    "customer": ExportTable("customer_id", [
+        Column("customer_id", _ID), Column("first_name", pa.string()),
+        Column("last_name", pa.string()), Column("email", pa.string()),
+        Column("address_id", _ID), Column("active", pa.int8()),
+        Column("create_date", _TS), Column("last_update", _TS),
+    ]),
+    "address": ExportTable("address_id", [
+        Column("address_id", _ID), Column("address", pa.string()), Column("address2", pa.string()),
+        Column("district", pa.string()), Column("city_id", _ID),
+        Column("postal_code", pa.string()), Column("phone", pa.string()),
+        Column("last_update", _TS),
+    ]),
+    "city": ExportTable("city_id", [
+        Column("city_id", _ID), Column("city", pa.string()), Column("country_id", _ID),
+        Column("last_update", _TS),
+    ]),
+    "country": ExportTable("country_id", [
+        Column("country_id", _ID), Column("country", pa.string()), Column("last_update", _TS),
+    ]),
+    "rental": ExportTable("rental_id", [
+        Column("rental_id", _ID), Column("rental_date", _TS), Column("film_id", _ID),
+        Column("customer_id", _ID), Column("return_date", _TS), Column("due_date", _TS),
+        Column("last_update", _TS),
+    ], month_of="rental_date", archived=True),
+    "payment": ExportTable("payment_id", [
+        Column("payment_id", _ID), Column("customer_id", _ID), Column("rental_id", _ID),
+        Column("amount", pa.decimal128(5, 2)), Column("payment_date", _TS),
+        Column("payment_method", pa.string()), Column("last_update", _TS),
+    ], month_of="payment_date", archived=True),
+}
+
+
+def read_manifest(out: str) -> Dict:
+    try:
+        with open(os.path.join(out, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"runs": 0, "tables": {}}
+
+
+def _write_manifest(out: str, manifest: Dict):
+    path = os.path.join(out, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _schema(spec: ExportTable) -> pa.Schema:
+    fields = [pa.field(c.name, c.type) for c in spec.columns] + [pa.field("export_run", pa.int32())]
+    if spec.month_of:
+        fields.append(pa.field("month", pa.string()))
+    return pa.schema(fields)
+
+
+def _to_arrow(rows, spec: ExportTable, run_no: int) -> pa.Table:
+    columns = list(zip(*rows))
+    arrays = [pa.array(values, type=c.type) for values, c in zip(columns, spec.columns)]
+    arrays.append(pa.array([run_no] * len(rows), type=pa.int32()))
+    if spec.month_of:
+        dates = columns[[c.name for c in spec.columns].index(spec.month_of)]
+        arrays.append(pa.array([d.strftime("%Y-%m") for d in dates], type=pa.string()))
+    return pa.Table.from_arrays(arrays, schema=_schema(spec))
+
+
+def _select(name: str, spec: ExportTable, since) -> str:
+    columns = ", ".join(f"{c.sql} AS {c.name}" if c.sql else c.name for c in spec.columns)
+    where = " WHERE last_update >= %s" if since is not None else ""
+    sources = [name, f"{name}_archive"] if spec.archived else [name]
+    return " UNION ALL ".join(f"SELECT {columns} FROM {table}{where}" for table in sources)
+
+
+def export_table(connection_factory, out: str, name: str, run_no: int,
+                 since: Optional[datetime] = None, chunk_size: int = 50000) -> int:
+    """Write `name` (all rows, or those changed since `since`) under out/<name>. Returns rows written."""
+    spec = TABLES[name]
+    target = os.path.join(out, name)
+    dest = target if since is not None else os.path.join(out, f".{name}-run{run_no}")
+    sql = _select(name, spec, since)
+    written, chunk = 0, 0
+    with connection_factory() as cn:
+        with cn.cursor(buffered=False) as cur:
+            cur.execute(sql, (since,) * sql.count("%s"))
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                pq.write_to_dataset(
+                    _to_arrow(rows, spec, run_no), dest,
+                    partition_cols=["month"] if spec.month_of else None,
+                    basename_template=f"run{run_no:05d}-{chunk:05d}-{{i}}.parquet",
+                    compression="zstd", existing_data_behavior="overwrite_or_ignore")
+                written += len(rows)
+                chunk += 1
+        os.makedirs(dest, exist_ok=True)
+
+        if since is not None:
+            # Moving a row to the archive deletes it from the hot table; that is
+            # not a delete as far as the export is concerned.
+            kept = (f" AND NOT EXISTS (SELECT 1 FROM {name}_archive a WHERE a.{spec.key} = t.row_id)"
+                    if spec.archived else "")
+            with cn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT row_id, deleted_at FROM row_tombstone t
+                    WHERE table_name = %s AND deleted_at >= %s{kept}
+                """, (name, since))
+                deleted = cur.fetchall()
+            if deleted:
+                os.makedirs(os.path.join(dest, "_deleted"), exist_ok=True)
+                keys, times = zip(*deleted)
+                pq.write_table(pa.table({"key": pa.array(keys, type=_ID),
+                                         "deleted_at": pa.array(times, type=_TS)}),
+                               os.path.join(dest, "_deleted", f"run{run_no:05d}.parquet"),
+                               compression="zstd")
+
+    if since is None:
+        # Swap the complete copy in; readers see either the old or the new set.
+        old = os.path.join(out, f".{name}-old{run_no}")
+        if os.path.exists(target):
+            os.rename(target, old)
+        os.rename(dest, target)
+        shutil.rmtree(old, ignore_errors=True)
+    return written
+
+
+def run(connection_factory, out: str, full: bool = False, chunk_size: int = 50000) -> Dict[str, Dict]:
+    """Export every table, incrementally where a recent enough watermark exists."""
+    os.makedirs(out, exist_ok=True)
+    manifest = read_manifest(out)
+    run_no = manifest["runs"] + 1
+    with connection_factory() as cn, cn.cursor() as cur:
+        cur.execute("SELECT NOW()")
+        started = cur.fetchone()[0]
+
+    report = {}
+    for name in TABLES:
+        state = manifest["tables"].get(name)
+        since = None
+        if state and not full:
+            watermark = datetime.fromisoformat(state["watermark"])
+            if started - watermark <= MAX_INCREMENTAL_AGE:
+                since = watermark - WATERMARK_OVERLAP
+        rows = export_table(connection_factory, out, name, run_no, since, chunk_size)
+        state = {
+            "watermark": started.isoformat(sep=" "),
+            "full_run": run_no if since is None else state["full_run"],
+            "rows_written": rows if since is None else state["rows_written"] + rows,
+        }
+        manifest["tables"][name] = state
+        report[name] = {"mode": "full" if since is None else "incremental", "rows": rows}
+    manifest["runs"] = run_no
+    _write_manifest(out, manifest)
+    return report
+
+
+def _latest(table: pa.Table, key: str) -> pa.Table:
+    """One row per key: the version from the newest export run."""
+    if table.num_rows == 0:
+        return table
+    table = table.sort_by([(key, "ascending"), ("export_run", "descending")])
+    ids = table[key].to_numpy()
+    keep = np.ones(len(ids), dtype=bool)
+    keep[1:] = ids[1:] != ids[:-1]
+    return table.filter(pa.array(keep))
+
+
+def read_table(out: str, name: str) -> pa.Table:
+    """The current rows of an exported table: newest version per key, deletes applied."""
+    key = TABLES[name].key
+    path = os.path.join(out, name)
+    table = pq.read_table(path, memory_map=True)
+    if table.num_columns == 0:      # exported while empty
+        table = _schema(TABLES[name]).empty_table()
+    table = _latest(table, key)
+    deleted_path = os.path.join(path, "_deleted")
+    if os.path.isdir(deleted_path):
+        deleted = (pq.read_table(deleted_path, memory_map=True)
+                   .group_by("key").aggregate([("deleted_at", "max")]))
+        columns = table.column_names
+        table = table.join(deleted, keys=key, right_keys="key", join_type="left outer")
+        gone = pc.fill_null(pc.less_equal(table["last_update"], table["deleted_at_max"]), False)
+        table = table.filter(pc.invert(gone)).select(columns)
+    return table
+
+
+def _rows_after(out: str, name: str, run_no: int) -> pa.Table:
+    """Rows that export runs after `run_no` wrote for `name`, newest version per key."""
+    spec = TABLES[name]
+    dataset = ds.dataset(os.path.join(out, name), format="parquet", partitioning="hive")
+    if "export_run" not in dataset.schema.names:     # nothing written yet
+        return _schema(spec).empty_table()
+    return _latest(dataset.to_table(filter=ds.field("export_run") > run_no), spec.key)
+
+
+def _deleted_after(out: str, name: str, run_no: int, last_run: int) -> Dict[int, datetime]:
+    """key -> deleted_at for the keys that runs run_no + 1 .. last_run deleted from `name`."""
+    deleted = {}
+    for n in range(run_no + 1, last_run + 1):
+        path = os.path.join(out, name, "_deleted", f"run{n:05d}.parquet")
+        if os.path.exists(path):
+            for row in pq.read_table(path).to_pylist():
+                deleted[row["key"]] = max(row["deleted_at"], deleted.get(row["key"], row["deleted_at"]))
+    return deleted
+
+
+class SnapshotReader(FactSnapshot):
+    """FactSnapshot over an export directory instead of the live database.
+
+    Catches up (apply) when the manifest changes after the next export run.
+    """
+
+    def __init__(self, out: str):
+        super().__init__(connection_factory=None)
+        self.out = out
+        self._manifest_mtime = None
+        self._run = 0            # last export run loaded
+
+    def _methods_of(self, column):
+        encoded = pc.fill_null(column, "").combine_chunks().dictionary_encode()
+        codes = np.array([self._method_code(v) for v in encoded.dictionary.to_pylist()],
+                         dtype=np.int16)
+        return codes[encoded.indices.to_numpy()]
+
+    def _load_dims(self):
+        countries = {r["country_id"]: r["country"]
+                     for r in read_table(self.out, "country").select(["country_id", "country"]).to_pylist()}
+        cities = {r["city_id"]: r for r in read_table(self.out, "city").to_pylist()}
+        city_of = {r["address_id"]: r["city_id"] for r in
+                   read_table(self.out, "address").select(["address_id", "city_id"]).to_pylist()}
+        films = {r["film_id"]: r["title"]
+                 for r in read_table(self.out, "film").select(["film_id", "title"]).to_pylist()}
+        customers = read_table(self.out, "customer").to_pylist()
+
+        size = max([c["customer_id"] for c in customers], default=0) + 1
+        country_of = np.full(size, -1, dtype=np.int32)
+        info = {}
+        for c in customers:
+            city = cities.get(city_of.get(c["address_id"]))
+            if city is None:
+                continue
+            country_of[c["customer_id"]] = city["country_id"]
+            info[c["customer_id"]] = {"customer_name": f"{c['first_name']} {c['last_name']}",
+                                      "email": c["email"], "city": city["city"],
+                                      "country": countries.get(city["country_id"])}
+        return {"country_of": country_of, "customers": info,
+                "countries": countries, "films": films}
+
+    def _payment_columns(self, pay):
+        amounts = pay["amount"].cast(pa.float64()).to_numpy()
+        return {
+            "id": pay["payment_id"].to_numpy().astype(np.int64),
+            "customer_id": pay["customer_id"].to_numpy().astype(np.int32),
+            "cents": np.rint(amounts * 100).astype(np.int64),
+            "date": pay["payment_date"].to_numpy().astype("datetime64[s]"),
+            "method": self._methods_of(pay["payment_method"]),
+        }
+
+    @staticmethod
+    def _rental_columns(rent):
+        return {
+            "id": rent["rental_id"].to_numpy().astype(np.int64),
+            "film_id": rent["film_id"].to_numpy().astype(np.int32),
+            "customer_id": rent["customer_id"].to_numpy().astype(np.int32),
+            "rental_date": rent["rental_date"].to_numpy().astype("datetime64[s]"),
+            "return_date": rent["return_date"].to_numpy().astype("datetime64[s]"),
+        }
+
+    def load(self):
+        with self._lock:
+            mtime = os.path.getmtime(os.path.join(self.out, MANIFEST))
+            manifest = read_manifest(self.out)
+            self._payments = _Facts(self._payment_columns(read_table(self.out, "payment")))
+            self._rentals = _Facts(self._rental_columns(read_table(self.out, "rental")))
+            self._dims = self._load_dims()
+            self._manifest_mtime = mtime
+            self._run = manifest["runs"]
+
+    refresh = load
+
+    def _catch_up(self, facts, name, columns_of, last_run):
+        rows = _rows_after(self.out, name, self._run)
+        deleted = _deleted_after(self.out, name, self._run, last_run)
+        if deleted and rows.num_rows:
+            # A key written again after its delete is back.
+            keys = rows[TABLES[name].key].to_pylist()
+            updated = rows["last_update"].to_pylist()
+            rows = rows.filter(pa.array([k not in deleted or u > deleted[k]
+                                         for k, u in zip(keys, updated)]))
+        return facts.drop(list(deleted)).upsert(columns_of(rows))
+
+    def apply(self, batch=None):
+        """Apply the export runs written since the last load: their rows and _deleted keys.
+
+        `batch` is ignored; the reader follows the export files, so it can
+        subscribe to anything that signals a finished run.
+        """
+        mtime = os.path.getmtime(os.path.join(self.out, MANIFEST))
+        manifest = read_manifest(self.out)
+        if self._payments is None or any(manifest["tables"][name]["full_run"] > self._run
+                                         for name in ("payment", "rental")):
+            return self.load()      # a full run replaced the files that were loaded
+        with self._lock:
+            last_run = manifest["runs"]
+            if last_run > self._run:
+                self._payments = self._catch_up(self._payments, "payment",
+                                                self._payment_columns, last_run)
+                self._rentals = self._catch_up(self._rentals, "rental",
+                                               self._rental_columns, last_run)
+                self._dims = self._load_dims()
+                self._run = last_run
+            self._manifest_mtime = mtime
+
+    def _current(self):
+        if self._payments is None:
+            self.load()
+        elif os.path.getmtime(os.path.join(self.out, MANIFEST)) != self._manifest_mtime:
+            self.apply()
+        return self._payments.columns, self._rentals.columns, self._dims
+
+
+def main(argv=None):
+    import settings
+
+    parser = argparse.ArgumentParser(description="DataTrack columnar export")
+    parser.add_argument("command", choices=["run", "status", "report"])
+    parser.add_argument("--out", default=settings.export_path or "exports/snapshot")
+    parser.add_argument("--full", action="store_true")
+    parser.add_argument("--chunk-size", type=int, default=settings.export_chunk_size)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        from utils.db import get_connection
+        for name, result in run(get_connection, args.out, args.full, args.chunk_size).items():
+            print(f"{name:<9} {result['mode']:<12} {result['rows']} row(s)")
+    elif args.command == "status":
+        manifest = read_manifest(args.out)
+        print(f"{args.out}: {manifest['runs']} run(s)")
+        for name, state in manifest["tables"].items():
+            print(f"  {name:<9} watermark {state['watermark']}  full run {state['full_run']}  "
+                  f"{state['rows_written']} row(s) written since")
+    else:
+        reader = SnapshotReader(args.out)
+        print("Top spenders:")
+        for row in reader.top_spenders(5):
+            print(f"  {row['customer_name']:<25} {row['total_paid']:>9}")
+        print("Top countries by spending:")
+        for row in reader.top_countries_by_spending(5):
+            print(f"  {row['country']:<25} {row['total_spent']:>9}")
+        print("Top rented films:")
+        for row in reader.top_rented_films(5):
+            print(f"  {row['title']:<25} {row['rental_count']:>9}")
+        print("Monthly revenue:")
+        for row in reader.revenue_series("month")[:6]:
+            print(f"  {row['label']:<25} {row['total']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+In-memory faceted index over the film catalog for /films.
+
+Every film gets a position in title order, and every facet value (category,
+language, rating, release year, rental rate and length buckets) keeps a
+bitmap of the positions that have it, held as a Python int. A search ORs the
+selected values within a facet and ANDs the facets together, then takes the
+page straight from the set bits, which are already in title order. Only that
+page is read from MySQL, by primary key.
+
+Facet counts are disjunctive: the count next to a value is what the result
+would be if that value were added to its facet's selection. In other words,
+it is counted against every filter except the facet's own.
+
+The catalog is reloaded (two queries) when a write through the DAOs bumps
+film, film_category, category or language, or when it is older than max_age
+for writes made elsewhere. Films.add/update/delete bump those tables, so the
+next read sees them. Availability comes from open_rentals and is refreshed
+on its own, because it changes with every rental.
+"""
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from utils.cache import table_versions
+
+CATALOG_TABLES = ("film", "film_category", "category", "language")
+
+# (label, lower bound inclusive, upper bound exclusive)
+RATE_BUCKETS = [("Under 1.00", None, 1), ("1.00 - 2.99", 1, 3), ("3.00 - 4.99", 3, 5),
+                ("5.00 and up", 5, None)]
+LENGTH_BUCKETS = [("Under 60 min", None, 60), ("60 - 89 min", 60, 90), ("90 - 119 min", 90, 120),
+                  ("120 - 149 min", 120, 150), ("150 min and up", 150, None)]
+
+# Facet name (also the query string parameter) -> heading.
+FACETS = {
+    "category_id": "Category",
+    "language_id": "Language",
+    "rating": "Rating",
+    "year": "Release year",
+    "rate": "Rental rate",
+    "length": "Length",
+}
+
+
+def _bucket(value, buckets) -> Optional[int]:
+    if value is None:
+        return None
+    for i, (_, low, high) in enumerate(buckets):
+        if (low is None or value >= low) and (high is None or value < high):
+            return i
+    return None
+
+
+def popcount(bits: int) -> int:
+    return bin(bits).count("1")
+
+
+def positions(bits: int, skip: int = 0, limit: Optional[int] = None) -> List[int]:
+    """Set bit positions in ascending order, after skipping `skip` of them."""
+    found = []
+    while bits and (limit is None or len(found) < limit):
+        low = bits & -bits
+        if skip:
+            skip -= 1
+        else:
+            found.append(low.bit_length() - 1)
+        bits ^= low
+    return found
+
+
+class _Catalog:
+    def __init__(self, films, categories, languages, film_categories):
+        films = sorted(films, key=lambda f: (f["title"], f["film_id"]))
+        self.film_ids = [f["film_id"] for f in films]
+        self.titles = [f["title"].lower() for f in films]
+        self.pos = {film_id: i for i, film_id in enumerate(self.film_ids)}
+        self.all = (1 << len(films)) - 1
+        self.labels = {
+            "category_id": dict(categories),
+            "language_id": dict(languages),
+            "rate": {i: label for i, (label, _, _) in enumerate(RATE_BUCKETS)},
+            "length": {i: label for i, (label, _, _) in enumerate(LENGTH_BUCKETS)},
+        }
+        self.bitmaps: Dict[str, Dict] = {name: {} for name in FACETS}
+
+        def add(facet, value, pos):
+            if value is not None:
+                self.bitmaps[facet][value] = self.bitmaps[facet].get(value, 0) | (1 << pos)
+
+        for pos, f in enumerate(films):
+            add("language_id", f["language_id"], pos)
+            add("rating", f["rating"], pos)
+            add("year", f["release_year"], pos)
+            add("rate", _bucket(f["rental_rate"], RATE_BUCKETS), pos)
+            add("length", _bucket(f["length"], LENGTH_BUCKETS), pos)
+        for film_id, category_id in film_categories:
+            if film_id in self.pos:
+                add("category_id", category_id, self.pos[film_id])
+        self.labels["rating"] = {v: v for v in self.bitmaps["rating"]}
+        self.labels["year"] = {v: str(v) for v in self.bitmaps["year"]}
+
+
+class FacetIndex:
+    def __init__(self, connection_factory, max_age=300):
+        self.connection_factory = connection_factory
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._catalog: Optional[_Catalog] = None
+        self._catalog_versions = None
+        self._loaded_at = 0.0
+        self._rented = 0
+        self._rented_version = None
+        self._rented_at = 0.0
+
+    # ---- loading -------------------------------------------------------
+
+    def load(self):
+        with self._lock:
+            versions = table_versions.get(*CATALOG_TABLES)
+            with self.connection_factory() as cn, cn.cursor(dictionary=True) as cur:
+                cur.execute("""
+                    SELECT film_id, title, language_id, rating, release_year, rental_rate, length
+                    FROM film
+                """)
+                films = cur.fetchall()
+                cur.execute("SELECT category_id, name FROM category")
+                categories = [(r["category_id"], r["name"]) for r in cur.fetchall()]
+                cur.execute("SELECT language_id, name FROM language")
+                languages = [(r["language_id"], r["name"]) for r in cur.fetchall()]
+                cur.execute("SELECT film_id, category_id FROM film_category")
+                film_categories = [(r["film_id"], r["category_id"]) for r in cur.fetchall()]
+            self._catalog = _Catalog(films, categories, languages, film_categories)
+            self._catalog_versions = versions
+            self._loaded_at = time.monotonic()
+            self._rented_version = None
+
+    def _current(self) -> _Catalog:
+        if (self._catalog is None
+                or table_versions.get(*CATALOG_TABLES) != self._catalog_versions
+                or time.monotonic() - self._loaded_at > self.max_age):
+            self.load()
+        return self._catalog
+
+    def _rented_bits(self, catalog: _Catalog) -> int:
+        """Positions of films that are out right now (open_rentals is keyed by film_id)."""
+        version = table_versions.get("open_rentals")
+        if (version != self._rented_version
+                or time.monotonic() - self._rented_at > min(self.max_age, 30)):
+            with self.connection_factory() as cn, cn.cursor() as cur:
+                cur.execute("SELECT film_id FROM open_rentals")
+                rented = [row[0] for row in cur.fetchall()]
+            bits = 0
+            for film_id in rented:
+                if film_id in catalog.pos:
+                    bits |= 1 << catalog.pos[film_id]
+            self._rented, self._rented_version, self._rented_at = bits, version, time.monotonic()
+        return self._rented
+
+    # ---- queries -------------------------------------------------------
+
+    @staticmethod
+    def _title_bits(catalog: _Catalog, q: str) -> int:
+        needle = q.lower()
+        bits = 0
+        for pos, title in enumerate(catalog.titles):
+            if needle in title:
+                bits |= 1 << pos
+        return bits
+
+    def search(self, selected: Dict[str, Iterable] = None, q: str = None,
+               available: bool = False, page: int = 1, page_size: int = 20) -> Dict:
+        """
+        `selected` maps facet names (FACETS) to the chosen values. Returns
+        film_ids for the page (title order), the total and the facet counts:
+        {facet: [{value, label, count, selected}]}.
+        """
+        catalog = self._current()
+        selected = {name: set(values) for name, values in (selected or {}).items()
+                    if name in FACETS and values}
+
+        base = catalog.all
+        if q:
+            base &= self._title_bits(catalog, q)
+        if available:
+            base &= ~self._rented_bits(catalog)
+
+        per_facet = {}
+        for name, values in selected.items():
+            bitmaps = catalog.bitmaps[name]
+            union = 0
+            for value in values:
+                union |= bitmaps.get(value, 0)
+            per_facet[name] = union
+
+        matches = base
+        for union in per_facet.values():
+            matches &= union
+
+        facets = {}
+        for name in FACETS:
+            others = base
+            for other, union in per_facet.items():
+                if other != name:
+                    others &= union
+            labels = catalog.labels.get(name, {})
+            values = []
+            for value, bits in catalog.bitmaps[name].items():
+                values.append({"value": value, "label": labels.get(value, value),
+                               "count": popcount(bits & others),
+                               "selected": value in selected.get(name, ())})
+            if name in ("rate", "length", "year"):
+                values.sort(key=lambda v: v["value"])
+            else:
+                values.sort(key=lambda v: str(v["label"]))
+            facets[name] = values
+
+        page_positions = positions(matches, skip=(page - 1) * page_size, limit=page_size)
+        return {
+            "film_ids": [catalog.film_ids[p] for p in page_positions],
+            "total": popcount(matches),
+            "facets": facets,
+        }
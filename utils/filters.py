@@ -0,0 +1,141 @@
+"""
+Declarative search filters.
+
+A FilterSpec declares the optional filters of one search page next to the
+SQL of its data and count queries. The queries carry a {where} placeholder,
+and the count query may also carry {joins} for joins that only some filters
+need. compile() picks the active filters (those with a truthy value, as the
+hand-written builders did) and returns the SQL and its parameters:
+
+    query = Rentals._SEARCH.compile({"q": q, "status": status})
+    query.run(cur, page_size, offset)     # data query, extra params appended
+    query.run_count(cur)
+
+The SQL is built once per combination of active filters (a bitmask over the
+declared filters) and cached. Every call with the same combination therefore
+sends byte-identical text with a stable fingerprint, which keys the timings in
+utils.metrics.query_stats and groups the same way in MySQL's statement digests.
+"""
+import hashlib
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from utils.metrics import query_stats
+
+
+def fingerprint(sql: str) -> str:
+    return hashlib.sha1(sql.encode("utf-8")).hexdigest()[:16]
+
+
+class Filter:
+    """
+    One optional filter. `sql` is a condition with %s placeholders, or a dict
+    {value: condition} for filters that choose between fixed conditions (the
+    value itself is then not a parameter; unknown values are ignored).
+    like=True wraps the value in %...% for every placeholder. `joins` names
+    entries of the spec's joins that the condition needs in the count query.
+    """
+
+    def __init__(self, name: str, sql, like: bool = False, joins: Sequence[str] = ()):
+        self.name = name
+        self.choices: Optional[Dict[Any, str]] = sql if isinstance(sql, dict) else None
+        self.sql: Optional[str] = None if self.choices is not None else sql
+        self.like = like
+        self.joins = tuple(joins)
+
+    def condition(self, value) -> Optional[str]:
+        if self.choices is not None:
+            return self.choices.get(value)
+        return self.sql
+
+    def params(self, value) -> List[Any]:
+        if self.choices is not None:
+            return []
+        value = f"%{value}%" if self.like else value
+        return [value] * self.sql.count("%s")
+
+
+class Compiled(NamedTuple):
+    spec: str
+    mask: int
+    sql: str
+    count_sql: Optional[str]
+    params: Tuple[Any, ...]
+    fingerprint: str
+    count_fingerprint: Optional[str]
+
+    def run(self, cur, *extra):
+        """Execute the data query; `extra` params (LIMIT/OFFSET) go last."""
+        _timed(cur, self.sql, self.params + extra, self.fingerprint, f"{self.spec}#{self.mask:x}")
+
+    def run_count(self, cur):
+        _timed(cur, self.count_sql, self.params, self.count_fingerprint,
+               f"{self.spec}.count#{self.mask:x}")
+
+
+def _timed(cur, sql, params, fp, label):
+    started = time.monotonic()
+    try:
+        cur.execute(sql, params)
+    finally:
+        query_stats.record(fp, label, (time.monotonic() - started) * 1000)
+
+
+class FilterSpec:
+    def __init__(self, name: str, select: str, filters: Sequence[Filter],
+                 count: Optional[str] = None, joins: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.select = select
+        self.count = count
+        self.filters = list(filters)
+        self.joins = joins or {}
+        # One bit per filter, or per choice for choice filters.
+        self._bits: Dict[Tuple[str, Any], int] = {}
+        for f in self.filters:
+            for choice in (f.choices or [None]):
+                self._bits[(f.name, choice)] = 1 << len(self._bits)
+        self._cache: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+
+    def compile(self, values: Dict[str, Any], **fragments: str) -> Compiled:
+        """
+        `values` maps filter names to values. `fragments` fill further
+        placeholders of the select text (e.g. a sort direction); they become
+        part of the SQL text, so only pass fixed, whitelisted strings.
+        """
+        mask = 0
+        active = []
+        params: List[Any] = []
+        for f in self.filters:
+            value = values.get(f.name)
+            if not value or f.condition(value) is None:
+                continue
+            mask |= self._bits[(f.name, value if f.choices is not None else None)]
+            active.append((f, value))
+            params.extend(f.params(value))
+
+        key = (mask, tuple(sorted(fragments.items())))
+        entry = self._cache.get(key)
+        if entry is None:
+            entry = self._build(active, fragments)
+            with self._lock:
+                self._cache.setdefault(key, entry)
+        sql, count_sql, fp, count_fp = entry
+        return Compiled(self.name, mask, sql, count_sql, tuple(params), fp, count_fp)
+
+    def _build(self, active, fragments):
+        conditions = [f.condition(value) for f, value in active]
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        sql = " ".join(self.select.format(where=where, **fragments).split())
+        count_sql = None
+        if self.count is not None:
+            needed = {name for f, _ in active for name in f.joins}
+            joins = " ".join(sql for name, sql in self.joins.items() if name in needed)
+            count_sql = " ".join(self.count.format(where=where, joins=joins, **fragments).split())
+        return (sql, count_sql, fingerprint(sql),
+                fingerprint(count_sql) if count_sql is not None else None)
+
+    def compiled(self):
+        """The SQL texts built so far, keyed by (mask, fragments)."""
+        return dict(self._cache)
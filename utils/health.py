@@ -0,0 +1,105 @@
+"""
+Liveness and readiness checks.
+
+/livez only says that the process answers; it never touches MySQL.
+
+/readyz borrows a pooled connection (waiting at most `timeout` seconds) and
+runs SELECT 1. The result is ready unless:
+
+  * warm-up has not finished,
+  * no connection could be had, or the database answered with an error,
+  * the ping took longer than max_latency_ms,
+  * the pool was at least max_utilization busy, or callers hit pool wait
+    timeouts since the previous check.
+
+The report also carries a rolling histogram of ping latency, the pool
+counters and the cache state. A check is reused for `cache_for` seconds, so
+frequent probes from several balancers cost at most one ping per interval.
+"""
+import threading
+import time
+
+from utils.cache import query_cache
+from utils.db import PoolExhausted
+from utils.http_cache import page_cache
+from utils.metrics import RollingHistogram
+
+
+class Readiness:
+    def __init__(self, connection_factory, pool=None, warmup=None, timeout=0.5,
+                 max_latency_ms=250, max_utilization=0.9, cache_for=1.0):
+        self.connection_factory = connection_factory
+        self.pool = pool
+        self.warmup = warmup
+        self.timeout = timeout
+        self.max_latency_ms = max_latency_ms
+        self.max_utilization = max_utilization
+        self.cache_for = cache_for
+        self.latency = RollingHistogram()
+        self._lock = threading.Lock()
+        self._last = None          # (checked at, ready, report)
+        self._seen_timeouts = 0
+
+    def ping(self) -> float:
+        """SELECT 1 on a pooled connection; returns the round trip in ms."""
+        started = time.monotonic()
+        cn = (self.pool.connection(timeout=self.timeout) if self.pool is not None
+              else self.connection_factory())
+        with cn, cn.cursor() as cur:
+            cur.execute("SELECT 1")
+            cur.fetchall()
+        ms = (time.monotonic() - started) * 1000
+        self.latency.observe(ms)
+        return ms
+
+    def check(self):
+        """Returns (ready, report). Concurrent callers share one ping."""
+        with self._lock:
+            if self._last and time.monotonic() - self._last[0] < self.cache_for:
+                return self._last[1], self._last[2]
+            ready, report = self._check()
+            self._last = (time.monotonic(), ready, report)
+            return ready, report
+
+    def _check(self):
+        reasons = []
+        report = {"db": {}, "cache": self.cache_status()}
+
+        if self.warmup is not None and not self.warmup.is_warm:
+            reasons.append(f"warming up: {self.warmup.describe()}")
+
+        if self.pool is not None:
+            # Taken before the ping, which itself holds a connection.
+            stats = self.pool.stats()
+            report["pool"] = stats
+            if stats["in_use"] >= self.max_utilization * stats["size"]:
+                reasons.append(f"pool saturated: {stats['in_use']}/{stats['size']} in use")
+            if stats["timeouts"] > self._seen_timeouts:
+                reasons.append(f"pool wait timeouts: {stats['timeouts'] - self._seen_timeouts}")
+            self._seen_timeouts = stats["timeouts"]
+
+        try:
+            ms = self.ping()
+            report["db"]["ping_ms"] = round(ms, 2)
+            if ms > self.max_latency_ms:
+                reasons.append(f"slow database: ping {ms:.0f} ms > {self.max_latency_ms} ms")
+        except PoolExhausted as e:
+            reasons.append(f"pool saturated: {e}")
+        except Exception as e:
+            reasons.append(f"database: {e}")
+        report["db"]["latency_ms"] = self.latency.snapshot()
+
+        report["ready"] = not reasons
+        report["reasons"] = reasons
+        return not reasons, report
+
+    def cache_status(self):
+        status = {
+            "page_cache": {"entries": len(page_cache), "hits": page_cache.hits,
+                           "misses": page_cache.misses},
+            "query_cache": {"entries": len(query_cache), "hits": query_cache.hits,
+                            "misses": query_cache.misses},
+        }
+        if self.warmup is not None:
+            status["warmup"] = self.warmup.describe()
+        return status
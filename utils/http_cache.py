@@ -0,0 +1,148 @@
+"""
+Conditional GET support for read pages.
+
+@cached_page("film", "category") computes a weak ETag from the request URL
+and the version counters of the listed tables. A matching If-None-Match is
+answered with 304 before the view runs, so MySQL is not touched. Pages whose
+tables have not changed can also be served from a server-side cache of
+rendered bodies (server_cache=True), which is meant for the heavy dashboards.
+
+The counters only see writes made through this process, unless the change
+feed (utils/change_feed.py) bumps them for the others. So every ETag also
+changes, and every server-side entry expires, after settings.page_cache_ttl
+seconds, the same bound cached_query uses. Pages that depend on the clock
+(e.g. overdue rentals) pass a shorter refresh_every=N.
+
+ETags are per process: they include table_versions.epoch, which is fresh in
+every process, and counters that count this process's bumps only. Behind a
+load balancer without sticky sessions, a revalidation that reaches another
+worker gets a full 200 instead of a 304. That costs a render, never a stale
+page, since a tag can only match in the process that issued it.
+
+Responses that carry flashed messages are never tagged or cached, because the
+same URL renders differently once the message has been shown. Neither are
+pages built from stale or partial results after a query deadline
+(utils/deadlines.py).
+
+Every page that could be tagged is also kept, by URL, as the last good copy.
+When the view fails because the database circuit breaker is open
+(utils/breaker.py), that copy is served instead, with a notice saying how
+old it is, and is never tagged or cached. Pages without a copy get the
+CircuitOpen error.
+"""
+import hashlib
+import time
+from datetime import datetime
+from functools import wraps
+
+from flask import g, request, session, make_response, current_app
+from markupsafe import escape
+
+import settings
+from utils.breaker import CircuitOpen
+from utils.cache import LRUCache, table_versions
+
+page_cache = LRUCache(max_entries=128)
+last_good_pages = LRUCache(max_entries=128)
+
+# base.html puts this marker where the notice goes.
+STALE_MARKER = b"<!--stale-notice-->"
+STALE_NOTICE = ('<div class="alert alert-warning">The database is not responding. '
+                'This page is a copy from {saved}, and changes cannot be saved until '
+                'it is back.</div>')
+
+
+def _etag(tables, refresh_every):
+    key = "|".join([
+        table_versions.epoch,
+        request.full_path,
+        ",".join(f"{t}={v}" for t, v in zip(tables, table_versions.get(*tables))),
+        str(int(time.time() // refresh_every)),
+    ])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
+
+def _cache_control(response, max_age):
+    if max_age:
+        response.headers["Cache-Control"] = f"private, max-age={max_age}"
+    else:
+        # Always revalidate; the ETag makes revalidation cheap.
+        response.headers["Cache-Control"] = "private, no-cache"
+
+
+def _keep_streamed(chunks, key, mimetype):
+    body = []
+    try:
+        for chunk in chunks:
+            body.append(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+            yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+    # Only reached when the whole body was sent.
+    last_good_pages.set(key, (time.time(), b"".join(body), mimetype))
+
+
+def _keep(response):
+    key = request.full_path
+    if response.is_streamed:
+        response.response = _keep_streamed(response.response, key, response.mimetype)
+    else:
+        last_good_pages.set(key, (time.time(), response.get_data(), response.mimetype))
+
+
+def _last_good_page():
+    kept = last_good_pages.get(request.full_path)
+    if kept is None:
+        return None
+    saved_at, body, mimetype = kept
+    saved = escape(datetime.fromtimestamp(saved_at).strftime("%Y-%m-%d %H:%M:%S"))
+    body = body.replace(STALE_MARKER, STALE_NOTICE.format(saved=saved).encode("utf-8"), 1)
+    response = current_app.response_class(body, mimetype=mimetype)
+    response.headers["Warning"] = '110 - "Response is Stale"'
+    response.headers["Cache-Control"] = "no-store"
+    g.degraded = True
+    return response
+
+
+def cached_page(*tables, max_age=0, server_cache=False, refresh_every=None):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET" or session.get("_flashes"):
+                return view(*args, **kwargs)
+
+            ttl = min(refresh_every or settings.page_cache_ttl, settings.page_cache_ttl)
+            etag = _etag(tables, ttl)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+                response.set_etag(etag, weak=True)
+                _cache_control(response, max_age)
+                return response
+
+            cached = page_cache.get(etag) if server_cache else None
+            if cached is not None and cached[0] > time.monotonic():
+                _, body, mimetype = cached
+                response = current_app.response_class(body, mimetype=mimetype)
+            else:
+                try:
+                    response = make_response(view(*args, **kwargs))
+                except CircuitOpen:
+                    response = _last_good_page()
+                    if response is None:
+                        raise
+                    return response
+                if (response.status_code != 200 or session.get("_flashes")
+                        or g.get("degraded")):
+                    return response
+                if server_cache and not response.is_streamed:
+                    page_cache.set(etag, (time.monotonic() + ttl, response.get_data(),
+                                          response.mimetype))
+                _keep(response)
+
+            response.set_etag(etag, weak=True)
+            _cache_control(response, max_age)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,245 @@
+"""
+EXPLAIN-based index checker for the data-access layer.
+
+Every probe below calls a method from utils/table_operations.py through a
+connection wrapper that runs EXPLAIN on each statement the method issues.
+SELECTs are then executed for real (some methods read a row before writing);
+INSERT/UPDATE/DELETE are only explained, never run, so the checker is safe to
+point at a live database.
+
+Plans are flagged when MySQL reads a whole table (type=ALL) or has to sort
+or build a temporary table (Using filesort / Using temporary).
+
+Usage:
+    python -m utils.index_advisor [--strict]
+"""
+import argparse
+import sys
+from typing import Any, Dict, List
+
+from utils.change_feed import ChangeFeed
+from utils.table_operations import Films, Customers, Addresses, Payments, Rentals
+
+# Lookup tables are small enough that a full scan is the right plan.
+SMALL_TABLES = {"language", "category", "country", "actor", "city"}
+
+
+class _ExplainingCursor:
+    def __init__(self, cn, log, probe, **kwargs):
+        self._cn = cn
+        self._cur = cn.cursor(**kwargs)
+        self._log = log
+        self._probe = probe
+        self._skipped = False
+
+    def execute(self, sql, params=()):
+        with self._cn.cursor(dictionary=True) as ex:
+            ex.execute("EXPLAIN " + sql, params)
+            plan = ex.fetchall()
+        self._log.append({"probe": self._probe, "sql": " ".join(sql.split()), "plan": plan})
+
+        self._skipped = not sql.lstrip().upper().startswith("SELECT")
+        if not self._skipped:
+            self._cur.execute(sql, params)
+
+    def executemany(self, sql, seq_params):
+        for params in seq_params:
+            self.execute(sql, params)
+
+    def fetchone(self):
+        return None if self._skipped else self._cur.fetchone()
+
+    def fetchall(self):
+        return [] if self._skipped else self._cur.fetchall()
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    @property
+    def rowcount(self):
+        return 0 if self._skipped else self._cur.rowcount
+
+    @property
+    def lastrowid(self):
+        return None
+
+    def close(self):
+        self._cur.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _ExplainingConnection:
+    def __init__(self, cn, log, probe):
+        self._cn = cn
+        self._log = log
+        self._probe = probe
+
+    def cursor(self, **kwargs):
+        return _ExplainingCursor(self._cn, self._log, self._probe, **kwargs)
+
+    def start_transaction(self, *args, **kwargs):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self._cn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# (label, call) pairs. Sample arguments exercise every optional filter branch.
+PROBES = [
+    ("Films.search", lambda d: d["films"].search()),
+    ("Films.search(filters)", lambda d: d["films"].search(category_id=1, language_id=1, q="ab")),
+    ("Films.count_search", lambda d: d["films"].count_search(category_id=1, q="ab")),
+    ("Films.search(available)", lambda d: d["films"].search(available=True)),
+    ("Films.get", lambda d: d["films"].get(1)),
+    ("Films.get_many", lambda d: d["films"].get_many(list(range(1, 21)))),
+    ("Films.actors", lambda d: d["films"].actors(1)),
+    ("Films.available_actors", lambda d: d["films"].available_actors(1)),
+    ("Films.add_actors", lambda d: d["films"].add_actors(1, [1, 2, 3])),
+    ("Films.remove_actors", lambda d: d["films"].remove_actors(1, [1, 2, 3])),
+    ("Films.set_actors", lambda d: d["films"].set_actors(1, [1, 2, 3])),
+    ("Films.cast_options", lambda d: d["films"].cast_options(1)),
+    ("Films.similar", lambda d: d["films"].similar(1)),
+    ("Films.update", lambda d: d["films"].update(1, {"category_id": 1})),
+    ("Films.delete", lambda d: d["films"].delete(1)),
+    ("Films.get_stats", lambda d: d["films"].get_stats()),
+    ("Customers.list_customers", lambda d: d["customers"].list_customers()),
+    ("Customers.list_customers(q)", lambda d: d["customers"].list_customers(q="ma")),
+    ("Customers.count_search(q)", lambda d: d["customers"].count_search(q="ma")),
+    ("Customers.get", lambda d: d["customers"].get(1)),
+    ("Customers.top_customers_by_payment", lambda d: d["customers"].top_customers_by_payment()),
+    ("Customers.top_spenders", lambda d: d["customers"].top_spenders()),
+    ("Customers.refresh_scores", lambda d: d["customers"].refresh_scores(full=True)),
+    ("Customers.scored", lambda d: d["customers"].scored()),
+    ("Customers.scored(rfm)", lambda d: d["customers"].scored(sort="rfm")),
+    ("Customers.scored(segment)", lambda d: d["customers"].scored(segment="Champions", min_r=3)),
+    ("Addresses.search", lambda d: d["addresses"].search()),
+    ("Addresses.search(filters)", lambda d: d["addresses"].search(district="a", country_id=1)),
+    ("Addresses.count_search", lambda d: d["addresses"].count_search(city_id=1)),
+    ("Addresses.get_cities", lambda d: d["addresses"].get_cities()),
+    ("Addresses.top_countries_by_customers", lambda d: d["addresses"].top_countries_by_customers()),
+    ("Addresses.top_countries_by_spending", lambda d: d["addresses"].top_countries_by_spending()),
+    ("Payments.search", lambda d: d["payments"].search()),
+    ("Payments.search(method)", lambda d: d["payments"].search(payment_method="Cash", sort_order="asc")),
+    ("Payments.search(q)", lambda d: d["payments"].search(q="12")),
+    ("Payments.search(since)", lambda d: d["payments"].search(since="2005-08-01")),
+    ("Payments.latest_date", lambda d: d["payments"].latest_date()),
+    ("Payments.archived_before", lambda d: d["payments"].archived_before()),
+    ("Payments.get", lambda d: d["payments"].get(1)),
+    ("Payments.get_all_customers", lambda d: d["payments"].get_all_customers()),
+    ("Payments.get_analytics", lambda d: d["payments"].get_analytics()),
+    ("Payments.revenue_series(week)", lambda d: d["payments"].revenue_series(
+        "week", start="2005-06-01", end="2005-08-31", payment_method="Cash", country_id=1)),
+    ("Payments.method_stats", lambda d: d["payments"].method_stats(start="2005-06-01")),
+    ("Payments.add_payment", lambda d: d["payments"].add_payment(
+        {"customer_id": 1, "amount": 1, "payment_date": "2005-06-01T10:00", "payment_method": "Cash"})),
+    ("Payments.delete_payment", lambda d: d["payments"].delete_payment(1)),
+    ("Rentals.search", lambda d: d["rentals"].search()),
+    ("Rentals.search(not_returned)", lambda d: d["rentals"].search(status="not_returned")),
+    ("Rentals.search(q)", lambda d: d["rentals"].search(q="ab")),
+    ("Rentals.count_search(returned)", lambda d: d["rentals"].count_search(status="returned")),
+    ("Rentals.search(since)", lambda d: d["rentals"].search(since="2005-08-01")),
+    ("Rentals.count_search(since)", lambda d: d["rentals"].count_search(since="2005-08-01")),
+    ("Rentals.latest_date", lambda d: d["rentals"].latest_date()),
+    ("Rentals.archived_before", lambda d: d["rentals"].archived_before()),
+    ("Rentals.search(overdue)", lambda d: d["rentals"].search(status="overdue")),
+    ("Rentals.count_search(overdue)", lambda d: d["rentals"].count_search(status="overdue")),
+    ("Rentals.get", lambda d: d["rentals"].get(1)),
+    ("Rentals.is_available", lambda d: d["rentals"].is_available(1)),
+    ("Rentals.add", lambda d: d["rentals"].add(customer_id=1, film_id=1)),
+    ("Rentals.update", lambda d: d["rentals"].update(1, {"film_id": 1, "customer_id": 1})),
+    ("Rentals.delete", lambda d: d["rentals"].delete(1)),
+    ("Rentals.return_film", lambda d: d["rentals"].return_film(1)),
+    ("Rentals.top_rented_films", lambda d: d["rentals"].top_rented_films()),
+    ("Rentals.assess_late_fees", lambda d: d["rentals"].assess_late_fees()),
+    ("Rentals.pending_late_notices", lambda d: d["rentals"].pending_late_notices()),
+    ("Rentals.mark_notified", lambda d: d["rentals"].mark_notified([1, 2])),
+    ("ChangeFeed.prime", lambda d: d["change_feed"].prime()),
+    ("ChangeFeed.poll", lambda d: d["change_feed"].poll()),
+]
+
+
+def run(connection_factory, probes=PROBES) -> List[Dict[str, Any]]:
+    """Run every probe and return one log entry per statement with its plan."""
+    log: List[Dict[str, Any]] = []
+    current = {"probe": None}
+
+    def factory():
+        return _ExplainingConnection(connection_factory(), log, current["probe"])
+
+    daos = {
+        "films": Films(connection_factory=factory),
+        "customers": Customers(connection_factory=factory),
+        "addresses": Addresses(connection_factory=factory),
+        "payments": Payments(connection_factory=factory),
+        "rentals": Rentals(connection_factory=factory),
+        "change_feed": ChangeFeed(factory),
+    }
+    for label, call in probes:
+        current["probe"] = label
+        try:
+            call(daos)
+        except Exception as e:
+            log.append({"probe": label, "sql": None, "plan": [], "error": str(e)})
+    return log
+
+
+def findings(entry: Dict[str, Any]) -> List[str]:
+    """Return human-readable problems for one statement's plan."""
+    problems = []
+    for row in entry["plan"]:
+        table = row.get("table") or ""
+        extra = row.get("Extra") or ""
+        if row.get("type") == "ALL" and table not in SMALL_TABLES:
+            problems.append(f"full scan on {table} (~{row.get('rows')} rows)")
+        if "Using filesort" in extra:
+            problems.append(f"filesort on {table}")
+        if "Using temporary" in extra:
+            problems.append(f"temporary table on {table}")
+    return problems
+
+
+def main(argv=None):
+    from utils.db import get_connection
+
+    parser = argparse.ArgumentParser(description="EXPLAIN every data-access query")
+    parser.add_argument("--strict", action="store_true", help="exit 1 when anything is flagged")
+    args = parser.parse_args(argv)
+
+    flagged = 0
+    for entry in run(get_connection):
+        if entry.get("error"):
+            print(f"[ERROR] {entry['probe']}: {entry['error']}")
+            flagged += 1
+            continue
+        problems = findings(entry)
+        status = "WARN " if problems else "ok   "
+        print(f"[{status}] {entry['probe']}: {entry['sql'][:100]}")
+        for p in problems:
+            print(f"          - {p}")
+        flagged += bool(problems)
+
+    print(f"\n{flagged} statement(s) flagged")
+    if args.strict and flagged:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
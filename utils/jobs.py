@@ -0,0 +1,94 @@
+"""
+The app's recurring jobs.
+
+    python -m utils.jobs worker      # dedicated worker process
+    python -m utils.jobs list        # registered jobs and their schedules
+
+The web app builds the same scheduler for its /jobs status page and, with
+run_scheduler = True in settings.py, also runs it in a background thread.
+
+cache-warm: the caches are per process, so a run refreshes the process that
+claims it. The web app passes its Warmup, which replays settings.warmup_routes
+and refills its page cache and lookups before their ttl runs out. A worker
+has no caches to fill; it replays the dashboard queries instead, which keeps
+their rows in MySQL's buffer pool for every web process.
+"""
+import argparse
+
+import settings
+from utils import archive, overdue, partitions, similarity
+from utils.change_feed import ChangeFeed
+from utils.scheduler import Scheduler
+from utils.table_operations import Addresses, Customers, Films, Payments, Rentals
+
+
+def build_scheduler(connection_factory, warmup=None) -> Scheduler:
+    scheduler = Scheduler(connection_factory)
+    customers = Customers(connection_factory=connection_factory)
+
+    scheduler.register("customer-scores", "*/5 * * * *", customers.refresh_scores)
+    scheduler.register("customer-scores-full", "30 3 * * *",
+                       lambda: customers.refresh_scores(full=True))
+    scheduler.register("film-similarity", "*/30 * * * *",
+                       lambda: similarity.build(connection_factory))
+    scheduler.register("film-similarity-full", "15 4 * * 0",
+                       lambda: similarity.build(connection_factory, full=True), lease=3600)
+    scheduler.register("late-fees", "@hourly",
+                       lambda: overdue.run(connection_factory, notify=overdue.configured_notifier()))
+    scheduler.register("cache-warm", "*/5 * * * *",
+                       warmup.run if warmup is not None else lambda: _warm_dashboards(connection_factory),
+                       retries=0)
+    scheduler.register("purge-tombstones", "45 2 * * *",
+                       lambda: ChangeFeed(connection_factory).purge_tombstones())
+    scheduler.register("partitions", "20 1 * * *",
+                       lambda: partitions.maintain(connection_factory,
+                                                   months_ahead=settings.partition_months_ahead,
+                                                   retention_months=settings.partition_retention_months,
+                                                   archive=settings.partition_archive),
+                       lease=3600)
+    if settings.archive_after_days:
+        scheduler.register("archive", "50 1 * * *",
+                           lambda: archive.run(connection_factory, settings.archive_after_days),
+                           lease=3600)
+    if settings.export_path:
+        scheduler.register("export", "10 2 * * *", lambda: _export(connection_factory), lease=3600)
+    return scheduler
+
+
+def _warm_dashboards(connection_factory):
+    """The queries behind the dashboard pages, results discarded."""
+    Films(connection_factory=connection_factory).get_stats()
+    addresses = Addresses(connection_factory=connection_factory)
+    addresses.top_countries_by_customers()
+    addresses.top_countries_by_spending()
+    payments = Payments(connection_factory=connection_factory)
+    payments.revenue_series()
+    payments.method_stats()
+    Customers(connection_factory=connection_factory).scored()
+    Rentals(connection_factory=connection_factory).top_rented_films()
+
+
+def _export(connection_factory):
+    from utils import export    # needs pyarrow
+    return export.run(connection_factory, settings.export_path,
+                      chunk_size=settings.export_chunk_size)
+
+
+def main(argv=None):
+    from utils.db import get_connection
+
+    parser = argparse.ArgumentParser(description="DataTrack background jobs")
+    parser.add_argument("command", choices=["worker", "list"])
+    args = parser.parse_args(argv)
+
+    scheduler = build_scheduler(get_connection)
+    if args.command == "list":
+        for job in scheduler.jobs.values():
+            print(f"{job.name:<24} {job.schedule.expr}")
+    else:
+        print(f"worker {scheduler.worker_id}: {len(scheduler.jobs)} job(s)")
+        scheduler.run_forever(interval=settings.scheduler_poll_seconds)
+
+
+if __name__ == "__main__":
+    main()
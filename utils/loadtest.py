@@ -0,0 +1,361 @@
+"""
+Closed-loop load test for the admin UI.
+
+Each virtual clerk picks a scenario from a weighted mix, runs its requests
+one after another, waits `--think` seconds and starts over, so the offered
+load follows the server's speed (closed loop) instead of a fixed arrival
+rate. Concurrency is stepped up (`--steps 1,2,4,8,16,32`) and every step
+runs for `--step-seconds`.
+
+    python -m utils.loadtest run --serve                 # app in this process
+    python -m utils.loadtest run --url http://127.0.0.1:5000 --mix browse
+    python -m utils.loadtest compare before.json after.json
+
+Point it at a local seeded database (the sakila sample data): the clerk mix
+creates rentals and payments.
+
+For each step the report has throughput, error rate and p50/p95/p99 per
+route. It also names the knee, which is the last step where adding clerks
+still bought a proportional share of throughput, and the highest step that
+met the p95 SLO. Reports are written as JSON under loadtest-reports/ and
+can be diffed with `compare`.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+# Id ranges of the sakila sample data.
+FILM_IDS = (1, 1000)
+CUSTOMER_IDS = (1, 599)
+SEARCH_TERMS = ["smith", "mary", "ang", "ali", "son", "lee", "mar", "john"]
+PAYMENT_METHODS = ["Credit Card", "Debit Card", "PayPal", "Bank Transfer"]
+DASHBOARDS = ["/films/stats", "/payments/analytics", "/address/top-countries",
+              "/customers/top-spenders", "/rentals/top"]
+
+REPORT_DIR = "loadtest-reports"
+
+
+# ---- scenarios ---------------------------------------------------------------
+# A scenario returns the requests of one clerk action as
+# (label, method, path, form data or None). The label groups latencies in the
+# report, so paths with ids share one label.
+
+def browse_films(rng):
+    page = rng.randint(1, 20)
+    film_id = rng.randint(*FILM_IDS)
+    return [("GET /films", "GET", f"/films?page={page}", None),
+            ("GET /film/<id>", "GET", f"/film/{film_id}", None)]
+
+
+def search_rentals(rng):
+    q = urllib.parse.quote(rng.choice(SEARCH_TERMS))
+    return [("GET /rentals?q=", "GET", f"/rentals?q={q}", None)]
+
+
+def browse_customers(rng):
+    return [("GET /customers", "GET", f"/customers?page={rng.randint(1, 10)}", None),
+            ("GET /customer/<id>", "GET", f"/customer/{rng.randint(*CUSTOMER_IDS)}", None)]
+
+
+def rent_film(rng):
+    form = {"customer_id": rng.randint(*CUSTOMER_IDS), "film_id": rng.randint(*FILM_IDS)}
+    return [("GET /rental/add", "GET", "/rental/add", None),
+            ("POST /rental/add", "POST", "/rental/add", form)]
+
+
+def record_payment(rng):
+    form = {
+        "customer_id": rng.randint(*CUSTOMER_IDS),
+        "amount": f"{rng.choice([0.99, 2.99, 4.99, 5.99]):.2f}",
+        "payment_date": datetime.now().strftime("%Y-%m-%dT%H:%M"),
+        "payment_method": rng.choice(PAYMENT_METHODS),
+    }
+    return [("POST /payments/add", "POST", "/payments/add", form)]
+
+
+def open_dashboard(rng):
+    path = rng.choice(DASHBOARDS)
+    return [(f"GET {path}", "GET", path, None)]
+
+
+SCENARIOS: Dict[str, Callable] = {
+    "browse_films": browse_films,
+    "search_rentals": search_rentals,
+    "browse_customers": browse_customers,
+    "rent_film": rent_film,
+    "record_payment": record_payment,
+    "open_dashboard": open_dashboard,
+}
+
+# Weighted scenario mixes (weights are relative).
+MIXES: Dict[str, Dict[str, int]] = {
+    "clerk": {"browse_films": 30, "search_rentals": 20, "browse_customers": 15,
+              "rent_film": 15, "record_payment": 10, "open_dashboard": 10},
+    "browse": {"browse_films": 45, "search_rentals": 30, "browse_customers": 25},
+    "dashboards": {"open_dashboard": 100},
+}
+
+
+# ---- driver ------------------------------------------------------------------
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Time the POST itself, not the page it redirects to.
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def _request(base_url, method, path, form, timeout):
+    data = urllib.parse.urlencode(form).encode() if form is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method)
+    try:
+        with _opener.open(req, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # Nearest rank.
+    return sorted_values[max(0, math.ceil(p * len(sorted_values)) - 1)]
+
+
+class Step:
+    """Samples of one concurrency level: (label, ms, ok) per request."""
+
+    def __init__(self, clerks):
+        self.clerks = clerks
+        self.samples: List[Tuple[str, float, bool]] = []
+        self.errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.elapsed = 0.0
+
+    def record(self, label, ms, ok, error=None):
+        with self._lock:
+            self.samples.append((label, ms, ok))
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def summary(self):
+        routes: Dict[str, List[float]] = {}
+        failed: Dict[str, int] = {}
+        for label, ms, ok in self.samples:
+            routes.setdefault(label, []).append(ms)
+            if not ok:
+                failed[label] = failed.get(label, 0) + 1
+        total = len(self.samples)
+        errors = sum(failed.values())
+        every = sorted(ms for _, ms, _ in self.samples)
+        return {
+            "clerks": self.clerks,
+            "seconds": round(self.elapsed, 2),
+            "requests": total,
+            "throughput": round(total / self.elapsed, 2) if self.elapsed else 0.0,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "p50": _round(percentile(every, 0.50)),
+            "p95": _round(percentile(every, 0.95)),
+            "p99": _round(percentile(every, 0.99)),
+            "routes": {
+                label: {
+                    "requests": len(values),
+                    "errors": failed.get(label, 0),
+                    "p50": _round(percentile(sorted(values), 0.50)),
+                    "p95": _round(percentile(sorted(values), 0.95)),
+                    "p99": _round(percentile(sorted(values), 0.99)),
+                }
+                for label, values in sorted(routes.items())
+            },
+            "error_samples": dict(sorted(self.errors.items(), key=lambda kv: -kv[1])[:5]),
+        }
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
+
+
+def run_step(base_url, mix, clerks, seconds, think=0.0, timeout=30.0, seed=None):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    step = Step(clerks)
+    deadline = time.monotonic() + seconds
+
+    def clerk(n):
+        rng = random.Random(None if seed is None else seed * 1000 + n)
+        while time.monotonic() < deadline:
+            scenario = SCENARIOS[rng.choices(names, weights)[0]]
+            for label, method, path, form in scenario(rng):
+                started = time.monotonic()
+                try:
+                    status = _request(base_url, method, path, form, timeout)
+                    ok, error = status < 400, (f"HTTP {status}" if status >= 400 else None)
+                except Exception as e:
+                    ok, error = False, f"{type(e).__name__}: {e}"
+                step.record(label, (time.monotonic() - started) * 1000, ok, error)
+            if think:
+                time.sleep(rng.expovariate(1 / think))
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=clerk, args=(n,), daemon=True) for n in range(clerks)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    step.elapsed = time.monotonic() - started
+    return step.summary()
+
+
+def find_knee(steps, min_gain=0.25):
+    """
+    Last step whose throughput still grew by at least `min_gain` of the
+    relative increase in clerks (doubling clerks should add >= 25% throughput
+    with the default). Returns that step's clerks, or None for fewer than two steps.
+    """
+    if len(steps) < 2:
+        return None
+    knee = steps[0]
+    for prev, cur in zip(steps, steps[1:]):
+        if not prev["throughput"]:
+            break
+        load_growth = cur["clerks"] / prev["clerks"] - 1
+        gain = cur["throughput"] / prev["throughput"] - 1
+        if gain < min_gain * load_growth:
+            break
+        knee = cur
+    return knee["clerks"]
+
+
+def max_within_slo(steps, p95_ms, max_error_rate):
+    best = None
+    for step in steps:
+        if step["p95"] is not None and step["p95"] <= p95_ms and step["error_rate"] <= max_error_rate:
+            best = step["clerks"]
+        else:
+            break
+    return best
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def _serve():
+    """Start app.py on a free local port in a daemon thread; returns its URL."""
+    from werkzeug.serving import make_server
+    from app import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="loadtest-server", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def print_report(report):
+    print(f"mix={report['mix']} url={report['url']} commit={report['commit']}")
+    print(f"{'clerks':>6} {'req/s':>8} {'errors':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for s in report["steps"]:
+        print(f"{s['clerks']:>6} {s['throughput']:>8.1f} {s['error_rate']:>7.1%} "
+              f"{s['p50'] or 0:>8.1f} {s['p95'] or 0:>8.1f} {s['p99'] or 0:>8.1f}")
+    last = report["steps"][-1] if report["steps"] else None
+    if last:
+        print(f"\nroutes at {last['clerks']} clerks (ms):")
+        for label, r in last["routes"].items():
+            print(f"  {label:<32} n={r['requests']:<6} p50={r['p50']:<8} p95={r['p95']:<8} "
+                  f"p99={r['p99']:<8} errors={r['errors']}")
+        for error, n in last["error_samples"].items():
+            print(f"  ! {n} x {error}")
+    print(f"\nknee: {report['knee']} clerks; "
+          f"SLO p95<={report['slo']['p95_ms']}ms: {report['slo']['max_clerks']} clerks")
+
+
+def compare(a, b):
+    print(f"{'clerks':>6} {'req/s':>17} {'p95 ms':>19}   ({a['commit']} -> {b['commit']})")
+    before = {s["clerks"]: s for s in a["steps"]}
+    for s in b["steps"]:
+        old = before.get(s["clerks"])
+        if old is None:
+            continue
+        print(f"{s['clerks']:>6} {old['throughput']:>7.1f} -> {s['throughput']:<7.1f} "
+              f"{old['p95'] or 0:>8.1f} -> {s['p95'] or 0:<8.1f}")
+    print(f"knee: {a['knee']} -> {b['knee']} clerks; "
+          f"SLO: {a['slo']['max_clerks']} -> {b['slo']['max_clerks']} clerks")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DataTrack closed-loop load test")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="ramp concurrency and write a report")
+    target = run.add_mutually_exclusive_group()
+    target.add_argument("--url", default="http://127.0.0.1:5000")
+    target.add_argument("--serve", action="store_true", help="run app.py in this process")
+    run.add_argument("--mix", choices=sorted(MIXES), default="clerk")
+    run.add_argument("--steps", default="1,2,4,8,16,32", help="clerks per step")
+    run.add_argument("--step-seconds", type=float, default=30)
+    run.add_argument("--think", type=float, default=0.0, help="mean think time (s)")
+    run.add_argument("--timeout", type=float, default=30.0)
+    run.add_argument("--slo-p95", type=float, default=500.0, help="p95 target (ms)")
+    run.add_argument("--max-error-rate", type=float, default=0.01)
+    run.add_argument("--seed", type=int)
+    run.add_argument("--out", help=f"report path (default: {REPORT_DIR}/<time>-<mix>.json)")
+
+    cmp = sub.add_parser("compare", help="compare two reports")
+    cmp.add_argument("before")
+    cmp.add_argument("after")
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        with open(args.before) as a, open(args.after) as b:
+            compare(json.load(a), json.load(b))
+        return
+
+    url = _serve() if args.serve else args.url.rstrip("/")
+    mix = MIXES[args.mix]
+    steps = []
+    for clerks in (int(n) for n in args.steps.split(",")):
+        print(f"{clerks} clerk(s) for {args.step_seconds:g}s ...", flush=True)
+        steps.append(run_step(url, mix, clerks, args.step_seconds, args.think,
+                              args.timeout, args.seed))
+
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "url": url,
+        "mix": args.mix,
+        "weights": mix,
+        "step_seconds": args.step_seconds,
+        "think": args.think,
+        "steps": steps,
+        "knee": find_knee(steps),
+        "slo": {"p95_ms": args.slo_p95, "max_error_rate": args.max_error_rate,
+                "max_clerks": max_within_slo(steps, args.slo_p95, args.max_error_rate)},
+    }
+    out = args.out or os.path.join(REPORT_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{args.mix}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print()
+    print_report(report)
+    print(f"\nreport: {out}")
+
+
+if __name__ == "__main__":
+    main()
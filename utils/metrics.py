@@ -0,0 +1,111 @@
+"""
+Small in-process metrics for the health endpoints.
+
+RollingHistogram counts observations (milliseconds) into fixed buckets over
+a sliding window. The window is split into slices that are recycled as time
+moves on, so memory stays constant and old samples fall out on their own.
+Percentiles are estimated from the bucket bounds.
+
+query_stats counts calls and time per SQL fingerprint for the compiled
+search queries.
+"""
+import threading
+import time
+
+DEFAULT_BOUNDS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class RollingHistogram:
+    def __init__(self, bounds=DEFAULT_BOUNDS_MS, window=60, slices=6):
+        self.bounds = tuple(bounds)
+        self.window = window
+        self._slice_len = window / slices
+        self._lock = threading.Lock()
+        # Per slice: [slice number, bucket counts (+1 overflow), count, total ms, max ms]
+        self._slices = [[-1, [0] * (len(self.bounds) + 1), 0, 0.0, 0.0] for _ in range(slices)]
+
+    def _slot(self, now):
+        number = int(now // self._slice_len)
+        slot = self._slices[number % len(self._slices)]
+        if slot[0] != number:
+            slot[0], slot[1], slot[2], slot[3], slot[4] = number, [0] * (len(self.bounds) + 1), 0, 0.0, 0.0
+        return slot
+
+    def observe(self, ms):
+        with self._lock:
+            slot = self._slot(time.monotonic())
+            i = 0
+            while i < len(self.bounds) and ms > self.bounds[i]:
+                i += 1
+            slot[1][i] += 1
+            slot[2] += 1
+            slot[3] += ms
+            slot[4] = max(slot[4], ms)
+
+    def snapshot(self):
+        """Counts, mean, max and p50/p95/p99 (bucket upper bounds) over the window."""
+        now = time.monotonic()
+        oldest = int(now // self._slice_len) - len(self._slices) + 1
+        buckets = [0] * (len(self.bounds) + 1)
+        count, total, peak = 0, 0.0, 0.0
+        with self._lock:
+            for number, counts, n, ms, top in self._slices:
+                if number >= oldest:
+                    buckets = [a + b for a, b in zip(buckets, counts)]
+                    count, total, peak = count + n, total + ms, max(peak, top)
+
+        def percentile(p):
+            if not count:
+                return None
+            rank, seen = p * count, 0
+            for i, n in enumerate(buckets):
+                seen += n
+                if seen >= rank:
+                    return self.bounds[i] if i < len(self.bounds) else round(peak, 1)
+
+        labels = [f"<={b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            "window_s": self.window,
+            "count": count,
+            "mean": round(total / count, 2) if count else None,
+            "max": round(peak, 2) if count else None,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "buckets": {label: n for label, n in zip(labels, buckets) if n},
+        }
+
+
+class QueryStats:
+    """Calls and time per SQL fingerprint (see utils/filters.py)."""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, fingerprint, label, ms):
+        with self._lock:
+            entry = self._stats.get(fingerprint)
+            if entry is None:
+                if len(self._stats) >= self.max_entries:
+                    return
+                entry = self._stats[fingerprint] = {
+                    "fingerprint": fingerprint, "label": label,
+                    "calls": 0, "total_ms": 0.0, "max_ms": 0.0,
+                }
+            entry["calls"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+
+    def top(self, n=20, by="total_ms"):
+        with self._lock:
+            rows = [dict(e) for e in self._stats.values()]
+        for row in rows:
+            row["mean_ms"] = round(row["total_ms"] / row["calls"], 2)
+            row["total_ms"] = round(row["total_ms"], 1)
+            row["max_ms"] = round(row["max_ms"], 1)
+        return sorted(rows, key=lambda r: -r[by])[:n]
+
+
+query_stats = QueryStats()
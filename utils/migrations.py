@@ -0,0 +1,104 @@
+"""
+Versioned schema migrations.
+
+Migrations are plain SQL files in Data/migrations named NNN_description.sql.
+Applied versions are recorded in the schema_migrations table, so each file
+runs exactly once per database.
+
+Usage:
+    python -m utils.migrations status
+    python -m utils.migrations upgrade [--to VERSION]
+"""
+import argparse
+import os
+import re
+from typing import Callable, List, Tuple
+
+import mysql.connector
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "Data", "migrations")
+
+_FILE_RE = re.compile(r"^(\d+)_([\w\-]+)\.sql$")
+
+
+def _ensure_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT NOT NULL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def available() -> List[Tuple[int, str, str]]:
+    """Return (version, name, path) for every migration file, sorted by version."""
+    found = []
+    for fname in os.listdir(MIGRATIONS_DIR):
+        m = _FILE_RE.match(fname)
+        if m:
+            found.append((int(m.group(1)), m.group(2), os.path.join(MIGRATIONS_DIR, fname)))
+    return sorted(found)
+
+
+def split_statements(sql_text: str) -> List[str]:
+    """Split a migration file into statements (one per `;` at end of line)."""
+    lines = [ln for ln in sql_text.splitlines() if not ln.strip().startswith("--")]
+    parts = re.split(r";\s*$", "\n".join(lines), flags=re.MULTILINE)
+    return [p.strip() for p in parts if p.strip()]
+
+
+def applied(connection_factory: Callable[[], mysql.connector.MySQLConnection]):
+    with connection_factory() as cn, cn.cursor() as cur:
+        _ensure_table(cur)
+        cur.execute("SELECT version FROM schema_migrations ORDER BY version")
+        return {row[0] for row in cur.fetchall()}
+
+
+def pending(connection_factory):
+    done = applied(connection_factory)
+    return [m for m in available() if m[0] not in done]
+
+
+def upgrade(connection_factory, target: int = None) -> List[int]:
+    """
+    Apply pending migrations in order, up to and including `target`.
+    MySQL commits DDL implicitly, so a failing migration stops the run and is
+    not recorded; fix the file (or the database) and run upgrade again.
+    """
+    ran = []
+    for version, name, path in pending(connection_factory):
+        if target is not None and version > target:
+            break
+        with open(path, encoding="utf-8") as fh:
+            statements = split_statements(fh.read())
+        with connection_factory() as cn, cn.cursor() as cur:
+            for stmt in statements:
+                cur.execute(stmt)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (version, name))
+        ran.append(version)
+    return ran
+
+
+def main(argv=None):
+    from utils.db import get_connection
+
+    parser = argparse.ArgumentParser(description="DataTrack schema migrations")
+    parser.add_argument("command", choices=["status", "upgrade"])
+    parser.add_argument("--to", type=int, default=None, help="stop after this version")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        done = applied(get_connection)
+        for version, name, _ in available():
+            mark = "applied" if version in done else "pending"
+            print(f"{version:03d}  {name:<40} {mark}")
+    else:
+        ran = upgrade(get_connection, target=args.to)
+        print("Applied: " + (", ".join(f"{v:03d}" for v in ran) if ran else "nothing to do"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Overdue rental job: assess late fees, then send one notice per customer.
+
+    python -m utils.overdue run [--preview]
+
+Fees are computed for all overdue rentals in a single set-based statement
+(Rentals.assess_late_fees). Notices are sent in batches of `batch_size`
+customers: each batch reads every un-notified fee of those customers, calls
+notify(customer, items) once per customer and marks the fees that were sent
+with one UPDATE. A customer's fees are never split across batches.
+
+There is no mail integration yet. Set settings.late_fee_notifier to a
+"module:function" with the notify signature to send notices; until then fees
+are assessed but stay un-notified, so nothing is lost once a notifier exists.
+--preview prints the pending notices without marking them.
+"""
+import argparse
+import importlib
+from itertools import groupby
+from operator import itemgetter
+
+from utils.table_operations import Rentals
+
+
+def print_notice(customer, items):
+    total = sum(item["fee"] for item in items)
+    titles = ", ".join(item["title"] for item in items)
+    print(f"{customer['email']}: {len(items)} overdue rental(s) ({titles}), late fees {total:.2f}")
+
+
+def configured_notifier():
+    """The notify function named by settings.late_fee_notifier, or None."""
+    import settings
+
+    if not settings.late_fee_notifier:
+        return None
+    module, _, name = settings.late_fee_notifier.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def run(connection_factory, notify=None, batch_size=500, preview=False):
+    """
+    Assess fees and send pending notices. Returns (overdue, notified_customers).
+    Without a notifier only the fees are assessed. With preview=True notices
+    are sent to `notify` but the fees are not marked as notified.
+    """
+    rentals = Rentals(connection_factory=connection_factory)
+    overdue = rentals.assess_late_fees()
+    if notify is None:
+        return overdue, 0
+
+    notified, after = 0, 0
+    while True:
+        batch = rentals.pending_late_notices(customers=batch_size, after=after)
+        if not batch:
+            break
+        sent = []
+        try:
+            for customer_id, items in groupby(batch, key=itemgetter("customer_id")):
+                items = list(items)
+                notify(items[0], items)
+                sent.extend(item["rental_id"] for item in items)
+                notified += 1
+        finally:
+            # Customers told before a failing notify are not told again.
+            if not preview:
+                rentals.mark_notified(sent)
+        after = batch[-1]["customer_id"]
+    return overdue, notified
+
+
+def main(argv=None):
+    from utils.db import get_connection
+
+    parser = argparse.ArgumentParser(description="Assess late fees and notify customers")
+    parser.add_argument("command", choices=["run"])
+    parser.add_argument("--batch-size", type=int, default=500, help="customers per batch")
+    parser.add_argument("--preview", action="store_true",
+                        help="print the pending notices without marking them notified")
+    args = parser.parse_args(argv)
+    notify = print_notice if args.preview else configured_notifier()
+    overdue, notified = run(get_connection, notify=notify, batch_size=args.batch_size,
+                            preview=args.preview)
+    if notify is None:
+        print(f"{overdue} overdue rental(s); no late_fee_notifier configured, notices left pending")
+    else:
+        print(f"{overdue} overdue rental(s), {notified} customer(s) "
+              f"{'previewed' if args.preview else 'notified'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Monthly partition maintenance for payment and rental (migration 009).
+
+    python -m utils.partitions status
+    python -m utils.partitions maintain [--months-ahead 3] [--retention-months 36] [--archive]
+
+maintain() splits the catch-all pmax partition so that every month up to
+`months_ahead` from now has its own partition before rows arrive for it. With
+a retention period it also removes whole months older than that. A month is
+dropped with ALTER TABLE ... DROP PARTITION, which takes no per-row work. With
+archive=True its rows are first copied into <table>_archive (migration 010)
+and added to the archive totals (migration 012), and the archive mark in
+archive_state is moved up to the month's end.
+
+Rental months that still have unreturned rentals are kept. Dropping a rental
+month without archiving clears payment.rental_id and the late fees of those
+rentals, as the old ON DELETE rules did.
+
+The oldest partition, p_old, holds all history from before the migration's
+first month. It is dropped or archived like a month once its upper bound is
+past the retention period. Every partition costs an index probe on lookups
+by id alone (see migration 009), so set a retention period to keep the count
+bounded.
+
+Tables that are not partitioned (migration 009 not applied) are skipped.
+"""
+import argparse
+from datetime import date
+from typing import Dict, List, Optional
+
+from utils import archive as archive_module
+from utils.cache import table_versions
+
+# table -> partitioning column
+TABLES = {"payment": "payment_date", "rental": "rental_date"}
+
+
+def _month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def _add_months(d: date, n: int) -> date:
+    month = d.month - 1 + n
+    return date(d.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"p{month.year}{month.month:02d}"
+
+
+def partitions(connection_factory, table: str) -> List[Dict]:
+    """Partitions of `table` in order: name, upper bound (exclusive), approximate rows."""
+    with connection_factory() as cn, cn.cursor(dictionary=True) as cur:
+        cur.execute("""
+            SELECT PARTITION_NAME AS name, PARTITION_DESCRIPTION AS less_than,
+                   TABLE_ROWS AS approx_rows
+            FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+              AND PARTITION_NAME IS NOT NULL
+            ORDER BY PARTITION_ORDINAL_POSITION
+        """, (table,))
+        rows = cur.fetchall()
+    for row in rows:
+        row["less_than"] = row["less_than"].strip("'")
+    return rows
+
+
+def ensure_future(connection_factory, table: str, months_ahead: int = 3) -> List[str]:
+    """Create the missing monthly partitions up to `months_ahead` from now."""
+    parts = partitions(connection_factory, table)
+    if not parts:
+        return []
+    monthly = [p for p in parts if p["name"] != "pmax"]
+    with connection_factory() as cn, cn.cursor() as cur:
+        cur.execute("SELECT CURDATE()")
+        today = cur.fetchone()[0]
+        last_bound = (date.fromisoformat(monthly[-1]["less_than"][:10]) if monthly
+                      else _month_start(today))
+        wanted = _add_months(_month_start(today), months_ahead + 1)
+        new = []
+        month = last_bound
+        while month < wanted:
+            new.append((partition_name(month), _add_months(month, 1)))
+            month = _add_months(month, 1)
+        if not new:
+            return []
+        # pmax is empty unless rows arrived beyond the last month, so this
+        # reorganisation is a metadata change in the normal case.
+        spec = ", ".join(f"PARTITION {name} VALUES LESS THAN ('{bound.isoformat()}')"
+                         for name, bound in new)
+        cur.execute(f"ALTER TABLE {table} REORGANIZE PARTITION pmax INTO "
+                    f"({spec}, PARTITION pmax VALUES LESS THAN (MAXVALUE))")
+    return [name for name, _ in new]
+
+
+def drop_old(connection_factory, table: str, retention_months: int,
+             archive: bool = False) -> List[str]:
+    """Drop (or archive, then drop) the months older than `retention_months`."""
+    parts = partitions(connection_factory, table)
+    dropped = []
+    with connection_factory() as cn, cn.cursor() as cur:
+        cur.execute("SELECT CURDATE()")
+        cutoff = _add_months(_month_start(cur.fetchone()[0]), -retention_months)
+        old = [p for p in parts
+               if p["name"] != "pmax" and date.fromisoformat(p["less_than"][:10]) <= cutoff]
+        # Always keep at least one partition below pmax.
+        old = old[:max(0, len([p for p in parts if p["name"] != "pmax"]) - 1)]
+        for p in old:
+            name = p["name"]
+            if table == "rental":
+                cur.execute(f"SELECT 1 FROM rental PARTITION ({name}) WHERE return_date IS NULL LIMIT 1")
+                if cur.fetchall():
+                    continue
+            cn.start_transaction()
+            try:
+                if archive:
+                    columns = archive_module.copy_columns(cur, table)
+                    archive_module.add_totals(cur, table, f"{table} PARTITION ({name})")
+                    cur.execute(f"""
+                        INSERT IGNORE INTO {archive_module.archive_table(table)} ({columns})
+                        SELECT {columns} FROM {table} PARTITION ({name})
+                    """)
+                    archive_module.record(cur, table, p["less_than"][:10], cur.rowcount)
+                elif table == "rental":
+                    cur.execute(f"""
+                        UPDATE payment p JOIN rental PARTITION ({name}) r ON r.rental_id = p.rental_id
+                        SET p.rental_id = NULL
+                    """)
+                    cur.execute(f"""
+                        DELETE lf FROM late_fee lf JOIN rental PARTITION ({name}) r
+                        ON r.rental_id = lf.rental_id
+                    """)
+                cn.commit()
+            except Exception:
+                cn.rollback()
+                raise
+            # DDL commits on its own; the rows are already copied or detached.
+            cur.execute(f"ALTER TABLE {table} DROP PARTITION {name}")
+            dropped.append(name)
+    if dropped:
+        table_versions.bump(table, archive_module.archive_table(table), "archive_state",
+                            *archive_module.TOTALS_TABLES)
+    return dropped
+
+
+def maintain(connection_factory, months_ahead: int = 3,
+             retention_months: Optional[int] = None, archive: bool = False) -> Dict[str, Dict]:
+    report = {}
+    for table in TABLES:
+        created = ensure_future(connection_factory, table, months_ahead)
+        dropped = (drop_old(connection_factory, table, retention_months, archive)
+                   if retention_months else [])
+        report[table] = {"created": created, "dropped": dropped}
+    return report
+
+
+def main(argv=None):
+    import settings
+    from utils.db import get_connection
+
+    parser = argparse.ArgumentParser(description="DataTrack partition maintenance")
+    parser.add_argument("command", choices=["status", "maintain"])
+    parser.add_argument("--months-ahead", type=int, default=settings.partition_months_ahead)
+    parser.add_argument("--retention-months", type=int, default=settings.partition_retention_months)
+    parser.add_argument("--archive", action="store_true", default=settings.partition_archive)
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        for table in TABLES:
+            parts = partitions(get_connection, table)
+            if not parts:
+                print(f"{table}: not partitioned")
+                continue
+            print(f"{table}: {len(parts)} partitions")
+            for p in parts:
+                print(f"  {p['name']:<8} < {p['less_than']:<12} ~{p['approx_rows']} rows")
+    else:
+        for table, result in maintain(get_connection, args.months_ahead,
+                                      args.retention_months, args.archive).items():
+            print(f"{table}: created {', '.join(result['created']) or 'none'}; "
+                  f"dropped {', '.join(result['dropped']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
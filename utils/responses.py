@@ -0,0 +1,126 @@
+"""
+Response layer for large pages: streamed rendering and on-the-fly compression.
+
+stream_page() renders a template as a stream of HTML, so the browser gets the
+<head> and starts loading CSS while the rest of a big table or <select> is
+still being rendered.
+
+Compress gzips (or brotli-compresses, when the optional brotli package is
+installed) text responses for clients that accept it. Buffered bodies under
+min_size are sent as-is. Streamed bodies are always compressed, with periodic
+flushes so streaming still delivers bytes early.
+"""
+import gzip
+import zlib
+
+from flask import current_app, get_flashed_messages, request, stream_with_context
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    "text/html", "text/css", "text/plain", "text/csv",
+    "application/javascript", "application/json", "image/svg+xml",
+}
+
+# Jinja yields one tiny string per template node; group this many per chunk.
+STREAM_BUFFER_ITEMS = 200
+
+
+def stream_page(template_name, **context):
+    """Like render_template, but the body is streamed."""
+    # The session cookie is sent before the body streams, so pop flashed
+    # messages now; the template's get_flashed_messages() reuses them.
+    get_flashed_messages(with_categories=True)
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_or_select_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER_ITEMS)
+    return app.response_class(stream_with_context(stream), mimetype="text/html")
+
+
+class _StreamCompressor:
+    """Compress an iterable of chunks, flushing early and then every flush_every bytes."""
+
+    def __init__(self, chunks, encoding, level, first_flush=4096, flush_every=32768):
+        self.chunks = chunks
+        self.encoding = encoding
+        self.level = level
+        self.first_flush = first_flush
+        self.flush_every = flush_every
+
+    def __iter__(self):
+        if self.encoding == "br":
+            comp = brotli.Compressor(quality=min(self.level, 11))
+            compress, flush, finish = comp.process, comp.flush, comp.finish
+        else:
+            comp = zlib.compressobj(self.level, zlib.DEFLATED, 31)  # 31 = gzip container
+            compress = comp.compress
+            flush = lambda: comp.flush(zlib.Z_SYNC_FLUSH)
+            finish = comp.flush
+
+        pending, threshold = 0, self.first_flush
+        try:
+            for chunk in self.chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                out = compress(chunk)
+                pending += len(chunk)
+                if pending >= threshold:
+                    out += flush()
+                    pending, threshold = 0, self.flush_every
+                if out:
+                    yield out
+            yield finish()
+        finally:
+            close = getattr(self.chunks, "close", None)
+            if close is not None:
+                close()
+
+
+class Compress:
+    def __init__(self, app=None, min_size=1024, level=6):
+        self.min_size = min_size
+        self.level = level
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def _choose_encoding(self):
+        accepted = request.accept_encodings
+        if brotli is not None and accepted["br"]:
+            return "br"
+        if accepted["gzip"]:
+            return "gzip"
+        return None
+
+    def after_request(self, response):
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough
+                or "Content-Encoding" in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = self._choose_encoding()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = _StreamCompressor(response.response, encoding, self.level)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            if encoding == "br":
+                data = brotli.compress(data, quality=min(self.level, 11))
+            else:
+                data = gzip.compress(data, compresslevel=self.level)
+            response.set_data(data)
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,300 @@
+"""
+Recurring background jobs, kept out of the request path.
+
+Jobs are registered in code with a schedule and persisted in the
+scheduled_job table (migration 008), which also stores their state:
+
+    scheduler = Scheduler(get_connection)
+    scheduler.register("refresh-scores", "*/5 * * * *", customers.refresh_scores)
+    scheduler.start()          # daemon thread in this process
+
+Schedules are five-field cron expressions (minute hour day-of-month month
+day-of-week, with *, lists, ranges and /steps), the aliases @hourly, @daily,
+@weekly and @monthly, or "@every 30s" / "@every 5m" / "@every 2h".
+
+Single flight: every process may run a scheduler, but a job runs only in the
+process that claims it with an atomic UPDATE on its row, which sets a lease
+(locked_until). While the job runs, a heartbeat thread extends the lease
+every lease / 3 seconds, so a run may take longer than its lease; a worker
+that dies mid-run stops the heartbeat and just lets the lease expire.
+
+Retries: a failing job is retried after retry_delay, 2 x retry_delay, ...
+up to `retries` times, then marked failed and left for its next scheduled run.
+"""
+import logging
+import os
+import re
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+_EVERY_RE = re.compile(r"^@every\s+(\d+)\s*([smh])$")
+_UNITS = {"s": 1, "m": 60, "h": 3600}
+# (low, high) for minute, hour, day of month, month, day of week (0 = Sunday).
+_FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+
+def _parse_field(text, low, high, is_dow=False):
+    values = set()
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError(f"bad step in {text!r}")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(x) for x in part.split("-", 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if is_dow and end == 7:
+            # 7 is accepted as Sunday as well.
+            if (7 - start) % step == 0:
+                values.add(0)
+            end = 6
+            if start == 7:
+                continue
+        if start < low or end > high or start > end:
+            raise ValueError(f"{text!r} is out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Schedule:
+    """A parsed schedule; next_after(dt) returns the first run time after dt."""
+
+    def __init__(self, expr: str):
+        self.expr = expr.strip()
+        text = ALIASES.get(self.expr, self.expr)
+        m = _EVERY_RE.match(text)
+        if m:
+            self.interval = timedelta(seconds=int(m.group(1)) * _UNITS[m.group(2)])
+            if not self.interval:
+                raise ValueError("@every needs a positive interval")
+            return
+        self.interval = None
+        parts = text.split()
+        if len(parts) != 5:
+            raise ValueError(f"expected 5 cron fields or @every, got {expr!r}")
+        (self.minutes, self.hours, self.days, self.months, self.weekdays) = (
+            _parse_field(p, lo, hi, is_dow=(i == 4)) for i, (p, (lo, hi)) in enumerate(zip(parts, _FIELDS))
+        )
+        # Cron rule: when both day fields are restricted, either may match.
+        self._any_day = parts[2] == "*" or parts[4] == "*"
+
+    def _day_matches(self, d):
+        dom = d.day in self.days
+        dow = (d.weekday() + 1) % 7 in self.weekdays
+        return d.month in self.months and ((dom and dow) if self._any_day else (dom or dow))
+
+    def next_after(self, dt: datetime) -> datetime:
+        if self.interval is not None:
+            return dt + self.interval
+        day = dt.date()
+        for _ in range(366 * 5):
+            if self._day_matches(day):
+                for hour in sorted(self.hours):
+                    for minute in sorted(self.minutes):
+                        candidate = datetime(day.year, day.month, day.day, hour, minute)
+                        if candidate > dt:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"{self.expr!r} never fires")
+
+
+class Job:
+    def __init__(self, name, schedule, func, retries=3, retry_delay=60, lease=900):
+        self.name = name
+        self.schedule = Schedule(schedule)
+        self.func = func
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.lease = lease
+
+
+class Scheduler:
+    def __init__(self, connection_factory, worker_id: Optional[str] = None):
+        self.connection_factory = connection_factory
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.jobs: Dict[str, Job] = {}
+        self._synced = False
+        self._thread = None
+        self._stop = threading.Event()
+
+    def register(self, name: str, schedule: str, func: Callable[[], object], **options):
+        """Add a job; options are retries, retry_delay (seconds) and lease (seconds)."""
+        self.jobs[name] = Job(name, schedule, func, **options)
+        self._synced = False
+
+    def job(self, name, schedule, **options):
+        """Decorator form of register()."""
+        def decorator(func):
+            self.register(name, schedule, func, **options)
+            return func
+        return decorator
+
+    def _now(self, cur) -> datetime:
+        cur.execute("SELECT NOW()")
+        return cur.fetchone()[0]
+
+    def sync(self):
+        """Create rows for new jobs; reschedule jobs whose schedule changed."""
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            now = self._now(cur)
+            for job in self.jobs.values():
+                cur.execute("""
+                    INSERT INTO scheduled_job (name, schedule, next_run_at)
+                    VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        next_run_at = IF(schedule = VALUES(schedule), next_run_at, VALUES(next_run_at)),
+                        schedule = VALUES(schedule)
+                """, (job.name, job.schedule.expr, job.schedule.next_after(now)))
+        self._synced = True
+
+    def _claim(self, job) -> bool:
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            cur.execute("""
+                UPDATE scheduled_job
+                SET locked_by = %s, locked_until = NOW() + INTERVAL %s SECOND,
+                    last_started_at = NOW(), last_status = 'running'
+                WHERE name = %s AND next_run_at <= NOW()
+                  AND (locked_until IS NULL OR locked_until < NOW())
+            """, (self.worker_id, job.lease, job.name))
+            return cur.rowcount == 1
+
+    def _renew(self, job) -> bool:
+        """Extend a lease this worker holds; False once it is no longer ours."""
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            cur.execute("""
+                UPDATE scheduled_job SET locked_until = NOW() + INTERVAL %s SECOND
+                WHERE name = %s AND locked_by = %s
+            """, (job.lease, job.name, self.worker_id))
+            return cur.rowcount == 1
+
+    def _heartbeat(self, job, done: threading.Event):
+        while not done.wait(job.lease / 3):
+            try:
+                if not self._renew(job):
+                    logger.warning("job %s: lease lost while running", job.name)
+                    return
+            except Exception:
+                logger.exception("job %s: lease renewal failed", job.name)
+
+    def _finish(self, job, error: Optional[str], duration_ms: int):
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            now = self._now(cur)
+            if error is None:
+                cur.execute("""
+                    UPDATE scheduled_job
+                    SET locked_by = NULL, locked_until = NULL, attempts = 0,
+                        last_status = 'ok', last_error = NULL, last_finished_at = %s,
+                        last_duration_ms = %s, run_count = run_count + 1, next_run_at = %s
+                    WHERE name = %s AND locked_by = %s
+                """, (now, duration_ms, job.schedule.next_after(now), job.name, self.worker_id))
+                return
+
+            cur.execute("SELECT attempts FROM scheduled_job WHERE name = %s", (job.name,))
+            attempts = cur.fetchone()[0] + 1
+            if attempts <= job.retries:
+                status, next_run = "retrying", now + timedelta(seconds=job.retry_delay * 2 ** (attempts - 1))
+            else:
+                status, next_run, attempts = "failed", job.schedule.next_after(now), 0
+            cur.execute("""
+                UPDATE scheduled_job
+                SET locked_by = NULL, locked_until = NULL, attempts = %s,
+                    last_status = %s, last_error = %s, last_finished_at = %s,
+                    last_duration_ms = %s, fail_count = fail_count + 1, next_run_at = %s
+                WHERE name = %s AND locked_by = %s
+            """, (attempts, status, error, now, duration_ms, next_run, job.name, self.worker_id))
+
+    def run_job(self, job) -> bool:
+        """Run one claimed job and record the outcome; True on success."""
+        started = time.monotonic()
+        error = None
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, done),
+                                     name=f"lease-{job.name}", daemon=True)
+        heartbeat.start()
+        try:
+            job.func()
+        except Exception:
+            error = traceback.format_exc(limit=5)
+        finally:
+            done.set()
+            heartbeat.join()
+        self._finish(job, error, int((time.monotonic() - started) * 1000))
+        return error is None
+
+    def run_pending(self):
+        """Run every job that is due and not running elsewhere. Returns the names run."""
+        if not self._synced:
+            self.sync()
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            cur.execute("""
+                SELECT name FROM scheduled_job
+                WHERE next_run_at <= NOW() AND (locked_until IS NULL OR locked_until < NOW())
+                ORDER BY next_run_at
+            """)
+            due = [row[0] for row in cur.fetchall()]
+        ran = []
+        for name in due:
+            job = self.jobs.get(name)
+            if job is not None and self._claim(job):
+                self.run_job(job)
+                ran.append(name)
+        return ran
+
+    def run_now(self, name: str):
+        """Make a job due immediately (picked up by the next run_pending)."""
+        if name not in self.jobs:
+            raise KeyError(f"no job named {name!r}")
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            cur.execute("UPDATE scheduled_job SET next_run_at = NOW() WHERE name = %s", (name,))
+
+    def status(self):
+        with self.connection_factory() as cn, cn.cursor(dictionary=True) as cur:
+            cur.execute("""
+                SELECT name, schedule, next_run_at, locked_by, locked_until, attempts,
+                       last_status, last_started_at, last_finished_at, last_duration_ms,
+                       last_error, run_count, fail_count
+                FROM scheduled_job
+                ORDER BY name
+            """)
+            rows = cur.fetchall()
+        for row in rows:
+            row["registered"] = row["name"] in self.jobs
+        return rows
+
+    # ---- worker loop --------------------------------------------------------
+
+    def run_forever(self, interval=10):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception:
+                logger.exception("scheduler tick failed")
+            self._stop.wait(interval)
+
+    def start(self, interval=10):
+        """Run due jobs every `interval` seconds in a daemon thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run_forever, args=(interval,),
+                                            name="scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,167 @@
+"""
+Film-to-film similarity from rental co-occurrence.
+
+Two films are similar when the same customers rented both. For each film the
+builder counts, over the customers who rented it, how often every other film
+appears in those customers' histories (one sparse row of the film x film
+co-occurrence matrix), scores the pairs by cosine similarity
+
+    shared(a, b) / sqrt(customers(a) * customers(b))
+
+and keeps the top K in film_similar (migration 006), where Films.similar()
+reads them by primary key.
+
+    python -m utils.similarity build [--full] [--k 10]
+
+The incremental build (the default) only rebuilds the lists of films rented
+by customers whose rentals changed since the last build, found through
+rental.last_update. It reads the histories of the customers who rented
+those films, not the whole rental table, plus one customer count per film
+for the denominators. The scores of other films that mention those films
+drift slightly until the next --full build, which also takes deleted rentals
+into account.
+"""
+import argparse
+import heapq
+import math
+from collections import Counter, defaultdict
+from datetime import timedelta
+from typing import Dict, List, Set, Tuple
+
+from utils.table_operations import transaction
+
+DEFAULT_K = 10
+# Pairs shared by fewer customers than this are treated as noise.
+MIN_SHARED = 2
+# Re-read this much rental history before the watermark (see change_feed.py).
+WATERMARK_OVERLAP = timedelta(seconds=5)
+
+
+def _in(column, ids):
+    return f" WHERE {column} IN ({', '.join(['%s'] * len(ids))})"
+
+
+def _load_pairs(cur, customers=None) -> Tuple[Dict[int, Set[int]], Dict[int, Set[int]]]:
+    """(film -> customers, customer -> films), over every customer or only `customers`."""
+    where, params = ("", ()) if customers is None else (_in("customer_id", customers),
+                                                        tuple(customers) * 2)
+    # Archived rentals (utils/archive.py) are still part of a customer's history.
+    cur.execute(f"""
+        SELECT customer_id, film_id FROM rental{where}
+        UNION
+        SELECT customer_id, film_id FROM rental_archive{where}
+    """, params)
+    film_customers: Dict[int, Set[int]] = defaultdict(set)
+    customer_films: Dict[int, Set[int]] = defaultdict(set)
+    for customer_id, film_id in cur.fetchall():
+        film_customers[film_id].add(customer_id)
+        customer_films[customer_id].add(film_id)
+    return film_customers, customer_films
+
+
+def _film_sizes(cur, films) -> Dict[int, int]:
+    """Distinct customers per film, for the cosine denominators."""
+    where = _in("film_id", films)
+    cur.execute(f"""
+        SELECT film_id, COUNT(*) FROM (
+            SELECT customer_id, film_id FROM rental{where}
+            UNION
+            SELECT customer_id, film_id FROM rental_archive{where}
+        ) pairs
+        GROUP BY film_id
+    """, tuple(films) * 2)
+    return dict(cur.fetchall())
+
+
+def neighbours(film_id, film_customers, customer_films, k=DEFAULT_K,
+               min_shared=MIN_SHARED, sizes=None) -> List[Tuple[int, float, int]]:
+    """
+    Top-k (similar_film_id, score, shared_customers) for one film.
+    film_customers must hold every customer of film_id; `sizes` gives the
+    other films' customer counts when film_customers only holds some of them.
+    """
+    shared = Counter()
+    for customer_id in film_customers.get(film_id, ()):
+        shared.update(customer_films[customer_id])
+    shared.pop(film_id, None)
+
+    n = len(film_customers.get(film_id, ()))
+    candidates = (
+        (count / math.sqrt(n * (sizes[other] if sizes is not None else len(film_customers[other]))),
+         count, -other)
+        for other, count in shared.items() if count >= min_shared
+    )
+    return [(-neg_other, score, count)
+            for score, count, neg_other in heapq.nlargest(k, candidates)]
+
+
+def _films_to_rebuild(cur, mark) -> List[int]:
+    """Every film rented by a customer whose rentals changed since `mark`."""
+    cur.execute("SELECT DISTINCT customer_id FROM rental WHERE last_update >= %s",
+                (mark - WATERMARK_OVERLAP,))
+    changed = [customer_id for (customer_id,) in cur.fetchall()]
+    if not changed:
+        return []
+    return sorted(_load_pairs(cur, changed)[0])
+
+
+def _customers_of(cur, films) -> List[int]:
+    where = _in("film_id", films)
+    cur.execute(f"""
+        SELECT customer_id FROM rental{where}
+        UNION
+        SELECT customer_id FROM rental_archive{where}
+    """, tuple(films) * 2)
+    return [customer_id for (customer_id,) in cur.fetchall()]
+
+
+def build(connection_factory, k=DEFAULT_K, full=False) -> int:
+    """Rebuild film_similar (all films, or only those affected by new rentals).
+    Returns the number of films whose neighbour list was rewritten."""
+    with transaction(connection_factory, touches=("film_similar",)) as cur:
+        cur.execute("SELECT rental_mark, NOW() FROM film_similar_state WHERE id = 1 FOR UPDATE")
+        mark, now = cur.fetchone()
+
+        sizes = None
+        if full or mark is None:
+            film_customers, customer_films = _load_pairs(cur)
+            films = list(film_customers)
+            cur.execute("DELETE FROM film_similar")
+        else:
+            films = _films_to_rebuild(cur, mark)
+            if films:
+                # Complete histories of everyone who rented a rebuilt film:
+                # enough to count its co-rentals, not the other films' sizes.
+                film_customers, customer_films = _load_pairs(cur, _customers_of(cur, films))
+                sizes = _film_sizes(cur, list(film_customers))
+                cur.execute("DELETE FROM film_similar" + _in("film_id", films), films)
+
+        rows = []
+        for film_id in films:
+            for position, (other, score, count) in enumerate(
+                    neighbours(film_id, film_customers, customer_films, k, sizes=sizes), start=1):
+                rows.append((film_id, position, other, score, count))
+        if rows:
+            cur.executemany("""
+                INSERT INTO film_similar (film_id, position, similar_film_id, score, shared_customers)
+                VALUES (%s, %s, %s, %s, %s)
+            """, rows)
+
+        cur.execute("UPDATE film_similar_state SET rental_mark = %s, built_at = %s WHERE id = 1",
+                    (now, now))
+    return len(films)
+
+
+def main(argv=None):
+    from utils.db import get_connection
+
+    parser = argparse.ArgumentParser(description="Build the film similarity index")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--full", action="store_true", help="rebuild every film's list")
+    parser.add_argument("--k", type=int, default=DEFAULT_K, help="neighbours kept per film")
+    args = parser.parse_args(argv)
+    print(f"rebuilt {build(get_connection, k=args.k, full=args.full)} film(s)")
+
+
+if __name__ == "__main__":
+    main()
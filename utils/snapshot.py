@@ -0,0 +1,371 @@
+"""
+Optional in-process columnar snapshot of the payment and rental fact tables.
+
+Dashboard aggregates (top spenders, top countries by spending, top rented
+films, revenue series, payment method stats) are answered with vectorized
+NumPy group-bys over arrays held in memory instead of re-joining
+customer -> address -> city -> country and re-scanning payment/rental.
+
+The snapshot is loaded once and then refreshed incrementally: fact rows with
+last_update >= the previous watermark are upserted by primary key, and the
+small dimension lookups are reloaded only when their tables' MAX(last_update)
+moves. Deleted fact rows are dropped from the row_tombstone entries
+(migration 004) written since the previous refresh. Writes made through
+table_operations bump table_versions, and the next query refreshes first, so
+this process never serves numbers older than its own writes, deletes
+included; writes from elsewhere are picked up once the snapshot is older than
+max_age seconds, or at once through the change feed (apply()). A snapshot
+left unrefreshed for longer than TOMBSTONE_HORIZON reloads in full, since the
+purge job may have removed tombstones it has not read. Archived rows
+(utils/archive.py) are read with the hot ones; moving a row to the archive
+leaves no tombstone, so the snapshot keeps it.
+
+Requires numpy (optional dependency). Enable with use_fact_snapshot in settings.py.
+"""
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+
+from utils.cache import table_versions
+
+FACT_TABLES = ("payment", "rental")
+DIM_TABLES = ("customer", "address", "city", "country", "film")
+
+# last_update has one-second resolution and a row can commit after a newer one;
+# re-read this much history on every refresh (upserts are idempotent).
+WATERMARK_OVERLAP = timedelta(seconds=5)
+
+# Hot and archived rows (utils/archive.py); {where} is applied to both sides.
+_PAYMENT_SQL = " UNION ALL ".join(f"""
+    SELECT payment_id, customer_id, ROUND(amount * 100), payment_date,
+           COALESCE(payment_method, ''), last_update
+    FROM {table}{{where}}
+""" for table in ("payment", "payment_archive"))
+_RENTAL_SQL = " UNION ALL ".join(f"""
+    SELECT rental_id, film_id, customer_id, rental_date, return_date, last_update
+    FROM {table}{{where}}
+""" for table in ("rental", "rental_archive"))
+
+
+# purge-tombstones keeps a week of tombstones; a snapshot idle for longer
+# than this reloads in full instead of trusting them.
+TOMBSTONE_HORIZON = 24 * 3600
+
+
+def _money(cents):
+    return Decimal(int(cents)).scaleb(-2)
+
+
+class _Facts:
+    """Column arrays for one fact table plus a primary key -> row position map."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.pos = {int(pk): i for i, pk in enumerate(columns["id"])}
+
+    def __len__(self):
+        return len(self.columns["id"])
+
+    def upsert(self, new_columns):
+        """Return a new _Facts with rows replaced or appended (copy-on-write)."""
+        ids = new_columns["id"]
+        if len(ids) == 0:
+            return self
+        cols = {k: v.copy() for k, v in self.columns.items()}
+        existing = np.array([self.pos.get(int(pk), -1) for pk in ids], dtype=np.int64)
+        hit = existing >= 0
+        for k in cols:
+            cols[k][existing[hit]] = new_columns[k][hit]
+            cols[k] = np.concatenate([cols[k], new_columns[k][~hit]])
+        return _Facts(cols)
+
+    def drop(self, ids):
+        """Return a new _Facts without the given primary keys."""
+        gone = [self.pos[pk] for pk in ids if pk in self.pos]
+        if not gone:
+            return self
+        keep = np.ones(len(self), dtype=bool)
+        keep[gone] = False
+        return _Facts({k: v[keep] for k, v in self.columns.items()})
+
+
+class FactSnapshot:
+    def __init__(self, connection_factory, max_age=60):
+        self.connection_factory = connection_factory
+        self.max_age = max_age
+        self.refreshed_at = 0.0
+        self._lock = threading.Lock()
+        self._payments = None
+        self._rentals = None
+        self._methods = [""]          # payment_method vocabulary; codes index into it
+        self._dims = None
+        self._dim_marks = None
+        self._watermarks = {}
+        self._tombstone = 0           # last row_tombstone id applied
+        self._versions = None
+
+    # ---- loading -------------------------------------------------------
+
+    def _fetch(self, sql, since=None):
+        if since is None:
+            sql, params = sql.format(where=""), ()
+        else:
+            sql = sql.format(where=" WHERE last_update >= %s")
+            params = (since - WATERMARK_OVERLAP,) * sql.count("%s")
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
+
+    def _tombstone_mark(self):
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            cur.execute("SELECT COALESCE(MAX(tombstone_id), 0) FROM row_tombstone")
+            return cur.fetchall()[0][0]
+
+    def _deleted_since(self, mark):
+        """Fact rows deleted after tombstone `mark`: (new mark, {table: [ids]})."""
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            cur.execute("""
+                SELECT tombstone_id, table_name, row_id FROM row_tombstone
+                WHERE tombstone_id > %s AND table_name IN ('payment', 'rental')
+                ORDER BY tombstone_id
+            """, (mark,))
+            rows = cur.fetchall()
+        deleted = {table: [] for table in FACT_TABLES}
+        for tombstone_id, table, row_id in rows:
+            deleted[table].append(int(row_id))
+            mark = tombstone_id
+        return mark, deleted
+
+    def _method_code(self, name):
+        try:
+            return self._methods.index(name)
+        except ValueError:
+            self._methods.append(name)
+            return len(self._methods) - 1
+
+    def _payment_columns(self, rows):
+        return {
+            "id": np.array([r[0] for r in rows], dtype=np.int64),
+            "customer_id": np.array([r[1] for r in rows], dtype=np.int32),
+            "cents": np.array([r[2] for r in rows], dtype=np.int64),
+            "date": np.array([r[3] for r in rows], dtype="datetime64[s]"),
+            "method": np.array([self._method_code(r[4]) for r in rows], dtype=np.int16),
+        }
+
+    @staticmethod
+    def _rental_columns(rows):
+        return {
+            "id": np.array([r[0] for r in rows], dtype=np.int64),
+            "film_id": np.array([r[1] for r in rows], dtype=np.int32),
+            "customer_id": np.array([r[2] for r in rows], dtype=np.int32),
+            "rental_date": np.array([r[3] for r in rows], dtype="datetime64[s]"),
+            "return_date": np.array([r[4] if r[4] is not None else "NaT" for r in rows],
+                                    dtype="datetime64[s]"),
+        }
+
+    @staticmethod
+    def _max_update(rows, previous):
+        marks = [r[-1] for r in rows if r[-1] is not None]
+        return max(marks) if marks else previous
+
+    def _dim_watermarks(self):
+        sql = " UNION ALL ".join(f"SELECT MAX(last_update) FROM {t}" for t in DIM_TABLES)
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            cur.execute(sql)
+            return tuple(r[0] for r in cur.fetchall())
+
+    def _load_dims(self):
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            cur.execute("""
+                SELECT c.customer_id, CONCAT(c.first_name, ' ', c.last_name), c.email,
+                       ci.city, co.country_id
+                FROM customer c
+                JOIN address a  ON a.address_id = c.address_id
+                JOIN city ci    ON ci.city_id = a.city_id
+                JOIN country co ON co.country_id = ci.country_id
+            """)
+            customers = cur.fetchall()
+            cur.execute("SELECT country_id, country FROM country")
+            countries = dict(cur.fetchall())
+            cur.execute("SELECT film_id, title FROM film")
+            films = dict(cur.fetchall())
+
+        size = max([r[0] for r in customers], default=0) + 1
+        country_of = np.full(size, -1, dtype=np.int32)
+        info = {}
+        for cid, name, email, city, country_id in customers:
+            country_of[cid] = country_id
+            info[cid] = {"customer_name": name, "email": email, "city": city,
+                         "country": countries.get(country_id)}
+        return {"country_of": country_of, "customers": info,
+                "countries": countries, "films": films}
+
+    def load(self):
+        """Full (re)load of facts and dimensions."""
+        with self._lock:
+            versions = table_versions.get(*FACT_TABLES, *DIM_TABLES)
+            # Read first: a delete during the load is then applied next time.
+            tombstone = self._tombstone_mark()
+            payments = self._fetch(_PAYMENT_SQL)
+            rentals = self._fetch(_RENTAL_SQL)
+            self._dim_marks = self._dim_watermarks()
+            self._dims = self._load_dims()
+            self._payments = _Facts(self._payment_columns(payments))
+            self._rentals = _Facts(self._rental_columns(rentals))
+            self._watermarks = {"payment": self._max_update(payments, None),
+                                "rental": self._max_update(rentals, None)}
+            self._tombstone = tombstone
+            self._versions = versions
+            self.refreshed_at = time.monotonic()
+
+    def refresh(self):
+        """Incremental refresh from the last_update watermarks and new tombstones."""
+        if self._payments is None or time.monotonic() - self.refreshed_at > TOMBSTONE_HORIZON:
+            return self.load()
+        with self._lock:
+            versions = table_versions.get(*FACT_TABLES, *DIM_TABLES)
+            tombstone, deleted = self._deleted_since(self._tombstone)
+            payments = self._fetch(_PAYMENT_SQL, self._watermarks["payment"])
+            rentals = self._fetch(_RENTAL_SQL, self._watermarks["rental"])
+            self._payments = (self._payments.upsert(self._payment_columns(payments))
+                              .drop(deleted["payment"]))
+            self._rentals = (self._rentals.upsert(self._rental_columns(rentals))
+                             .drop(deleted["rental"]))
+            self._tombstone = tombstone
+            self._watermarks["payment"] = self._max_update(payments, self._watermarks["payment"])
+            self._watermarks["rental"] = self._max_update(rentals, self._watermarks["rental"])
+            marks = self._dim_watermarks()
+            if marks != self._dim_marks:
+                self._dims = self._load_dims()
+                self._dim_marks = marks
+            self._versions = versions
+            self.refreshed_at = time.monotonic()
+
+    def apply(self, batch):
+        """ChangeFeed subscriber: drop deleted fact rows, refresh on the next query otherwise."""
+        if self._payments is None:
+            return
+        with self._lock:
+            if batch.deleted and batch.table == "payment":
+                self._payments = self._payments.drop(batch.deleted)
+            elif batch.deleted and batch.table == "rental":
+                self._rentals = self._rentals.drop(batch.deleted)
+            if batch.upserted or batch.table in DIM_TABLES:
+                self._versions = None
+
+    def _current(self):
+        if (self._payments is None
+                or table_versions.get(*FACT_TABLES, *DIM_TABLES) != self._versions
+                or time.monotonic() - self.refreshed_at > self.max_age):
+            self.refresh()
+        return self._payments.columns, self._rentals.columns, self._dims
+
+    @property
+    def loaded(self):
+        return self._payments is not None
+
+    # ---- queries (same shapes as the table_operations methods) -----------
+
+    def top_spenders(self, limit: int = 20):
+        pay, _, dims = self._current()
+        totals = np.bincount(pay["customer_id"], weights=pay["cents"])
+        counts = np.bincount(pay["customer_id"])
+        rows = []
+        for cid in np.argsort(-totals, kind="stable"):
+            if len(rows) >= limit or counts[cid] == 0:
+                break
+            info = dims["customers"].get(int(cid))
+            if info is None:
+                continue
+            rows.append(dict(info, customer_id=int(cid),
+                             total_paid=_money(totals[cid]), payments_count=int(counts[cid])))
+        return rows
+
+    def top_countries_by_spending(self, limit: int = 15):
+        pay, _, dims = self._current()
+        country_of = dims["country_of"]
+        cust = pay["customer_id"]
+        known = cust < len(country_of)
+        country = np.where(known, country_of[np.where(known, cust, 0)], -1)
+        mask = country >= 0
+        totals = np.bincount(country[mask], weights=pay["cents"][mask])
+        order = [c for c in np.argsort(-totals, kind="stable") if totals[c] > 0][:limit]
+        return [{"rank": i, "country": dims["countries"].get(int(c)), "total_spent": _money(totals[c])}
+                for i, c in enumerate(order, start=1)]
+
+    def top_rented_films(self, limit=10):
+        _, rent, dims = self._current()
+        counts = np.bincount(rent["film_id"])
+        order = [f for f in np.argsort(-counts, kind="stable") if counts[f] > 0][:limit]
+        return [{"film_id": int(f), "title": dims["films"].get(int(f)), "rental_count": int(counts[f])}
+                for f in order]
+
+    def _payment_mask(self, pay, dims, start=None, end=None, payment_method=None, country_id=None):
+        mask = np.ones(len(pay["id"]), dtype=bool)
+        day = pay["date"].astype("datetime64[D]")
+        if start:
+            mask &= day >= np.datetime64(start, "D")
+        if end:
+            mask &= day <= np.datetime64(end, "D")
+        if payment_method:
+            code = self._methods.index(payment_method) if payment_method in self._methods else -1
+            mask &= pay["method"] == code
+        if country_id:
+            country_of = dims["country_of"]
+            cust = pay["customer_id"]
+            mask &= (cust < len(country_of)) & (country_of[np.minimum(cust, len(country_of) - 1)] == country_id)
+        return mask
+
+    def revenue_series(self, granularity="month", start=None, end=None,
+                       payment_method=None, country_id=None, newest_first=True):
+        pay, _, dims = self._current()
+        mask = self._payment_mask(pay, dims, start, end, payment_method, country_id)
+        days = pay["date"][mask].astype("datetime64[D]")
+        if granularity == "day":
+            buckets = days
+        elif granularity == "week":
+            # 1970-01-01 was a Thursday; shift back to the Monday of each week.
+            buckets = days - ((days.astype(np.int64) + 3) % 7).astype("timedelta64[D]")
+        elif granularity == "month":
+            buckets = days.astype("datetime64[M]").astype("datetime64[D]")
+        elif granularity == "quarter":
+            months = days.astype("datetime64[M]").astype(np.int64)
+            buckets = (months - months % 3).astype("datetime64[M]").astype("datetime64[D]")
+        else:
+            raise ValueError(f"unknown granularity: {granularity}")
+
+        periods, inverse = np.unique(buckets, return_inverse=True)
+        totals = np.bincount(inverse, weights=pay["cents"][mask], minlength=len(periods))
+        counts = np.bincount(inverse, minlength=len(periods))
+        rows = []
+        for period, total, count in zip(periods.astype(object), totals, counts):
+            if granularity == "month":
+                label = period.strftime("%Y-%m")
+            elif granularity == "quarter":
+                label = f"{period.year} Q{(period.month - 1) // 3 + 1}"
+            elif granularity == "week":
+                label = f"Week of {period.isoformat()}"
+            else:
+                label = period.isoformat()
+            rows.append({"period_start": period, "label": label,
+                         "total": _money(total), "payment_count": int(count)})
+        return rows[::-1] if newest_first else rows
+
+    def method_stats(self, start=None, end=None, country_id=None):
+        pay, _, dims = self._current()
+        mask = self._payment_mask(pay, dims, start, end, None, country_id)
+        codes = pay["method"][mask]
+        totals = np.bincount(codes, weights=pay["cents"][mask], minlength=len(self._methods))
+        counts = np.bincount(codes, minlength=len(self._methods))
+        rows = [{"payment_method": self._methods[i] or None, "usage_count": int(counts[i]),
+                 "total": _money(totals[i])}
+                for i in range(len(counts)) if counts[i]]
+        return sorted(rows, key=lambda r: r["total"], reverse=True)
+
+    def get_analytics(self):
+        monthly_revenue = [{"month_year": r["label"], "total": r["total"]}
+                           for r in self.revenue_series("month")[:10]]
+        return monthly_revenue, self.method_stats()
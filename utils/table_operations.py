@@ -1,32 +1,175 @@
-from typing import Callable, Dict, List, Any
+from contextlib import contextmanager
+from datetime import date, datetime, time
+from typing import Callable, Dict, Iterable, List, Any
 import mysql.connector
+from mysql.connector import errorcode
+from utils.cache import cached_query, table_versions
+from utils.deadlines import deadline
+from utils.facets import FacetIndex
+from utils.filters import Filter, FilterSpec
 
 def _dict_rows(cur) -> List[Dict[str, Any]]:
     cols = [c[0] for c in cur.description]
     return [dict(zip(cols, row)) for row in cur.fetchall()]
 
+@contextmanager
+def transaction(connection_factory, touches=(), **cursor_kwargs):
+    """
+    Unit of work for multi-statement writes.
+    Connections are opened with autocommit=True, so without this every statement
+    is its own commit. Statements run on the yielded cursor share one transaction
+    and one commit; any exception rolls all of them back.
+    `touches` lists the tables written; their cache versions are bumped after commit.
+    """
+    with connection_factory() as cn, cn.cursor(**cursor_kwargs) as cur:
+        cn.start_transaction()
+        try:
+            yield cur
+            cn.commit()
+        except Exception:
+            cn.rollback()
+            raise
+    table_versions.bump(*touches)
+
+# payment and rental are partitioned (migration 009), and partitioned tables
+# cannot take part in foreign keys. These two helpers do the checks the
+# constraints used to do, inside the caller's transaction.
+
+def _require(cur, table: str, key: str, value):
+    """The referenced row must exist; it stays share-locked until commit."""
+    cur.execute(f"SELECT 1 FROM {table} WHERE {key} = %s FOR SHARE", (value,))
+    if not cur.fetchall():
+        raise ValueError(f"No {table} with id {value}.")
+
+def _refuse_delete(cur, table: str, key: str, value, children):
+    """Lock the row, then fail while any (child table, column) still refers to it."""
+    cur.execute(f"SELECT 1 FROM {table} WHERE {key} = %s FOR UPDATE", (value,))
+    cur.fetchall()
+    for child, column in children:
+        cur.execute(f"SELECT 1 FROM {child} WHERE {column} = %s LIMIT 1", (value,))
+        if cur.fetchall():
+            raise ValueError(f"This {table} still has {child} records.")
+
+def _require_hot(cur, table: str, key: str, value):
+    """Archived rows are read-only: lock the hot row, refuse if it only exists in the archive."""
+    cur.execute(f"SELECT 1 FROM {table} WHERE {key} = %s FOR UPDATE", (value,))
+    if not cur.fetchall():
+        cur.execute(f"SELECT 1 FROM {table}_archive WHERE {key} = %s", (value,))
+        if cur.fetchall():
+            raise ValueError(f"This {table} is archived and read-only.")
+
+# Old payments and closed rentals move to *_archive tables (utils/archive.py).
+# Reads whose date range reaches below archive_state.archived_before read the
+# hot and archived rows together through these derived tables.
+_PAYMENT_ALL = """(
+    SELECT payment_id, customer_id, rental_id, amount, payment_date, last_update, payment_method FROM payment
+    UNION ALL
+    SELECT payment_id, customer_id, rental_id, amount, payment_date, last_update, payment_method FROM payment_archive
+)"""
+_RENTAL_ALL = """(
+    SELECT rental_id, rental_date, return_date, due_date, customer_id, film_id FROM rental
+    UNION ALL
+    SELECT rental_id, rental_date, return_date, due_date, customer_id, film_id FROM rental_archive
+)"""
+
+# All-time aggregates add the hot rows to the per-customer and per-film totals
+# of the archived ones (migration 012) instead: up to two rows per customer or
+# film, summed by the caller, and no archive scan.
+_CUSTOMER_PAYMENT_TOTALS = """(
+    SELECT customer_id, SUM(amount) AS total_paid, COUNT(*) AS payments_count
+    FROM payment GROUP BY customer_id
+    UNION ALL
+    SELECT customer_id, payment_total, payment_count
+    FROM customer_archive_total WHERE payment_count > 0
+)"""
+_FILM_RENTAL_TOTALS = """(
+    SELECT film_id, COUNT(*) AS rental_count FROM rental GROUP BY film_id
+    UNION ALL
+    SELECT film_id, rental_count FROM film_archive_total
+)"""
+
+def _reaches_archive(since, mark) -> bool:
+    """True when a date range starting at `since` (None: unbounded) reaches below `mark`."""
+    if mark is None:
+        return False
+    if since is None:
+        return True
+    if isinstance(since, str):
+        since = date.fromisoformat(since[:10])
+    if not isinstance(since, datetime):
+        since = datetime.combine(since, time.min)
+    return since < mark
+
+def _archived_before(cur, table: str):
+    cur.execute("SELECT archived_before FROM archive_state WHERE table_name = %s", (table,))
+    row = cur.fetchall()
+    return row[0][0] if row else None
+
+def _unknown_count(self, *args, **kwargs):
+    """Deadline fallback for counts: unknown, the page shows open-ended paging."""
+    return None
+
 class Films:
     """Data-access helpers for the Sakila-like schema using mysql.connector."""
+
+    _SEARCH = FilterSpec(
+        "films",
+        filters=[
+            Filter("language_id", "f.language_id = %s"),
+            Filter("category_id", "fc.category_id = %s", joins=["fc"]),
+            Filter("q", "f.title LIKE %s", like=True),
+            Filter("available", "NOT EXISTS (SELECT 1 FROM open_rentals o WHERE o.film_id = f.film_id)"),
+        ],
+        select="""
+            SELECT
+                f.film_id, f.title, f.release_year, f.rating,
+                l.name AS language_name,
+                GROUP_CONCAT(DISTINCT c.name ORDER BY c.name SEPARATOR ', ') AS categories
+            FROM film AS f
+            JOIN language l ON l.language_id = f.language_id
+            LEFT JOIN film_category fc ON fc.film_id = f.film_id
+            LEFT JOIN category c ON c.category_id = fc.category_id
+            {where}
+            GROUP BY f.film_id, f.title, f.release_year, f.rating, l.name
+            ORDER BY f.title
+            LIMIT %s OFFSET %s
+        """,
+        # language is a required FK and category rows only matter when
+        # filtering on them, so the count joins film_category only then.
+        count="SELECT COUNT(DISTINCT f.film_id) FROM film AS f {joins} {where}",
+        joins={"fc": "LEFT JOIN film_category fc ON fc.film_id = f.film_id"},
+    )
+
     def __init__(self, connection_factory: Callable[[], mysql.connector.MySQLConnection]):
         self.connection_factory = connection_factory
+        # Loaded on first use; follows add/update/delete through table_versions.
+        self.facets = FacetIndex(connection_factory)
 
-    def search(self, category_id=None, language_id=None, q=None, page=1, page_size=20):
+    def search(self, category_id=None, language_id=None, q=None, available=None,
+               page=1, page_size=20):
         offset = (page - 1) * page_size
-        where = []
-        params = []
-
-        if language_id:
-            where.append("f.language_id = %s")
-            params.append(language_id)
-        if category_id:
-            where.append("fc.category_id = %s")
-            params.append(category_id)
-        if q:
-            where.append("f.title LIKE %s")
-            params.append(f"%{q}%")
-
-        where_clause = ("WHERE " + " AND ".join(where)) if where else ""
+        query = self._SEARCH.compile(dict(category_id=category_id, language_id=language_id,
+                                          q=q, available=available))
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            query.run(cur, page_size, offset)
+            return _dict_rows(cur)
 
+    def browse(self, selected=None, q=None, available=False, page=1, page_size=20):
+        """
+        Faceted search for /films: the facet index resolves the filters and
+        picks the page, MySQL only reads that page's rows by primary key.
+        Returns films, total and facets (see FacetIndex.search).
+        """
+        result = self.facets.search(selected, q=q, available=available,
+                                    page=page, page_size=page_size)
+        result["films"] = self.get_many(result["film_ids"])
+        return result
+
+    def get_many(self, film_ids: List[int]):
+        """List rows (same columns as search) for the given ids, in that order."""
+        if not film_ids:
+            return []
+        marks = ", ".join(["%s"] * len(film_ids))
         sql = f"""
             SELECT
                 f.film_id, f.title, f.release_year, f.rating,
@@ -36,15 +179,13 @@ class Films:
             JOIN language l ON l.language_id = f.language_id
             LEFT JOIN film_category fc ON fc.film_id = f.film_id
             LEFT JOIN category c ON c.category_id = fc.category_id
-            {where_clause}
+            WHERE f.film_id IN ({marks})
             GROUP BY f.film_id, f.title, f.release_year, f.rating, l.name
-            ORDER BY f.title
-            LIMIT %s OFFSET %s
         """
-        params += [page_size, offset]
         with self.connection_factory() as cn, cn.cursor() as cur:
-            cur.execute(sql, params)
-            return _dict_rows(cur)
+            cur.execute(sql, list(film_ids))
+            by_id = {row["film_id"]: row for row in _dict_rows(cur)}
+        return [by_id[film_id] for film_id in film_ids if film_id in by_id]
 
     def get(self, film_id: int):
         sql = """
@@ -94,7 +235,7 @@ class Films:
         
         category_id = data.get("category_id")
 
-        with self.connection_factory() as cn, cn.cursor() as cur:
+        with transaction(self.connection_factory, touches=("film", "film_category")) as cur:
             cur.execute(sql_film, params)
             new_film_id = cur.lastrowid
             
@@ -102,14 +243,17 @@ class Films:
                 sql_cat = "INSERT INTO film_category (film_id, category_id) VALUES (%s, %s)"
                 cur.execute(sql_cat, (new_film_id, category_id))
                 
-            return new_film_id
+        return new_film_id
 
     def delete(self, film_id: int):
         """
         First removes dependencies in film_actor and film_category 
         to prevent Foreign Key constraints from failing.
+        All three deletes commit together or not at all.
         """
-        with self.connection_factory() as cn, cn.cursor() as cur:
+        with transaction(self.connection_factory, touches=("film", "film_actor", "film_category")) as cur:
+            _refuse_delete(cur, "film", "film_id", film_id,
+                           [("rental", "film_id"), ("rental_archive", "film_id")])
             cur.execute("DELETE FROM film_actor WHERE film_id = %s", (film_id,))
             cur.execute("DELETE FROM film_category WHERE film_id = %s", (film_id,))
             cur.execute("DELETE FROM film WHERE film_id = %s", (film_id,))
@@ -140,11 +284,13 @@ class Films:
             cur.execute(sql, (film_id,))
             return _dict_rows(cur)
 
+    @cached_query("language")
     def languages(self):
         with self.connection_factory() as cn, cn.cursor() as cur:
             cur.execute("SELECT language_id, name FROM language ORDER BY name")
             return _dict_rows(cur)
 
+    @cached_query("category")
     def categories(self):
         with self.connection_factory() as cn, cn.cursor() as cur:
             cur.execute("SELECT category_id, name FROM category ORDER BY name")
@@ -167,7 +313,7 @@ class Films:
         )
         category_id = data.get("category_id")
         
-        with self.connection_factory() as cn, cn.cursor() as cur:
+        with transaction(self.connection_factory, touches=("film", "film_category")) as cur:
             cur.execute(sql_film, params_film)
             
             if category_id:
@@ -179,17 +325,89 @@ class Films:
                     cur.execute(insert_cat_sql, (film_id, category_id))
 
     def add_actor(self, film_id: int, actor_id: int):
-        sql_check = "SELECT 1 FROM film_actor WHERE film_id=%s AND actor_id=%s"
-        sql_ins = "INSERT INTO film_actor(actor_id, film_id) VALUES(%s, %s)"
-        with self.connection_factory() as cn, cn.cursor() as cur:
-            cur.execute(sql_check, (film_id, actor_id))
-            if cur.fetchone() is None:
-                cur.execute(sql_ins, (actor_id, film_id))
+        self.add_actors(film_id, [actor_id])
 
     def remove_actor(self, film_id: int, actor_id: int):
-        sql = "DELETE FROM film_actor WHERE film_id=%s AND actor_id=%s"
+        self.remove_actors(film_id, [actor_id])
+
+    @staticmethod
+    def _insert_actors(cur, film_id, actor_ids):
+        rows = ", ".join(["(%s, %s)"] * len(actor_ids))
+        params = []
+        for actor_id in actor_ids:
+            params += [actor_id, film_id]
+        cur.execute(f"INSERT IGNORE INTO film_actor(actor_id, film_id) VALUES {rows}", params)
+
+    @staticmethod
+    def _delete_actors(cur, film_id, actor_ids):
+        placeholders = ", ".join(["%s"] * len(actor_ids))
+        sql = f"DELETE FROM film_actor WHERE film_id=%s AND actor_id IN ({placeholders})"
+        cur.execute(sql, [film_id] + list(actor_ids))
+
+    def add_actors(self, film_id: int, actor_ids: Iterable[int]):
+        """Add many actors in one multi-row INSERT; actors already on the film are skipped."""
+        actor_ids = sorted(set(actor_ids))
+        if not actor_ids:
+            return
+        with transaction(self.connection_factory, touches=("film_actor",)) as cur:
+            self._insert_actors(cur, film_id, actor_ids)
+
+    def remove_actors(self, film_id: int, actor_ids: Iterable[int]):
+        actor_ids = sorted(set(actor_ids))
+        if not actor_ids:
+            return
+        with transaction(self.connection_factory, touches=("film_actor",)) as cur:
+            self._delete_actors(cur, film_id, actor_ids)
+
+    def set_actors(self, film_id: int, actor_ids: Iterable[int]):
+        """
+        Make the film's cast exactly `actor_ids`.
+        Diffs against the current film_actor rows (locked for the transaction) and
+        applies only the delta: at most one SELECT, one INSERT and one DELETE.
+        Returns (added, removed) actor id lists.
+        """
+        wanted = set(actor_ids)
+        with transaction(self.connection_factory, touches=("film_actor",)) as cur:
+            cur.execute("SELECT actor_id FROM film_actor WHERE film_id=%s FOR UPDATE", (film_id,))
+            current = {row[0] for row in cur.fetchall()}
+            added = sorted(wanted - current)
+            removed = sorted(current - wanted)
+            if added:
+                self._insert_actors(cur, film_id, added)
+            if removed:
+                self._delete_actors(cur, film_id, removed)
+        return added, removed
+
+    def cast_options(self, film_id: int):
+        """All actors with an in_cast flag for this film, cast members first (one query)."""
+        sql = """
+            SELECT a.actor_id, a.first_name, a.last_name,
+                   (fa.film_id IS NOT NULL) AS in_cast
+            FROM actor a
+            LEFT JOIN film_actor fa ON fa.actor_id = a.actor_id AND fa.film_id = %s
+            ORDER BY in_cast DESC, a.last_name, a.first_name
+        """
         with self.connection_factory() as cn, cn.cursor() as cur:
-            cur.execute(sql, (film_id, actor_id))
+            cur.execute(sql, (film_id,))
+            return _dict_rows(cur)
+
+    def similar(self, film_id: int, k: int = 5):
+        """
+        Films most often rented by the same customers, best first, read from the
+        precomputed film_similar table (see utils/similarity.py).
+        Returns film_id, title, rating, score, shared_customers.
+        """
+        sql = """
+            SELECT f.film_id, f.title, f.rating, s.score, s.shared_customers
+            FROM film_similar s
+            JOIN film f ON f.film_id = s.similar_film_id
+            WHERE s.film_id = %s
+            ORDER BY s.position
+            LIMIT %s
+        """
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            cur.execute(sql, (film_id, k))
+            return _dict_rows(cur)
 
     def count(self) -> int:
         with self.connection_factory() as cn, cn.cursor() as cur:
@@ -197,35 +415,14 @@ class Films:
             (n,) = cur.fetchone()
             return int(n)
 
-    def count_search(self, category_id=None, language_id=None, q=None):
-        where = []
-        params = []
-
-        if language_id:
-            where.append("f.language_id = %s")
-            params.append(language_id)
-        if category_id:
-            where.append("fc.category_id = %s")
-            params.append(category_id)
-        if q:
-            where.append("f.title LIKE %s")
-            params.append(f"%{q}%")
-
-        where_clause = ("WHERE " + " AND ".join(where)) if where else ""
-
-        sql = f"""
-            SELECT COUNT(DISTINCT f.film_id)
-            FROM film AS f
-            JOIN language l ON l.language_id = f.language_id
-            LEFT JOIN film_category fc ON fc.film_id = f.film_id
-            LEFT JOIN category c ON c.category_id = fc.category_id
-            {where_clause}
-        """
-
+    def count_search(self, category_id=None, language_id=None, q=None, available=None):
+        query = self._SEARCH.compile(dict(category_id=category_id, language_id=language_id,
+                                          q=q, available=available))
         with self.connection_factory() as cn, cn.cursor() as cur:
-            cur.execute(sql, params)
+            query.run_count(cur)
             return cur.fetchone()[0]
     
+    @deadline(2000)
     def get_stats(self):
         stats = {}
         
@@ -278,26 +475,24 @@ class Films:
 class Customers:
     """Data-access helpers for the customer table and related analytics."""
 
-    def __init__(self, connection_factory: Callable[[], mysql.connector.MySQLConnection]):
-        self.connection_factory = connection_factory
-
-    def list_customers(self, q: str = None, page: int = 1, page_size: int = 20):
-        """
-        List customers with pagination and search (q).
-        Includes join with address/city/country for display.
-        """
-        offset = (page - 1) * page_size
-        where = []
-        params = []
-
-        if q:
-            like_q = f"%{q}%"
-            where.append("(c.first_name LIKE %s OR c.last_name LIKE %s OR c.email LIKE %s)")
-            params.extend([like_q, like_q, like_q])
-
-        where_clause = ("WHERE " + " AND ".join(where)) if where else ""
-
-        query = f"""
+    # Sort options for scored(); each is backed by an index on customer_score.
+    SCORE_SORTS = {
+        "monetary": "s.monetary DESC",
+        "ltv": "s.ltv DESC",
+        "rfm": "s.rfm_score DESC, s.monetary DESC",
+        "recency": "s.recency_days ASC, s.monetary DESC",
+        "frequency": "s.frequency DESC, s.monetary DESC",
+    }
+    SEGMENTS = ("Champions", "Loyal", "Potential", "New", "At Risk", "Hibernating")
+    # LTV = average spend per active month, projected over this many months.
+    LTV_HORIZON_MONTHS = 12
+
+    _SEARCH = FilterSpec(
+        "customers",
+        filters=[
+            Filter("q", "(c.first_name LIKE %s OR c.last_name LIKE %s OR c.email LIKE %s)", like=True),
+        ],
+        select="""
             SELECT 
                 c.customer_id,
                 c.first_name,
@@ -312,14 +507,25 @@ class Customers:
             LEFT JOIN address a ON c.address_id = a.address_id
             LEFT JOIN city ci ON a.city_id = ci.city_id
             LEFT JOIN country co ON ci.country_id = co.country_id
-            {where_clause}
+            {where}
             ORDER BY c.last_name, c.first_name
             LIMIT %s OFFSET %s
-        """
-        params.extend([page_size, offset])
+        """,
+        count="SELECT COUNT(*) FROM customer c {where}",
+    )
 
+    def __init__(self, connection_factory: Callable[[], mysql.connector.MySQLConnection]):
+        self.connection_factory = connection_factory
+
+    def list_customers(self, q: str = None, page: int = 1, page_size: int = 20):
+        """
+        List customers with pagination and search (q).
+        Includes join with address/city/country for display.
+        """
+        offset = (page - 1) * page_size
+        query = self._SEARCH.compile(dict(q=q))
         with self.connection_factory() as conn, conn.cursor(dictionary=True) as cur:
-            cur.execute(query, params)
+            query.run(cur, page_size, offset)
             return cur.fetchall()
 
     def get(self, customer_id: int):
@@ -355,6 +561,7 @@ class Customers:
         )
         with self.connection_factory() as conn, conn.cursor() as cur:
             cur.execute(sql, params)
+        table_versions.bump("customer")
 
     def update(self, customer_id: int, data: Dict[str, Any]):
         """Update existing customer."""
@@ -373,28 +580,32 @@ class Customers:
         )
         with self.connection_factory() as conn, conn.cursor() as cur:
             cur.execute(sql, params)
+        table_versions.bump("customer")
 
     def delete(self, customer_id: int):
-        """Delete a customer."""
-        # Note: If foreign keys (rentals/payments) exist without CASCADE, this might fail.
+        """Delete a customer. Customers with rentals or payments are kept (ValueError)."""
         sql = "DELETE FROM customer WHERE customer_id = %s"
-        with self.connection_factory() as conn, conn.cursor() as cur:
+        with transaction(self.connection_factory, touches=("customer",)) as cur:
+            _refuse_delete(cur, "customer", "customer_id", customer_id,
+                           [("rental", "customer_id"), ("payment", "customer_id"),
+                            ("rental_archive", "customer_id"), ("payment_archive", "customer_id")])
             cur.execute(sql, (customer_id,))
 
+    @deadline(2000)
     def top_customers_by_payment(self, limit: int = 10):
         """
         Return customers ordered by total payment amount (descending).
         """
-        query = """
+        query = f"""
             SELECT 
                 c.customer_id,
                 c.first_name,
                 c.last_name,
                 c.email,
-                SUM(p.amount) AS total_spent,
-                COUNT(p.payment_id) AS payment_count
+                SUM(p.total_paid) AS total_spent,
+                CAST(SUM(p.payments_count) AS SIGNED) AS payment_count
             FROM customer c
-            JOIN payment p ON p.customer_id = c.customer_id
+            JOIN {_CUSTOMER_PAYMENT_TOTALS} p ON p.customer_id = c.customer_id
             GROUP BY c.customer_id, c.first_name, c.last_name, c.email
             ORDER BY total_spent DESC
             LIMIT %s
@@ -404,24 +615,147 @@ class Customers:
             return cur.fetchall()
         
     def count_search(self, q: str = None) -> int:
-        where = []
-        params = []
+        query = self._SEARCH.compile(dict(q=q))
+        with self.connection_factory() as conn, conn.cursor() as cur:
+            query.run_count(cur)
+            (n,) = cur.fetchone()
+            return int(n)
+        
+    def refresh_scores(self, full: bool = False) -> int:
+        """
+        Recompute RFM scores and LTV for customers queued in customer_score_dirty
+        (or for everyone when full=True). Returns the number of customers rescored.
+        Raw metrics come from one grouped pass over payment (plus rental counts),
+        restricted to the queued customers. Quintile scores depend on every
+        customer, so they are reassigned for the whole table afterwards; that
+        step only reads customer_score.
+        """
+        with transaction(self.connection_factory, touches=("customer_score",)) as cur:
+            cur.execute("SELECT customer_id FROM customer_score_dirty FOR UPDATE")
+            dirty = [row[0] for row in cur.fetchall()]
+            if not dirty and not full:
+                return 0
+
+            if full:
+                scope, params = "", []
+                cur.execute("DELETE FROM customer_score")
+            else:
+                marks = ", ".join(["%s"] * len(dirty))
+                scope, params = f"AND customer_id IN ({marks})", list(dirty) * 2
+                cur.execute(f"DELETE FROM customer_score WHERE customer_id IN ({marks})", dirty)
+
+            # Hot payments plus the archive totals (migration 012), which carry
+            # the archived first/last payment dates for the same purpose.
+            cur.execute(f"""
+                INSERT INTO customer_score
+                    (customer_id, first_payment, last_payment, frequency, monetary, rental_count, ltv)
+                SELECT p.customer_id, MIN(p.first_payment), MAX(p.last_payment),
+                       SUM(p.payments), SUM(p.amount),
+                       (SELECT COUNT(*) FROM rental r WHERE r.customer_id = p.customer_id)
+                         + COALESCE((SELECT t.rental_count FROM customer_archive_total t
+                                     WHERE t.customer_id = p.customer_id), 0),
+                       SUM(p.amount)
+                           / (TIMESTAMPDIFF(MONTH, MIN(p.first_payment), MAX(p.last_payment)) + 1)
+                           * %s
+                FROM (
+                    SELECT customer_id, MIN(payment_date) AS first_payment,
+                           MAX(payment_date) AS last_payment, COUNT(*) AS payments,
+                           SUM(amount) AS amount
+                    FROM payment WHERE TRUE {scope}
+                    GROUP BY customer_id
+                    UNION ALL
+                    SELECT customer_id, first_payment, last_payment, payment_count, payment_total
+                    FROM customer_archive_total WHERE payment_count > 0 {scope}
+                ) p
+                GROUP BY p.customer_id
+            """, [self.LTV_HORIZON_MONTHS] + params)
+            rescored = cur.rowcount
+
+            # Scores are 1-5 by cumulative distribution, so ties share a score.
+            # Recency is measured from the newest payment on record.
+            cur.execute("""
+                UPDATE customer_score s
+                JOIN (
+                    SELECT customer_id,
+                           DATEDIFF(MAX(last_payment) OVER (), last_payment) AS recency_days,
+                           CEIL(CUME_DIST() OVER (ORDER BY last_payment) * 5) AS r,
+                           CEIL(CUME_DIST() OVER (ORDER BY frequency) * 5) AS f,
+                           CEIL(CUME_DIST() OVER (ORDER BY monetary) * 5) AS m
+                    FROM customer_score
+                ) q ON q.customer_id = s.customer_id
+                SET s.recency_days = q.recency_days,
+                    s.r_score = q.r, s.f_score = q.f, s.m_score = q.m,
+                    s.rfm_score = q.r * 100 + q.f * 10 + q.m,
+                    s.segment = CASE
+                        WHEN q.r >= 4 AND q.f >= 4 AND q.m >= 4 THEN 'Champions'
+                        WHEN q.f >= 4 THEN 'Loyal'
+                        WHEN q.r >= 4 AND q.f <= 2 THEN 'New'
+                        WHEN q.r <= 2 AND q.f >= 3 THEN 'At Risk'
+                        WHEN q.r <= 2 THEN 'Hibernating'
+                        ELSE 'Potential'
+                    END
+            """)
 
-        if q:
-            like_q = f"%{q}%"
-            where.append("(c.first_name LIKE %s OR c.last_name LIKE %s OR c.email LIKE %s)")
-            params.extend([like_q, like_q, like_q])
+            if dirty:
+                marks = ", ".join(["%s"] * len(dirty))
+                cur.execute(f"DELETE FROM customer_score_dirty WHERE customer_id IN ({marks})", dirty)
+        return rescored
 
+    def score_status(self) -> dict:
+        """When scores were last written, and how many customers wait for the next run."""
+        with self.connection_factory() as conn, conn.cursor(dictionary=True) as cur:
+            cur.execute("""
+                SELECT (SELECT MAX(scored_at) FROM customer_score) AS scored_at,
+                       (SELECT COUNT(*) FROM customer_score_dirty) AS pending
+            """)
+            return cur.fetchone()
+
+    def scored(self, sort: str = "monetary", segment: str = None,
+               min_r: int = None, min_f: int = None, min_m: int = None, limit: int = 20):
+        """
+        Customers from customer_score, sorted by one of SCORE_SORTS and optionally
+        filtered by segment and minimum R/F/M scores. Rows carry the same
+        customer_name/email/city/country/payments_count/total_paid fields as
+        top_spenders(), plus the score columns.
+        """
+        if sort not in self.SCORE_SORTS:
+            raise ValueError(f"sort must be one of {', '.join(self.SCORE_SORTS)}")
+        where = []
+        params = []
+        if segment:
+            where.append("s.segment = %s")
+            params.append(segment)
+        for column, minimum in (("r_score", min_r), ("f_score", min_f), ("m_score", min_m)):
+            if minimum:
+                where.append(f"s.{column} >= %s")
+                params.append(minimum)
         where_clause = ("WHERE " + " AND ".join(where)) if where else ""
 
-        sql = f"SELECT COUNT(*) FROM customer c {where_clause}"
-        with self.connection_factory() as conn, conn.cursor() as cur:
+        sql = f"""
+            SELECT s.customer_id,
+                   CONCAT(c.first_name, ' ', c.last_name) AS customer_name,
+                   c.email, ci.city, co.country,
+                   s.frequency AS payments_count,
+                   s.monetary AS total_paid,
+                   s.rental_count, s.last_payment, s.recency_days,
+                   s.r_score, s.f_score, s.m_score, s.rfm_score, s.segment, s.ltv
+            FROM customer_score s
+            JOIN customer c ON c.customer_id = s.customer_id
+            JOIN address a  ON a.address_id = c.address_id
+            JOIN city ci    ON ci.city_id = a.city_id
+            JOIN country co ON co.country_id = ci.country_id
+            {where_clause}
+            ORDER BY {self.SCORE_SORTS[sort]}
+            LIMIT %s
+        """
+        params.append(limit)
+        with self.connection_factory() as conn, conn.cursor(dictionary=True) as cur:
             cur.execute(sql, params)
-            (n,) = cur.fetchone()
-            return int(n)
-        
+            return cur.fetchall()
+
+    @deadline(2000)
     def top_spenders(self, limit: int = 20):
-        sql = """
+        sql = f"""
         SELECT c.customer_id,
             CONCAT(c.first_name,' ',c.last_name) AS customer_name,
             c.email,
@@ -435,9 +769,9 @@ class Customers:
         JOIN country co ON co.country_id = ci.country_id
         JOIN (
         SELECT customer_id,
-                SUM(amount) AS total_paid,
-                COUNT(*)    AS payments_count
-        FROM payment
+                SUM(total_paid) AS total_paid,
+                CAST(SUM(payments_count) AS SIGNED) AS payments_count
+        FROM {_CUSTOMER_PAYMENT_TOTALS} p
         GROUP BY customer_id
         ) totals ON totals.customer_id = c.customer_id
         ORDER BY totals.total_paid DESC
@@ -450,38 +784,18 @@ class Customers:
 
 class Addresses:
     """Data-access helpers for the address table."""
-    def __init__(self, connection_factory: Callable[[], mysql.connector.MySQLConnection]):
-        self.connection_factory = connection_factory
 
-    def search(self, address=None, district=None, postal_code=None, phone=None, 
-               city_id=None, country_id=None, page=1, page_size=20):
-        """Search addresses with optional filters"""
-        offset = (page - 1) * page_size
-        where = []
-        params = []
-
-        if address:
-            where.append("a.address LIKE %s")
-            params.append(f"%{address}%")
-        if district:
-            where.append("a.district LIKE %s")
-            params.append(f"%{district}%")
-        if postal_code:
-            where.append("a.postal_code LIKE %s")
-            params.append(f"%{postal_code}%")
-        if phone:
-            where.append("a.phone LIKE %s")
-            params.append(f"%{phone}%")
-        if city_id:
-            where.append("a.city_id = %s")
-            params.append(city_id)
-        if country_id:
-            where.append("co.country_id = %s")
-            params.append(country_id)
-
-        where_clause = ("WHERE " + " AND ".join(where)) if where else ""
-
-        sql = f"""
+    _SEARCH = FilterSpec(
+        "addresses",
+        filters=[
+            Filter("address", "a.address LIKE %s", like=True),
+            Filter("district", "a.district LIKE %s", like=True),
+            Filter("postal_code", "a.postal_code LIKE %s", like=True),
+            Filter("phone", "a.phone LIKE %s", like=True),
+            Filter("city_id", "a.city_id = %s"),
+            Filter("country_id", "c.country_id = %s", joins=["c"]),
+        ],
+        select="""
             SELECT
                 a.address_id, a.address, a.address2, a.district,
                 a.postal_code, a.phone,
@@ -490,14 +804,26 @@ class Addresses:
             FROM address a
             JOIN city c ON a.city_id = c.city_id
             JOIN country co ON c.country_id = co.country_id
-            {where_clause}
+            {where}
             ORDER BY a.address_id ASC
             LIMIT %s OFFSET %s
-        """
-        params += [page_size, offset]
-        
+        """,
+        # city and country are required FKs; the count joins city only to
+        # filter on its country.
+        count="SELECT COUNT(*) FROM address a {joins} {where}",
+        joins={"c": "JOIN city c ON a.city_id = c.city_id"},
+    )
+    def __init__(self, connection_factory: Callable[[], mysql.connector.MySQLConnection]):
+        self.connection_factory = connection_factory
+
+    def search(self, address=None, district=None, postal_code=None, phone=None, 
+               city_id=None, country_id=None, page=1, page_size=20):
+        """Search addresses with optional filters"""
+        offset = (page - 1) * page_size
+        query = self._SEARCH.compile(dict(address=address, district=district, postal_code=postal_code,
+                                          phone=phone, city_id=city_id, country_id=country_id))
         with self.connection_factory() as cn, cn.cursor(dictionary=True) as cur:
-            cur.execute(sql, params)
+            query.run(cur, page_size, offset)
             return cur.fetchall()
 
     def get(self, address_id: int):
@@ -537,6 +863,7 @@ class Addresses:
         )
         with self.connection_factory() as cn, cn.cursor() as cur:
             cur.execute(sql, params)
+        table_versions.bump("address")
 
     def add(self, data: Dict[str, Any]):
         """Add a new address"""
@@ -554,13 +881,16 @@ class Addresses:
         )
         with self.connection_factory() as cn, cn.cursor() as cur:
             cur.execute(sql, params)
+        table_versions.bump("address")
 
     def delete(self, address_id: int):
         """Delete an address"""
         sql = "DELETE FROM address WHERE address_id=%s"
         with self.connection_factory() as cn, cn.cursor() as cur:
             cur.execute(sql, (address_id,))
+        table_versions.bump("address")
 
+    @cached_query("city", "country")
     def get_cities(self, city_id=None, city_name=None, country_name=None, country_id=None):
         """Get cities with optional filters"""
         sql = """
@@ -593,6 +923,7 @@ class Addresses:
             cur.execute(sql, params)
             return cur.fetchall()
 
+    @cached_query("country")
     def get_countries(self, country_id=None, name=None):
         """Get countries with optional filters"""
         sql = "SELECT country_id, country FROM country"
@@ -619,42 +950,13 @@ class Addresses:
     def count_search(self, address=None, district=None, postal_code=None, phone=None, 
                      city_id=None, country_id=None):
         """Count addresses matching search criteria"""
-        where = []
-        params = []
-
-        if address:
-            where.append("a.address LIKE %s")
-            params.append(f"%{address}%")
-        if district:
-            where.append("a.district LIKE %s")
-            params.append(f"%{district}%")
-        if postal_code:
-            where.append("a.postal_code LIKE %s")
-            params.append(f"%{postal_code}%")
-        if phone:
-            where.append("a.phone LIKE %s")
-            params.append(f"%{phone}%")
-        if city_id:
-            where.append("a.city_id = %s")
-            params.append(city_id)
-        if country_id:
-            where.append("co.country_id = %s")
-            params.append(country_id)
-
-        where_clause = ("WHERE " + " AND ".join(where)) if where else ""
-
-        sql = f"""
-            SELECT COUNT(DISTINCT a.address_id)
-            FROM address a
-            JOIN city c ON a.city_id = c.city_id
-            JOIN country co ON c.country_id = co.country_id
-            {where_clause}
-        """
-
+        query = self._SEARCH.compile(dict(address=address, district=district, postal_code=postal_code,
+                                          phone=phone, city_id=city_id, country_id=country_id))
         with self.connection_factory() as cn, cn.cursor() as cur:
-            cur.execute(sql, params)
+            query.run_count(cur)
             return cur.fetchone()[0]
 
+    @deadline(2000)
     def top_countries_by_customers(self, limit: int = 15):
         """
         Top countries by customer count.
@@ -682,20 +984,21 @@ class Addresses:
                 row['rank'] = idx
             return results
 
+    @deadline(2000)
     def top_countries_by_spending(self, limit: int = 15):
         """
         Top countries by total payment amount.
         Returns: rank, country, total_spent
         """
-        sql = """
+        sql = f"""
             SELECT 
                 co.country,
-                SUM(p.amount) AS total_spent
+                SUM(p.total_paid) AS total_spent
             FROM country co
             JOIN city ci ON ci.country_id = co.country_id
             JOIN address a ON a.city_id = ci.city_id
             JOIN customer c ON c.address_id = a.address_id
-            JOIN payment p ON p.customer_id = c.customer_id
+            JOIN {_CUSTOMER_PAYMENT_TOTALS} p ON p.customer_id = c.customer_id
             GROUP BY co.country_id, co.country
             ORDER BY total_spent DESC
             LIMIT %s
@@ -712,91 +1015,124 @@ class Addresses:
 class Payments:
     """Data-access helpers for the payment table."""
 
-    def __init__(self, connection_factory: Callable[[], mysql.connector.MySQLConnection]):
-        self.connection_factory = connection_factory
-
-    def search(self, q=None, payment_method=None, sort_order="desc", page=1, per_page=10):
-        """
-        Searches payments and returns both the results (rows) AND the total count.
-        """
-        offset = (page - 1) * per_page
-        params = []
-        conditions = []
-
-        # --- PART 1: Build the WHERE Clause ---
-        # We build the conditions once so we can use them for both counting and fetching data.
-        
-        # Base query part
-        base_query = """
-            FROM payment p
-            JOIN customer c ON p.customer_id = c.customer_id
-            WHERE 1=1
-        """
-
-        # Search Conditions
-        if q:
-            conditions.append("""
+    _TOUCHES = ("payment", "payment_daily_rollup")
+
+    # Adds (sign=1) or removes (sign=-1) one payment's contribution to its
+    # payment_daily_rollup bucket. Runs inside the payment write's transaction.
+    _ROLLUP_SQL = """
+        INSERT INTO payment_daily_rollup (day, payment_method, country_id, total, payment_count)
+        SELECT DATE(p.payment_date), COALESCE(p.payment_method, ''), COALESCE(ci.country_id, 0),
+               %s * p.amount, %s
+        FROM payment p
+        LEFT JOIN customer c ON c.customer_id = p.customer_id
+        LEFT JOIN address a ON a.address_id = c.address_id
+        LEFT JOIN city ci ON ci.city_id = a.city_id
+        WHERE p.payment_id = %s
+        ON DUPLICATE KEY UPDATE total = total + VALUES(total),
+                                payment_count = payment_count + VALUES(payment_count)
+    """
+
+    # Queues the payment's customer for Customers.refresh_scores().
+    _SCORE_DIRTY_SQL = """
+        INSERT IGNORE INTO customer_score_dirty (customer_id)
+        SELECT customer_id FROM payment WHERE payment_id = %s
+    """
+
+    # Bucket start for each granularity, computed from payment_daily_rollup.day.
+    GRANULARITIES = {
+        "day": "day",
+        "week": "DATE_SUB(day, INTERVAL WEEKDAY(day) DAY)",
+        "month": "DATE_SUB(day, INTERVAL (DAYOFMONTH(day) - 1) DAY)",
+        "quarter": "MAKEDATE(YEAR(day), 1) + INTERVAL (QUARTER(day) - 1) QUARTER",
+    }
+
+    _SEARCH = FilterSpec(
+        "payments",
+        filters=[
+            Filter("q", """
                 (CAST(p.payment_id AS CHAR) LIKE %s OR 
                  CAST(p.amount AS CHAR) LIKE %s OR 
                  c.first_name LIKE %s OR 
                  c.last_name LIKE %s)
-            """)
-            term = f"%{q}%"
-            params.extend([term, term, term, term])
-
-        # Filter Conditions
-        if payment_method:
-            conditions.append("p.payment_method = %s")
-            params.append(payment_method)
-
-        # Add conditions to base query
-        if conditions:
-            base_query += " AND " + " AND ".join(conditions)
-
-        # --- PART 2: Get Total Count ---
-        # We need to know the total number of matching records to calculate total pages.
-        count_sql = "SELECT COUNT(*) as total " + base_query
-        
-        # --- PART 3: Get the Data ---
-        data_sql = """
+            """, like=True, joins=["c"]),
+            Filter("payment_method", "p.payment_method = %s"),
+            # Date bounds let MySQL prune the monthly partitions (migration 009).
+            Filter("since", "p.payment_date >= %s"),
+            Filter("until", "p.payment_date < %s"),
+        ],
+        select="""
             SELECT 
                 p.payment_id, p.customer_id, p.rental_id, 
                 p.amount, p.payment_date, p.last_update, p.payment_method,
                 c.first_name, c.last_name
-        """ + base_query
+            FROM {payment} p
+            JOIN customer c ON p.customer_id = c.customer_id
+            {where}
+            ORDER BY p.payment_date {order}
+            LIMIT %s OFFSET %s
+        """,
+        # Every payment has a customer; joined only to search on the name.
+        count="SELECT COUNT(*) AS total FROM {payment} p {joins} {where}",
+        joins={"c": "JOIN customer c ON p.customer_id = c.customer_id"},
+    )
 
-        # Sorting
-        order_dir = "ASC" if sort_order == "asc" else "DESC"
-        data_sql += f" ORDER BY p.payment_date {order_dir}"
+    def __init__(self, connection_factory: Callable[[], mysql.connector.MySQLConnection]):
+        self.connection_factory = connection_factory
 
-        # Pagination
-        data_sql += " LIMIT %s OFFSET %s"
-        # We need a copy of params for the data query because we append limit/offset
-        data_params = params.copy() 
-        data_params.extend([per_page, offset])
+    @deadline(1500)
+    def search(self, q=None, payment_method=None, sort_order="desc", page=1, per_page=10,
+               since=None, until=None):
+        """
+        Searches payments and returns both the results (rows) AND the total count.
+        since/until bound payment_date (until is exclusive).
+        """
+        offset = (page - 1) * per_page
+        order_dir = "ASC" if sort_order == "asc" else "DESC"
+        source = _PAYMENT_ALL if _reaches_archive(since, self.archived_before()) else "payment"
+        query = self._SEARCH.compile(dict(q=q, payment_method=payment_method, since=since,
+                                          until=until), order=order_dir, payment=source)
 
         with self.connection_factory() as cn, cn.cursor(dictionary=True) as cur:
-            # 1. Run Count Query
-            # Note: For COUNT, we use 'params' (without limit/offset)
-            # We use a non-dictionary cursor for count usually, but dictionary works too (returns {'total': 123})
-            cur.execute(count_sql, params)
+            query.run_count(cur)
             total_count = cur.fetchone()['total']
 
-            # 2. Run Data Query
-            cur.execute(data_sql, data_params)
+            query.run(cur, per_page, offset)
             rows = cur.fetchall()
-        
+
         # Return both the rows and the total count
         return rows, total_count
 
+    @cached_query("payment")
+    def latest_date(self):
+        """Newest payment_date (index lookup); anchors the default date window."""
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            cur.execute("SELECT MAX(payment_date) FROM payment")
+            return cur.fetchone()[0]
+
+    @cached_query("archive_state", ttl=30)
+    def archived_before(self):
+        """Payments dated before this may be in payment_archive (None: none archived)."""
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            return _archived_before(cur, "payment")
+
     def get(self, payment_id: int):
-        """Get a single payment detail."""
+        """Get a single payment detail (from the archive when it has moved there)."""
         sql = "SELECT * FROM payment WHERE payment_id = %s"
         with self.connection_factory() as conn, conn.cursor(dictionary=True) as cur:
             cur.execute(sql, (payment_id,))
             row = cur.fetchone()
+            if row is None:
+                row = self._get_archived(cur, payment_id)
             return row
 
+    @staticmethod
+    def _get_archived(cur, payment_id):
+        cur.execute("SELECT * FROM payment_archive WHERE payment_id = %s", (payment_id,))
+        row = cur.fetchone()
+        if row is not None:
+            row["archived"] = True
+        return row
+
     def get_payment_details(self, payment_id):
         """
         Fetches payment and customers. 
@@ -806,6 +1142,8 @@ class Payments:
             # 1. Fetch the specific payment record
             cur.execute("SELECT * FROM payment WHERE payment_id = %s", (payment_id,))
             payment = cur.fetchone()
+            if payment is None:
+                payment = self._get_archived(cur, payment_id)
 
             # 2. Fetch all customers for the dropdown
             cur.execute("SELECT customer_id, CONCAT(first_name, ' ', last_name) as full_name FROM customer ORDER BY first_name")
@@ -839,9 +1177,14 @@ class Payments:
             payment_id
         )
 
-        with self.connection_factory() as cn, cn.cursor() as cur:
+        with transaction(self.connection_factory, touches=self._TOUCHES) as cur:
+            _require_hot(cur, "payment", "payment_id", payment_id)
+            _require(cur, "customer", "customer_id", data['customer_id'])
+            cur.execute(self._ROLLUP_SQL, (-1, -1, payment_id))
+            cur.execute(self._SCORE_DIRTY_SQL, (payment_id,))
             cur.execute(sql, params)
-            cn.commit()
+            cur.execute(self._ROLLUP_SQL, (1, 1, payment_id))
+            cur.execute(self._SCORE_DIRTY_SQL, (payment_id,))
 
     def delete_payment(self, payment_id):
         """
@@ -849,10 +1192,13 @@ class Payments:
         """
         sql = "DELETE FROM payment WHERE payment_id = %s"
         
-        with self.connection_factory() as cn, cn.cursor() as cur:
+        with transaction(self.connection_factory, touches=self._TOUCHES) as cur:
+            _require_hot(cur, "payment", "payment_id", payment_id)
+            cur.execute(self._ROLLUP_SQL, (-1, -1, payment_id))
+            cur.execute(self._SCORE_DIRTY_SQL, (payment_id,))
             cur.execute(sql, (payment_id,))
-            cn.commit()
 
+    @cached_query("customer")
     def get_all_customers(self):
         """
         Fetches all customers to populate the dropdown menu in the Add Page.
@@ -883,137 +1229,324 @@ class Payments:
             data['payment_method']
         )
 
-        with self.connection_factory() as cn, cn.cursor() as cur:
+        with transaction(self.connection_factory, touches=self._TOUCHES) as cur:
+            _require(cur, "customer", "customer_id", data['customer_id'])
             cur.execute(sql, params)
-            cn.commit()
+            payment_id = cur.lastrowid
+            cur.execute(self._ROLLUP_SQL, (1, 1, payment_id))
+            cur.execute(self._SCORE_DIRTY_SQL, (payment_id,))
 
-    def get_analytics(self):
+    @staticmethod
+    def _rollup_filters(start=None, end=None, payment_method=None, country_id=None):
+        where = []
+        params = []
+        if start:
+            where.append("day >= %s")
+            params.append(start)
+        if end:
+            where.append("day <= %s")
+            params.append(end)
+        if payment_method:
+            where.append("payment_method = %s")
+            params.append(payment_method)
+        if country_id:
+            where.append("country_id = %s")
+            params.append(country_id)
+        return ("WHERE " + " AND ".join(where)) if where else "", params
+
+    @deadline(1000)
+    def revenue_series(self, granularity="month", start=None, end=None,
+                       payment_method=None, country_id=None, newest_first=True):
         """
-        Runs queries for the analytics dashboard.
-        Returns: Monthly Revenue and Payment Method Stats.
+        Revenue per day/week/month/quarter over an optional date range (inclusive),
+        optionally for one payment method and/or customer country.
+        Sums payment_daily_rollup rows, so cost grows with the number of days in
+        range, not the number of payments.
+        Returns rows with period_start (date), label, total, payment_count.
         """
-        with self.connection_factory() as cn, cn.cursor(dictionary=True) as cur:
-            
-            # 1. Monthly Revenue Trends
-            sql_monthly = """
-                SELECT DATE_FORMAT(payment_date, '%Y-%m') as month_year, SUM(amount) as total
-                FROM payment
-                GROUP BY month_year
-                ORDER BY month_year DESC
-                LIMIT 10
-            """
-            cur.execute(sql_monthly)
-            monthly_revenue = cur.fetchall()
-
-            # 2. Stats by Payment Method
-            sql_methods = """
-                SELECT payment_method, COUNT(*) as usage_count, SUM(amount) as total
-                FROM payment
-                GROUP BY payment_method
-                ORDER BY total DESC
-            """
-            cur.execute(sql_methods)
-            payment_methods_stats = cur.fetchall()
+        if granularity not in self.GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(self.GRANULARITIES)}")
+        bucket = self.GRANULARITIES[granularity]
+        where_clause, params = self._rollup_filters(start, end, payment_method, country_id)
 
-            return monthly_revenue, payment_methods_stats
+        sql = f"""
+            SELECT {bucket} AS period_start,
+                   SUM(total) AS total,
+                   SUM(payment_count) AS payment_count
+            FROM payment_daily_rollup
+            {where_clause}
+            GROUP BY period_start
+            HAVING SUM(payment_count) <> 0
+            ORDER BY period_start {"DESC" if newest_first else "ASC"}
+        """
+        with self.connection_factory() as cn, cn.cursor(dictionary=True) as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
 
-class Rentals:
-    """Data-access helpers for the rental table."""
-    def __init__(self, connection_factory: Callable[[], mysql.connector.MySQLConnection]):
-        self.connection_factory = connection_factory
+        for row in rows:
+            d = row["period_start"]
+            if granularity == "month":
+                row["label"] = d.strftime("%Y-%m")
+            elif granularity == "quarter":
+                row["label"] = f"{d.year} Q{(d.month - 1) // 3 + 1}"
+            elif granularity == "week":
+                row["label"] = f"Week of {d.isoformat()}"
+            else:
+                row["label"] = d.isoformat()
+        return rows
+
+    @deadline(1000)
+    def method_stats(self, start=None, end=None, country_id=None):
+        """Payment count and volume per payment method, from the daily rollup."""
+        where_clause, params = self._rollup_filters(start, end, None, country_id)
+        sql = f"""
+            SELECT NULLIF(payment_method, '') AS payment_method,
+                   SUM(payment_count) AS usage_count,
+                   SUM(total) AS total
+            FROM payment_daily_rollup
+            {where_clause}
+            GROUP BY payment_method
+            HAVING SUM(payment_count) <> 0
+            ORDER BY total DESC
+        """
+        with self.connection_factory() as cn, cn.cursor(dictionary=True) as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
 
-    def search(self, q=None, status=None, page=1, page_size=20):
+    def get_analytics(self):
         """
-        Searching in Rental Tables.
-        status: 'returned', 'not_returned' or None
-        q: Customer name or film name search
+        Runs queries for the analytics dashboard.
+        Returns: Monthly Revenue (last 10 months) and Payment Method Stats.
         """
-        offset = (page - 1) * page_size
-        where = []
-        params = []
-
-
-        if status == 'not_returned':
-            where.append("r.return_date IS NULL")
-        elif status == 'returned':
-            where.append("r.return_date IS NOT NULL")
+        monthly_revenue = [
+            {"month_year": row["label"], "total": row["total"]}
+            for row in self.revenue_series("month")[:10]
+        ]
+        return monthly_revenue, self.method_stats()
 
-        if q:
-            like_q = f"%{q}%"
-            where.append("(CONCAT(c.first_name, ' ', c.last_name) LIKE %s OR f.title LIKE %s)")
-            params.extend([like_q, like_q])
-
-        where_clause = ("WHERE " + " AND ".join(where)) if where else ""
+class Rentals:
+    """Data-access helpers for the rental table."""
 
-        sql = f"""
+    _SEARCH = FilterSpec(
+        "rentals",
+        filters=[
+            Filter("status", {
+                "not_returned": "r.return_date IS NULL",
+                "returned": "r.return_date IS NOT NULL",
+                "overdue": "r.return_date IS NULL AND r.due_date < NOW()",
+            }),
+            Filter("q", "(CONCAT(c.first_name, ' ', c.last_name) LIKE %s OR f.title LIKE %s)",
+                   like=True, joins=["c", "f"]),
+            # Date bounds let MySQL prune the monthly partitions (migration 009).
+            Filter("since", "r.rental_date >= %s"),
+            Filter("until", "r.rental_date < %s"),
+        ],
+        select="""
             SELECT 
-                r.rental_id, r.rental_date, r.return_date,
+                r.rental_id, r.rental_date, r.return_date, r.due_date,
+                (r.return_date IS NULL AND r.due_date < NOW()) AS overdue,
                 c.customer_id, c.first_name, c.last_name,
                 f.film_id, f.title
-            FROM rental r
+            FROM {rental} r
             JOIN customer c ON r.customer_id = c.customer_id
             JOIN film f ON r.film_id = f.film_id
-            {where_clause}
+            {where}
             ORDER BY r.rental_date DESC
             LIMIT %s OFFSET %s
-        """
-        params.extend([page_size, offset])
+        """,
+        # Every rental has a customer and a film; joined only to search on names.
+        count="SELECT COUNT(*) FROM {rental} r {joins} {where}",
+        joins={"c": "JOIN customer c ON r.customer_id = c.customer_id",
+               "f": "JOIN film f ON r.film_id = f.film_id"},
+    )
 
+    def __init__(self, connection_factory: Callable[[], mysql.connector.MySQLConnection]):
+        self.connection_factory = connection_factory
+
+    @deadline(1500)
+    def search(self, q=None, status=None, page=1, page_size=20, since=None, until=None):
+        """
+        Searching in Rental Tables.
+        status: 'returned', 'not_returned', 'overdue' or None
+        q: Customer name or film name search
+        since/until: rental_date bounds (until is exclusive)
+        """
+        offset = (page - 1) * page_size
+        query = self._compile_search(q, status, since, until)
         with self.connection_factory() as cn, cn.cursor() as cur:
-            cur.execute(sql, params)
+            query.run(cur, page_size, offset)
             return _dict_rows(cur)
 
+    def _compile_search(self, q, status, since, until):
+        # Open rentals are never archived, so those views stay on the hot table.
+        archived = (status not in ("not_returned", "overdue")
+                    and _reaches_archive(since, self.archived_before()))
+        return self._SEARCH.compile(dict(q=q, status=status, since=since, until=until),
+                                    rental=_RENTAL_ALL if archived else "rental")
+
+    @cached_query("rental")
+    def latest_date(self):
+        """Newest rental_date (index lookup); anchors the default date window."""
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            cur.execute("SELECT MAX(rental_date) FROM rental")
+            return cur.fetchone()[0]
+
+    @cached_query("archive_state", ttl=30)
+    def archived_before(self):
+        """Rentals dated before this may be in rental_archive (None: none archived)."""
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            return _archived_before(cur, "rental")
+
     def get(self, rental_id: int):
+        """A rental with customer name and film title, from the archive when it has moved there."""
         sql = """
             SELECT 
                 r.*,
                 c.first_name, c.last_name,
                 f.title
-            FROM rental r
+            FROM {table} r
             JOIN customer c ON r.customer_id = c.customer_id
             JOIN film f ON r.film_id = f.film_id
             WHERE r.rental_id = %s
         """
         with self.connection_factory() as cn, cn.cursor() as cur:
-            cur.execute(sql, (rental_id,))
+            cur.execute(sql.format(table="rental"), (rental_id,))
             rows = _dict_rows(cur)
+            if rows:
+                return rows[0]
+            cur.execute(sql.format(table="rental_archive"), (rental_id,))
+            rows = _dict_rows(cur)
+            for row in rows:
+                row["archived"] = True
             return rows[0] if rows else None
 
+    # Copies a rental row into open_rentals. The PRIMARY KEY on open_rentals.film_id
+    # rejects a second open rental of the same film, even under concurrent requests.
+    _OPEN_SQL = """
+        INSERT INTO open_rentals (film_id, rental_id, customer_id, rental_date)
+        SELECT film_id, rental_id, customer_id, rental_date
+        FROM rental
+        WHERE rental_id = %s
+    """
+    _SCORE_DIRTY_SQL = """
+        INSERT IGNORE INTO customer_score_dirty (customer_id)
+        SELECT customer_id FROM rental WHERE rental_id = %s
+    """
+    # Added to the rental date to get the due date (the film's rental_duration).
+    _LOAN_PERIOD_SQL = "INTERVAL (SELECT rental_duration FROM film WHERE film_id = %s) DAY"
+    # Late fee per started day overdue, capped at the film's replacement cost.
+    LATE_FEE_PER_DAY = 1.00
+    _ALREADY_RENTED = "Bu film şu an başka bir müşteride kirada ve henüz iade edilmedi."
+    _TOUCHES = ("rental", "open_rentals")
+
+    def is_available(self, film_id: int) -> bool:
+        with self.connection_factory() as cn, cn.cursor() as cur:
+            cur.execute("SELECT 1 FROM open_rentals WHERE film_id = %s", (film_id,))
+            return cur.fetchone() is None
+
     def add(self, customer_id, film_id):
-        
-        check_sql = "SELECT 1 FROM rental WHERE film_id = %s AND return_date IS NULL"
-        
-        insert_sql = """
-            INSERT INTO rental (rental_date, film_id, customer_id)
-            VALUES (NOW(), %s, %s)
+        insert_sql = f"""
+            INSERT INTO rental (rental_date, film_id, customer_id, due_date)
+            VALUES (NOW(), %s, %s, NOW() + {self._LOAN_PERIOD_SQL})
         """
         
-        with self.connection_factory() as cn, cn.cursor() as cur:
-            cur.execute(check_sql, (film_id,))
-            if cur.fetchone():
-                raise ValueError("Bu film şu an başka bir müşteride kirada ve henüz iade edilmedi.")
-            
-            cur.execute(insert_sql, (film_id, customer_id))
+        try:
+            with transaction(self.connection_factory, touches=self._TOUCHES) as cur:
+                _require(cur, "customer", "customer_id", customer_id)
+                _require(cur, "film", "film_id", film_id)
+                cur.execute(insert_sql, (film_id, customer_id, film_id))
+                rental_id = cur.lastrowid
+                cur.execute(self._OPEN_SQL, (rental_id,))
+                cur.execute(self._SCORE_DIRTY_SQL, (rental_id,))
+        except mysql.connector.IntegrityError as e:
+            if e.errno == errorcode.ER_DUP_ENTRY:
+                raise ValueError(self._ALREADY_RENTED)
+            raise
 
     def return_film(self, rental_id):
         """Return film"""
         sql = """
             UPDATE rental
             SET return_date = NOW()
-            WHERE rental_id = %s
+            WHERE rental_id = %s AND return_date IS NULL
         """
-        with self.connection_factory() as cn, cn.cursor() as cur:
-
+        with transaction(self.connection_factory, touches=self._TOUCHES) as cur:
             cur.execute(sql, (rental_id,))
+            cur.execute("DELETE FROM open_rentals WHERE rental_id = %s", (rental_id,))
     
-    def top_rented_films(self, limit=10):
+    def assess_late_fees(self) -> int:
+        """
+        Insert or refresh the late fee of every overdue rental in one
+        INSERT ... SELECT (overdue rentals are a range on idx_rental_open_due).
+        Fees of rentals returned since the last run stay as they were. A fee
+        that grew since the customer was notified is marked pending again, so
+        the next notice carries the new amount.
+        Returns the number of overdue rentals assessed.
+        """
+        # notified_at is assigned before fee, so it compares against the old fee.
         sql = """
+            INSERT INTO late_fee (rental_id, customer_id, days_overdue, fee)
+            SELECT r.rental_id, r.customer_id,
+                   TIMESTAMPDIFF(DAY, r.due_date, NOW()) + 1,
+                   LEAST((TIMESTAMPDIFF(DAY, r.due_date, NOW()) + 1) * %s, f.replacement_cost)
+            FROM rental r
+            JOIN film f ON f.film_id = r.film_id
+            WHERE r.return_date IS NULL AND r.due_date < NOW()
+            ON DUPLICATE KEY UPDATE customer_id = VALUES(customer_id),
+                                    days_overdue = VALUES(days_overdue),
+                                    notified_at = IF(VALUES(fee) > fee, NULL, notified_at),
+                                    fee = VALUES(fee)
+        """
+        with transaction(self.connection_factory, touches=("late_fee",)) as cur:
+            cur.execute("SELECT COUNT(*) FROM rental WHERE return_date IS NULL AND due_date < NOW()")
+            (overdue,) = cur.fetchone()
+            cur.execute(sql, (self.LATE_FEE_PER_DAY,))
+        return int(overdue)
+
+    def pending_late_notices(self, customers=500, after=0):
+        """
+        Every late fee nobody was told about yet, for the first `customers`
+        customers with such fees after customer_id `after`, ordered by customer.
+        """
+        sql = """
+            SELECT lf.rental_id, lf.customer_id, lf.days_overdue, lf.fee,
+                   c.first_name, c.last_name, c.email,
+                   f.title, COALESCE(r.due_date, ra.due_date) AS due_date
+            FROM (
+                SELECT DISTINCT customer_id FROM late_fee
+                WHERE notified_at IS NULL AND customer_id > %s
+                ORDER BY customer_id
+                LIMIT %s
+            ) pending
+            JOIN late_fee lf ON lf.customer_id = pending.customer_id AND lf.notified_at IS NULL
+            -- A fee outlives its rental's move to the archive (returned rentals only).
+            LEFT JOIN rental r          ON r.rental_id = lf.rental_id
+            LEFT JOIN rental_archive ra ON ra.rental_id = lf.rental_id
+            JOIN customer c ON c.customer_id = lf.customer_id
+            JOIN film f     ON f.film_id = COALESCE(r.film_id, ra.film_id)
+            ORDER BY lf.customer_id, lf.rental_id
+        """
+        with self.connection_factory() as cn, cn.cursor(dictionary=True) as cur:
+            cur.execute(sql, (after, customers))
+            return cur.fetchall()
+
+    def mark_notified(self, rental_ids: Iterable[int]):
+        ids = list(rental_ids)
+        if not ids:
+            return
+        marks = ", ".join(["%s"] * len(ids))
+        with transaction(self.connection_factory, touches=("late_fee",)) as cur:
+            cur.execute(f"UPDATE late_fee SET notified_at = NOW() WHERE rental_id IN ({marks})", ids)
+
+    @deadline(2000)
+    def top_rented_films(self, limit=10):
+        sql = f"""
             SELECT 
                 f.film_id, 
                 f.title, 
-                COUNT(r.rental_id) AS rental_count
+                CAST(SUM(r.rental_count) AS SIGNED) AS rental_count
             FROM film f
-            JOIN rental r ON f.film_id = r.film_id
+            JOIN {_FILM_RENTAL_TOTALS} r ON f.film_id = r.film_id
             GROUP BY f.film_id, f.title
             ORDER BY rental_count DESC
             LIMIT %s
@@ -1023,48 +1556,46 @@ class Rentals:
             return _dict_rows(cur)
 
     def update(self, rental_id: int, data: dict):
-        sql = """
+        sql = f"""
             UPDATE rental 
-            SET rental_date = %s, return_date = %s, film_id = %s, customer_id = %s
+            SET rental_date = %s, return_date = %s, film_id = %s, customer_id = %s,
+                due_date = %s + {self._LOAN_PERIOD_SQL}
             WHERE rental_id = %s
         """
         ret_date = data.get("return_date") if data.get("return_date") else None
         
-        params = (data.get("rental_date"), ret_date, data.get("film_id"), data.get("customer_id"), rental_id)
-        with self.connection_factory() as cn, cn.cursor() as cur:
-            cur.execute(sql, params)
+        params = (data.get("rental_date"), ret_date, data.get("film_id"), data.get("customer_id"),
+                  data.get("rental_date"), data.get("film_id"), rental_id)
+        try:
+            with transaction(self.connection_factory, touches=self._TOUCHES) as cur:
+                _require_hot(cur, "rental", "rental_id", rental_id)
+                _require(cur, "customer", "customer_id", data.get("customer_id"))
+                _require(cur, "film", "film_id", data.get("film_id"))
+                cur.execute(self._SCORE_DIRTY_SQL, (rental_id,))
+                cur.execute(sql, params)
+                cur.execute(self._SCORE_DIRTY_SQL, (rental_id,))
+                # Film, dates or return state may have changed: rebuild this rental's slot.
+                cur.execute("DELETE FROM open_rentals WHERE rental_id = %s", (rental_id,))
+                if ret_date is None:
+                    cur.execute(self._OPEN_SQL, (rental_id,))
+        except mysql.connector.IntegrityError as e:
+            if e.errno == errorcode.ER_DUP_ENTRY:
+                raise ValueError(self._ALREADY_RENTED)
+            raise
 
     def delete(self, rental_id: int):
-        sql = "DELETE FROM rental WHERE rental_id = %s"
-        with self.connection_factory() as cn, cn.cursor() as cur:
-            cur.execute(sql, (rental_id,))
-
-    def count_search(self, q=None, status=None) -> int:
-        where = []
-        params = []
-
-        if status == 'not_returned':
-            where.append("r.return_date IS NULL")
-        elif status == 'returned':
-            where.append("r.return_date IS NOT NULL")
-
-        if q:
-            like_q = f"%{q}%"
-            where.append("(CONCAT(c.first_name, ' ', c.last_name) LIKE %s OR f.title LIKE %s)")
-            params.extend([like_q, like_q])
-
-        where_clause = ("WHERE " + " AND ".join(where)) if where else ""
-
-        sql = f"""
-            SELECT COUNT(*) 
-            FROM rental r
-            JOIN customer c ON r.customer_id = c.customer_id
-            JOIN film f ON r.film_id = f.film_id
-            {where_clause}
-        """
-
+        with transaction(self.connection_factory, touches=self._TOUCHES + ("payment",)) as cur:
+            _require_hot(cur, "rental", "rental_id", rental_id)
+            cur.execute("DELETE FROM open_rentals WHERE rental_id = %s", (rental_id,))
+            cur.execute("UPDATE payment SET rental_id = NULL WHERE rental_id = %s", (rental_id,))
+            cur.execute(self._SCORE_DIRTY_SQL, (rental_id,))
+            cur.execute("DELETE FROM rental WHERE rental_id = %s", (rental_id,))
+
+    @deadline(1000, fallback=_unknown_count)
+    def count_search(self, q=None, status=None, since=None, until=None) -> int:
+        query = self._compile_search(q, status, since, until)
         with self.connection_factory() as cn, cn.cursor() as cur:
-            cur.execute(sql, params)
+            query.run_count(cur)
             (n,) = cur.fetchone()
             return int(n)
 
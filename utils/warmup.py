@@ -0,0 +1,87 @@
+"""
+Cache warm-up at process start.
+
+A fresh worker has empty in-process caches (lookup lists, rendered
+dashboards) and MySQL may have a cold buffer pool after a deploy. Warmup
+runs a list of data-access calls and then requests a list of hot routes
+through the app itself (Flask test client, no network), which fills the
+@cached_query lookups, the server-side page cache and the database's own
+caches before real visitors arrive.
+
+/readyz (and /health) answer 503 until the warm-up has finished, so a load balancer keeps
+the worker out of rotation while it is cold. A failed step is recorded and
+skipped; it does not keep the worker cold forever. Running again later (the
+cache-warm job, utils/jobs.py) refreshes the caches without taking a warm
+worker out of rotation.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+COLD, WARMING, WARM = "cold", "warming", "warm"
+
+
+class Warmup:
+    def __init__(self, app, routes: Iterable[str] = (),
+                 calls: Iterable[Tuple[str, Callable[[], object]]] = ()):
+        self.app = app
+        self.routes: List[str] = list(routes)
+        self.calls = list(calls)
+        self.state = COLD
+        self.errors: List[str] = []
+        self.started_at: Optional[float] = None
+        self.duration: Optional[float] = None
+        self.done = 0
+
+    @property
+    def total(self):
+        return len(self.calls) + len(self.routes)
+
+    @property
+    def is_warm(self):
+        return self.state == WARM
+
+    def run(self):
+        """Run every call and route once, in order. Safe to call again (re-warm)."""
+        if self.state != WARM:
+            self.state = WARMING
+        self.errors, self.done = [], 0
+        self.started_at = time.monotonic()
+        logger.info("warm-up started: %d step(s)", self.total)
+
+        for label, call in self.calls:
+            try:
+                call()
+            except Exception as e:
+                self.errors.append(f"{label}: {e}")
+            self.done += 1
+
+        client = self.app.test_client()
+        for route in self.routes:
+            try:
+                response = client.get(route)
+                response.get_data()   # drain streamed pages
+                if response.status_code >= 400:
+                    self.errors.append(f"{route}: HTTP {response.status_code}")
+            except Exception as e:
+                self.errors.append(f"{route}: {e}")
+            self.done += 1
+
+        self.duration = time.monotonic() - self.started_at
+        self.state = WARM
+        for error in self.errors:
+            logger.warning("warm-up: %s", error)
+        logger.info("warm-up finished: %s", self.describe())
+
+    def start(self):
+        """Warm up in a background thread so the server can start listening."""
+        threading.Thread(target=self.run, name="warmup", daemon=True).start()
+
+    def describe(self):
+        if self.state == WARM:
+            errors = f", {len(self.errors)} error(s)" if self.errors else ""
+            return f"warm ({self.total} steps in {self.duration:.1f}s{errors})"
+        return f"{self.state} ({self.done}/{self.total})"